@@ -0,0 +1,613 @@
+"""
+agent_pool.py - Agentes keep-alive: uma VM atende muitas requisicoes
+
+No modo normal o inittab roda o handler uma vez e a VM desliga
+(reboot=k panic=1): toda invocacao paga boot do kernel, init e o import
+do handler. No modo agente (nano_lambda.mode=agent no cmdline) o
+/agent-runner.py do guest importa o handler uma vez, escuta no vsock
+(porta AGENT_PORT) e atende requisicoes em loop, como o container
+"quente" do Lambda.
+
+Protocolo (uma conexao persistente do host por agente, aberta pelo
+socket Unix do vsock com "CONNECT <porta>\\n"):
+
+    host -> guest   HEADER(KIND_JSON, tamanho) + {"input": "..."}
+    guest -> host   HEADER(KIND_ITEM, tamanho) + ITEM_HEADER + cabecalho
+                    JSON + dados crus (mesmo formato do lote, ver
+                    decode_item em result_channel.py)
+
+    host -> guest   HEADER(KIND_JSON, tamanho) + {"ping": true}
+    guest -> host   HEADER(KIND_ITEM, 0)        (keepalive, ver abaixo)
+
+O AgentPool guarda os agentes ociosos por funcao. Uma requisicao vai
+para um agente vivo da funcao; sem nenhum, e havendo vaga, boota um
+agente novo; sem vaga, devolve None e o NanoLambda boota uma VM avulsa.
+Agentes ociosos ha mais de `idle_ttl` sao despejados e um agente que
+atendeu `max_requests` requisicoes e reciclado (estado acumulado do
+handler, vazamento de memoria). O guest desliga sozinho depois de
+2 x idle_ttl sem requisicao (o host sumiu): um agente que a reserva do
+autoscaler segura ocioso recebe um keepalive a cada idle_ttl.
+
+Com `balloon_idle` (balloon.py) o agente ocioso ha esse tempo infla o
+balao de memoria e devolve ao host o que o guest nao usa; o lease
+desinfla antes da requisicao. memory() soma reserva, balao e RSS dos
+agentes para a contabilidade de memoria do host.
+
+Uso:
+    agents = AgentPool(lambda vm_id: NanoLambda(vm_id=vm_id), max_agents=4)
+    agents.start()
+    resultado = agents.invoke("handler.py", "input")   # None = sem vaga
+    print(agents.stats())
+    agents.close()
+"""
+
+import collections
+import itertools
+import json
+import select
+import socket
+import threading
+import time
+
+from result_channel import HEADER, ITEM_HEADER, KIND_ITEM, KIND_JSON, decode_item
+
+AGENT_PORT = 10001
+CONNECT_TIMEOUT = 5.0
+
+
+class AgentConnection:
+    """Conexao persistente do host com o agente de uma VM (vsock)."""
+
+    def __init__(self, uds_path, port=AGENT_PORT):
+        self.uds_path = uds_path
+        self.port = port
+        self.sock = None
+        self._file = None
+
+    def connect(self, timeout=CONNECT_TIMEOUT):
+        """
+        Abre a conexao pelo socket do vsock. O Firecracker fecha a
+        conexao se ninguem escuta na porta do guest: tenta de novo ate
+        o `timeout`.
+        """
+        deadline = time.time() + timeout
+        delay = 0.001
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(max(deadline - time.time(), 0.1))
+                sock.connect(self.uds_path)
+                sock.sendall(f"CONNECT {self.port}\n".encode())
+                reply = sock.makefile("rb").readline()
+                if reply.startswith(b"OK "):
+                    self.sock = sock
+                    self._file = sock.makefile("rb")
+                    return self
+            except OSError:
+                pass
+            sock.close()
+            if time.time() >= deadline:
+                raise Exception(f"Agente nao aceitou conexao na porta {self.port}")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def _read(self, size):
+        data = self._file.read(size)
+        if data is None or len(data) < size:
+            raise ConnectionError("agente fechou a conexao")
+        return data
+
+    def request(self, input_data, timeout):
+        """Manda um input e espera o item de resposta (formato do decode_item)."""
+        payload = json.dumps({"input": input_data}).encode("utf-8")
+        self.sock.settimeout(timeout)
+        self.sock.sendall(HEADER.pack(KIND_JSON, len(payload)) + payload)
+        kind, size = HEADER.unpack(self._read(HEADER.size))
+        if kind != KIND_ITEM:
+            raise ConnectionError(f"resposta inesperada do agente (tipo {kind})")
+        frame = self._read(size)
+        (length,) = ITEM_HEADER.unpack_from(frame)
+        end = ITEM_HEADER.size + length
+        return decode_item(json.loads(frame[ITEM_HEADER.size:end]), frame[end:])
+
+    def ping(self, timeout=CONNECT_TIMEOUT):
+        """Keepalive: o guest responde um item vazio e zera o timeout ocioso."""
+        payload = json.dumps({"ping": True}).encode("utf-8")
+        self.sock.settimeout(timeout)
+        self.sock.sendall(HEADER.pack(KIND_JSON, len(payload)) + payload)
+        kind, size = HEADER.unpack(self._read(HEADER.size))
+        if kind != KIND_ITEM or size:
+            raise ConnectionError(f"resposta inesperada do agente (tipo {kind})")
+
+    def is_open(self):
+        """
+        False se o guest ja fechou a conexao (timeout ocioso dele ou
+        VM caindo): o EOF fica pendente no socket.
+        """
+        if self.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            # Ocioso nao ha nada para ler; legivel sem dados e EOF
+            return not readable or self.sock.recv(1, socket.MSG_PEEK) != b""
+        except OSError:
+            return False
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+class AgentPool:
+    """
+    Agentes keep-alive por funcao, com no maximo `max_agents` VMs.
+
+    `factory(vm_id)` deve devolver um runner com start_agent(),
+    agent_invoke(), agent_ping(), is_agent_alive(), memory_usage(),
+    o contador agent_requests e cleanup() (ex: NanoLambda sem
+    `agents`); com `balloon_idle`, tambem inflate_balloon() e
+    deflate_balloon().
+
+    Por funcao o pool conta chegadas, hits, concorrencia e tempo de
+    servico (demand()); provision() e set_reserve() deixam um
+    autoscaler (autoscaler.py) bootar agentes antes da demanda e
+    proteger os reservados do despejo por ociosidade.
+    """
+
+    def __init__(self, factory, max_agents=4, idle_ttl=60, max_requests=1000,
+                 name="agents", check_interval=1.0, balloon_idle=None):
+        self.factory = factory
+        self.max_agents = max_agents
+        self.idle_ttl = idle_ttl
+        self.max_requests = max_requests
+        self.name = name
+        self.check_interval = check_interval
+        self.balloon_idle = balloon_idle
+
+        self._idle = {}       # funcao -> deque de (vm, momento em que ficou ociosa)
+        self._functions = {}  # funcao -> contadores (ver _function)
+        self._owners = {}     # vm -> funcao
+        self._ballooned = {}  # vm ociosa -> MiB pedidos ao balao
+        self._pinged = {}     # vm ociosa -> ultimo keepalive
+        self._live = 0        # agentes vivos: ociosos, atendendo ou bootando
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+        self._hits = 0
+        self._misses = 0
+        self._fallbacks = 0
+        self._provisioned = 0
+        self._evicted = 0
+        self._recycled = 0
+        self._failures = 0
+        self._requests = 0
+        self._inflations = 0
+        self._deflations = 0
+        self._boot_times = collections.deque(maxlen=100)
+
+    def start(self):
+        """Inicia o despejo dos agentes ociosos em background."""
+        self._thread = threading.Thread(target=self._evict_loop,
+                                        name=f"agent-pool-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _function(self, function_path):
+        """Contadores da funcao (com lock)."""
+        stats = self._functions.get(function_path)
+        if stats is None:
+            stats = self._functions[function_path] = {
+                "arrivals": 0, "hits": 0, "misses": 0, "fallbacks": 0,
+                "served": 0, "service_s": 0.0, "in_flight": 0, "peak": 0,
+                "live": 0, "reserve": 0, "provisioned": 0,
+            }
+        return stats
+
+    def _reserve_slot(self, function_path):
+        """Conta um agente novo da funcao antes de bootar (com lock)."""
+        self._live += 1
+        self._function(function_path)["live"] += 1
+
+    def _expire_idle(self):
+        """
+        Tira os agentes ociosos mortos e os ociosos ha mais de
+        idle_ttl alem da reserva da funcao (com lock).
+        """
+        now = time.time()
+        dead = []
+        for function_path, idle in list(self._idle.items()):
+            stats = self._functions[function_path]
+            surplus = stats["live"] - stats["reserve"]
+            alive = collections.deque()
+            for vm, idle_since in idle:
+                if not vm.is_agent_alive():
+                    dead.append(vm)
+                elif surplus > 0 and now - idle_since > self.idle_ttl:
+                    self._evicted += 1
+                    surplus -= 1
+                    dead.append(vm)
+                else:
+                    alive.append((vm, idle_since))
+            if alive:
+                self._idle[function_path] = alive
+            else:
+                del self._idle[function_path]
+        return dead
+
+    def _take_idle(self, wanted):
+        """
+        Tira da fila de ociosos os agentes com wanted(vm, idle_since):
+        o trabalho neles (balao, keepalive) roda fora do lock sem um
+        lease pegar a VM no meio (com lock).
+        """
+        taken = []
+        for function_path, idle in list(self._idle.items()):
+            keep = collections.deque()
+            for vm, idle_since in idle:
+                if wanted(vm, idle_since):
+                    taken.append((function_path, vm, idle_since))
+                else:
+                    keep.append((vm, idle_since))
+            if keep:
+                self._idle[function_path] = keep
+            else:
+                del self._idle[function_path]
+        return taken
+
+    def _return_idle(self, entries):
+        """Devolve aos ociosos o que _take_idle tirou; com o pool fechado, retira."""
+        closing = []
+        with self._cond:
+            for function_path, vm, idle_since in entries:
+                if self._closed:
+                    closing.append(vm)
+                    continue
+                idle = self._idle.setdefault(function_path, collections.deque())
+                idle.append((vm, idle_since))
+                # Mantem a ordem por ociosidade: o lease pega o usado por ultimo
+                self._idle[function_path] = collections.deque(
+                    sorted(idle, key=lambda entry: entry[1]))
+        for vm in closing:
+            self._retire(vm)
+
+    def _take_inflatable(self):
+        """Ociosos ha mais de balloon_idle que ainda nao inflaram (com lock)."""
+        if self.balloon_idle is None:
+            return []
+        now = time.time()
+        return self._take_idle(lambda vm, idle_since: vm not in self._ballooned
+                               and now - idle_since > self.balloon_idle)
+
+    def _inflate(self, entries):
+        """Infla o balao dos agentes e os devolve aos ociosos."""
+        for function_path, vm, idle_since in entries:
+            try:
+                mib = vm.inflate_balloon()
+            except Exception as e:
+                print(f"[!] Agentes {self.name}: falha ao inflar o balao: {e}")
+                mib = 0
+            with self._cond:
+                # Mesmo com 0 (guest sem estatisticas ainda) so tenta de
+                # novo na proxima vez que ficar ocioso
+                self._ballooned[vm] = mib
+                self._inflations += bool(mib)
+        self._return_idle(entries)
+
+    def _take_stale(self):
+        """
+        Ociosos sem contato com o guest ha mais de idle_ttl (com lock).
+        Sem reserva eles ja teriam sido despejados; com ela, o guest
+        desligaria em 2 x idle_ttl.
+        """
+        now = time.time()
+        return self._take_idle(lambda vm, idle_since: (
+            now - max(idle_since, self._pinged.get(vm, 0)) > self.idle_ttl))
+
+    def _keepalive(self, entries):
+        """Manda o keepalive aos agentes; o que nao responde sai do pool."""
+        alive = []
+        for function_path, vm, idle_since in entries:
+            try:
+                vm.agent_ping()
+            except Exception as e:
+                print(f"[!] Agentes {self.name}: agente nao respondeu ao keepalive: {e}")
+                self._retire(vm)
+                continue
+            with self._cond:
+                self._pinged[vm] = time.time()
+            alive.append((function_path, vm, idle_since))
+        self._return_idle(alive)
+
+    def _evict_loop(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    break
+                dead = self._expire_idle()
+                inflatable = self._take_inflatable()
+                stale = self._take_stale()
+                if not dead and not inflatable and not stale:
+                    self._cond.wait(timeout=self.check_interval)
+                    continue
+            for vm in dead:
+                self._retire(vm)
+            if stale:
+                self._keepalive(stale)
+            if inflatable:
+                self._inflate(inflatable)
+
+    def _evict_oldest(self):
+        """
+        Libera a vaga do agente ocioso ha mais tempo, de preferencia de
+        uma funcao acima da reserva (com lock).
+        """
+        candidates = [fn for fn in self._idle
+                      if self._functions[fn]["live"] > self._functions[fn]["reserve"]]
+        oldest = None
+        for function_path in candidates or list(self._idle):
+            if oldest is None or self._idle[function_path][0][1] < self._idle[oldest][0][1]:
+                oldest = function_path
+        if oldest is None:
+            return None
+        vm, _ = self._idle[oldest].popleft()
+        if not self._idle[oldest]:
+            del self._idle[oldest]
+        self._evicted += 1
+        return vm
+
+    def _retire(self, vm):
+        vm.cleanup()
+        with self._cond:
+            self._live -= 1
+            self._ballooned.pop(vm, None)
+            self._pinged.pop(vm, None)
+            function_path = self._owners.pop(vm, None)
+            if function_path is not None:
+                self._functions[function_path]["live"] -= 1
+            self._cond.notify_all()
+
+    def _boot(self, function_path):
+        """Boota um agente da funcao (vaga ja contada). None se falhar."""
+        vm = self.factory(f"{self.name}-{next(self._ids)}")
+        with self._cond:
+            self._owners[vm] = function_path
+        start = time.time()
+        try:
+            vm.start_agent(function_path, idle_timeout=self.idle_ttl * 2)
+        except Exception as e:
+            print(f"[!] Agentes {self.name}: falha ao bootar agente: {e}")
+            with self._cond:
+                self._failures += 1
+            self._retire(vm)
+            return None
+        with self._cond:
+            self._boot_times.append(time.time() - start)
+        return vm
+
+    def lease(self, function_path):
+        """
+        Agente da funcao para uma requisicao: um ocioso (hit) ou um
+        novo, bootado agora (miss). None quando todas as vagas estao
+        com agentes ocupados.
+        """
+        dead = []
+        deflate = 0
+        with self._cond:
+            stats = self._function(function_path)
+            vm = None
+            idle = self._idle.get(function_path)
+            while idle:
+                # O usado por ultimo primeiro: os mais antigos envelhecem e saem
+                candidate, _ = idle.pop()
+                if candidate.is_agent_alive():
+                    vm = candidate
+                    break
+                dead.append(candidate)
+            if idle is not None and not idle:
+                del self._idle[function_path]
+            if vm is not None:
+                self._hits += 1
+                stats["hits"] += 1
+                deflate = self._ballooned.pop(vm, 0)
+                self._pinged.pop(vm, None)
+            elif not self._closed:
+                if self._live - len(dead) >= self.max_agents:
+                    victim = self._evict_oldest()
+                    if victim is not None:
+                        dead.append(victim)
+                if self._live - len(dead) < self.max_agents:
+                    self._reserve_slot(function_path)
+                    self._misses += 1
+                    stats["misses"] += 1
+                    vm = False  # bootar fora do lock
+            if vm is None:
+                self._fallbacks += 1
+                stats["fallbacks"] += 1
+
+        for old in dead:
+            self._retire(old)
+        if deflate:
+            self._deflate(vm)
+        if vm is not False:
+            return vm
+        return self._boot(function_path)
+
+    def _deflate(self, vm):
+        try:
+            vm.deflate_balloon()
+        except Exception as e:
+            # Com deflate_on_oom o guest ainda pega as paginas de volta se precisar
+            print(f"[!] Agentes {self.name}: falha ao desinflar o balao: {e}")
+            return
+        with self._cond:
+            self._deflations += 1
+
+    def release(self, vm, function_path):
+        """Devolve o agente: volta a ficar ocioso ou e reciclado."""
+        with self._cond:
+            if not self._closed and vm.is_agent_alive():
+                if vm.agent_requests < self.max_requests:
+                    self._idle.setdefault(function_path, collections.deque()).append(
+                        (vm, time.time()))
+                    return
+                self._recycled += 1
+        self._retire(vm)
+
+    def provision(self, function_path, count):
+        """
+        Boota ate `count` agentes da funcao em background, antes de
+        chegarem requisicoes (dentro de max_agents). Retorna quantos.
+        """
+        with self._cond:
+            started = 0
+            while (started < count and not self._closed
+                   and self._live < self.max_agents):
+                self._reserve_slot(function_path)
+                started += 1
+            self._provisioned += started
+            self._function(function_path)["provisioned"] += started
+        for _ in range(started):
+            threading.Thread(target=self._provision_one, args=(function_path,),
+                             name=f"agent-provision-{self.name}", daemon=True).start()
+        return started
+
+    def _provision_one(self, function_path):
+        vm = self._boot(function_path)
+        if vm is not None:
+            self.release(vm, function_path)
+
+    def set_reserve(self, function_path, count):
+        """Agentes ociosos da funcao que o despejo por ociosidade preserva."""
+        with self._cond:
+            self._function(function_path)["reserve"] = count
+
+    def demand(self):
+        """
+        Contadores por funcao (acumulados) e o pico de concorrencia
+        desde a chamada anterior, que e zerado: um consumidor so.
+        """
+        with self._cond:
+            snapshot = {}
+            for function_path, stats in self._functions.items():
+                snapshot[function_path] = dict(
+                    stats, idle=len(self._idle.get(function_path, ())))
+                stats["peak"] = stats["in_flight"]
+            return snapshot
+
+    def invoke(self, function_path, input_data):
+        """
+        Atende a requisicao num agente da funcao (resultado no formato
+        do NanoLambda.invoke) ou devolve None se nao houver vaga.
+        """
+        with self._cond:
+            stats = self._function(function_path)
+            stats["arrivals"] += 1
+            stats["in_flight"] += 1
+            stats["peak"] = max(stats["peak"], stats["in_flight"])
+        try:
+            # Uma segunda tentativa so se a conexao caiu antes da resposta
+            for retry in (True, False):
+                vm = self.lease(function_path)
+                if vm is None:
+                    return None
+                result = self._serve(vm, function_path, stats, input_data, retry)
+                if result is not None:
+                    return result
+        finally:
+            with self._cond:
+                stats["in_flight"] -= 1
+
+    def memory(self):
+        """
+        Memoria dos agentes para a contabilidade do host: soma do
+        memory_usage() de cada um (reserva, balao, footprint e RSS).
+        `pending` sao as vagas contadas cujo runner ainda nao existe.
+        """
+        with self._cond:
+            vms = list(self._owners)
+            live = self._live
+        usages = [vm.memory_usage() for vm in vms]
+        return {
+            "vms": len(usages),
+            "pending": max(0, live - len(usages)),
+            "mem_mib": sum(u["mem_mib"] for u in usages),
+            "balloon_mib": sum(u["balloon_mib"] for u in usages),
+            "footprint_mib": sum(u["footprint_mib"] for u in usages),
+            "rss_mib": sum(u["rss_mib"] or 0 for u in usages),
+            "ballooned": sum(1 for u in usages if u["balloon_mib"]),
+        }
+
+    def _serve(self, vm, function_path, stats, input_data, retry):
+        """
+        Uma requisicao no agente. Com `retry`, devolve None se o guest
+        fechou a conexao (a VM sai e o invoke tenta outro agente ou um
+        novo).
+        """
+        start = time.time()
+        try:
+            result = vm.agent_invoke(input_data)
+        except Exception as e:
+            with self._cond:
+                self._failures += 1
+            if retry and isinstance(e, ConnectionError):
+                print(f"[!] Agentes {self.name}: conexao com o agente caiu ({e}), "
+                      f"tentando outro")
+                self._retire(vm)
+                return None
+            # O agente (ou a VM) caiu no meio: a requisicao falha e a VM sai
+            result = {"success": False, "type": "text", "data": f"agente falhou: {e}",
+                      "log": vm.console.log_text(), "timings": {}}
+        with self._cond:
+            self._requests += 1
+            stats["served"] += 1
+            stats["service_s"] += time.time() - start
+        self.release(vm, function_path)
+        return result
+
+    def stats(self):
+        """Estatisticas dos agentes (hits, boots, despejos e reciclagens)."""
+        with self._cond:
+            boots = sorted(self._boot_times)
+            return {
+                "name": self.name,
+                "max_agents": self.max_agents,
+                "live": self._live,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "functions": len(self._idle),
+                "requests": self._requests,
+                "hits": self._hits,
+                "misses": self._misses,
+                "fallbacks": self._fallbacks,
+                "provisioned": self._provisioned,
+                "evicted": self._evicted,
+                "recycled": self._recycled,
+                "failures": self._failures,
+                "inflations": self._inflations,
+                "deflations": self._deflations,
+                "boot_avg_s": sum(boots) / len(boots) if boots else 0.0,
+                "boot_max_s": boots[-1] if boots else 0.0,
+            }
+
+    def close(self):
+        """Para o despejo e desliga os agentes ociosos."""
+        with self._cond:
+            self._closed = True
+            idle = [vm for queue in self._idle.values() for vm, _ in queue]
+            self._idle.clear()
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10)
+        for vm in idle:
+            self._retire(vm)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,308 @@
+"""
+autoscaler.py - Capacidade quente prevista por funcao (agentes keep-alive)
+
+Um pool de tamanho fixo gasta memoria de madrugada e seca no pico. O
+Autoscaler olha a demanda de cada funcao no AgentPool (agent_pool.py) a
+cada AUTOSCALE_INTERVAL e boota agentes antes das requisicoes chegarem:
+
+- chegadas/s por funcao suavizadas por EWMA com tendencia (Holt): a
+  previsao olha adiante o tempo de boot de um agente
+- percentil (AUTOSCALE_PERCENTILE) das chegadas/s e do pico de
+  concorrencia numa janela de AUTOSCALE_WINDOW leituras: um pico
+  recente nao e esquecido na leitura seguinte
+- alvo = chegadas/s previstas x tempo de servico x folga (lei de
+  Little), nunca abaixo do pico de concorrencia da janela
+
+O alvo fica entre `min_warm` e `max_warm` por funcao e a soma cabe no
+orcamento de memoria do host; sem espaco para todos, as vagas vao para
+quem tem o maior deficit. O orcamento e contado pelo footprint dos
+agentes vivos (AgentPool.memory()): um agente com o balao inflado
+(balloon.py) ocupa so o que o guest ainda pode tocar e a sobra vira
+vagas de mem_per_vm_mib para agentes novos.
+Subir e na hora (provision); descer so marca a reserva menor e o pool
+despeja os agentes a mais depois de ociosos por idle_ttl.
+
+Decisoes, alvos, taxas e a taxa de hits da capacidade quente saem como
+metricas (instrumentation.py, GET /metrics do gateway).
+
+Uso:
+    agents = AgentPool(lambda vm_id: NanoLambda(vm_id=vm_id), max_agents=8)
+    agents.start()
+    autoscaler = Autoscaler(agents, min_warm=0, mem_budget_mib=2048)
+    autoscaler.start()
+    ...
+    print_autoscaler_report(autoscaler.report())
+    autoscaler.close()
+"""
+
+import collections
+import math
+import threading
+import time
+
+from engine import host_memory_mib, percentile
+from instrumentation import DISABLED
+
+AUTOSCALE_INTERVAL = 1.0
+AUTOSCALE_WINDOW = 60
+AUTOSCALE_PERCENTILE = 95
+AUTOSCALE_ALPHA = 0.3   # peso da leitura nova no nivel
+AUTOSCALE_BETA = 0.1    # peso da variacao nova na tendencia
+AUTOSCALE_HEADROOM = 1.2
+
+
+class DemandForecast:
+    """Demanda de uma funcao a partir dos contadores do AgentPool.demand()."""
+
+    def __init__(self, window=AUTOSCALE_WINDOW, alpha=AUTOSCALE_ALPHA, beta=AUTOSCALE_BETA):
+        self.alpha = alpha
+        self.beta = beta
+        self.level = None
+        self.trend = 0.0
+        self.service_s = None
+        self.rates = collections.deque(maxlen=window)
+        self.peaks = collections.deque(maxlen=window)
+        self.lookups = collections.deque(maxlen=window)  # (hits, requisicoes) por leitura
+        self._last = None
+
+    def update(self, counters, elapsed):
+        """
+        Acrescenta uma leitura (contadores acumulados, `elapsed` desde a
+        anterior). Retorna hits, misses e fallbacks da leitura.
+
+        A primeira leitura so guarda a base: os contadores acumulados
+        desde a criacao do pool (que pode ja estar atendendo) divididos
+        por um intervalo virariam uma taxa falsa.
+        """
+        last = self._last
+        self._last = counters
+        if last is None:
+            return dict.fromkeys(("hits", "misses", "fallbacks"), 0)
+        rate = (counters["arrivals"] - last["arrivals"]) / elapsed
+        if self.level is None:
+            self.level = rate
+        else:
+            previous = self.level
+            # Com a tendencia negativa o nivel passaria de zero no fim de um pico
+            self.level = max(0.0, self.alpha * rate
+                             + (1 - self.alpha) * (self.level + self.trend))
+            self.trend = self.beta * (self.level - previous) + (1 - self.beta) * self.trend
+        served = counters["served"] - last["served"]
+        if served:
+            observed = (counters["service_s"] - last["service_s"]) / served
+            self.service_s = (observed if self.service_s is None
+                              else self.alpha * observed + (1 - self.alpha) * self.service_s)
+        self.rates.append(rate)
+        self.peaks.append(counters["peak"])
+        delta = {key: counters[key] - last[key] for key in ("hits", "misses", "fallbacks")}
+        self.lookups.append((delta["hits"], sum(delta.values())))
+        return delta
+
+    def forecast(self, ahead):
+        """Chegadas/s previstas daqui a `ahead` leituras."""
+        return max(0.0, (self.level or 0.0) + self.trend * ahead)
+
+    def rate_percentile(self, pct):
+        return percentile(sorted(self.rates), pct)
+
+    def peak_percentile(self, pct):
+        return percentile(sorted(self.peaks), pct)
+
+    def hit_ratio(self):
+        """Hits / requisicoes na janela (None sem requisicoes)."""
+        hits = sum(h for h, _ in self.lookups)
+        total = sum(t for _, t in self.lookups)
+        return hits / total if total else None
+
+    def target(self, ahead, pct=AUTOSCALE_PERCENTILE, headroom=AUTOSCALE_HEADROOM):
+        """Agentes quentes para a demanda prevista."""
+        rate = max(self.forecast(ahead), self.rate_percentile(pct))
+        little = rate * (self.service_s or 0.0) * headroom
+        return math.ceil(max(little, self.peak_percentile(pct)))
+
+
+class Autoscaler:
+    """
+    Ajusta a capacidade quente de cada funcao de um AgentPool.
+
+    tick() faz uma rodada (leitura, previsao, provision/reserva) e
+    devolve as decisoes; start() roda tick() a cada `interval` numa
+    thread.
+    """
+
+    def __init__(self, pool, min_warm=0, max_warm=None, mem_budget_mib=None,
+                 mem_per_vm_mib=256, interval=AUTOSCALE_INTERVAL, window=AUTOSCALE_WINDOW,
+                 pct=AUTOSCALE_PERCENTILE, alpha=AUTOSCALE_ALPHA, beta=AUTOSCALE_BETA,
+                 headroom=AUTOSCALE_HEADROOM, instrumentation=DISABLED):
+        self.pool = pool
+        self.min_warm = min_warm
+        self.max_warm = max_warm if max_warm is not None else pool.max_agents
+        # Por padrao deixa 20% da memoria livre para o host (como o engine)
+        self.mem_budget_mib = mem_budget_mib or int(host_memory_mib() * 0.8)
+        self.mem_per_vm_mib = mem_per_vm_mib
+        self.capacity = max(0, min(pool.max_agents, self.mem_budget_mib // mem_per_vm_mib))
+        self.memory = None
+        self.interval = interval
+        self.window = window
+        self.pct = pct
+        self.alpha = alpha
+        self.beta = beta
+        self.headroom = headroom
+        self.instrumentation = instrumentation
+
+        self._forecasts = {}
+        self._targets = {}
+        self._rows = {}
+        self._last_tick = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="autoscaler", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[!] Autoscaler: {e}")
+
+    def _update_capacity(self):
+        """
+        Vagas que cabem no orcamento: os agentes vivos pelo footprint
+        (reserva - balao) e cada agente novo pela reserva inteira.
+        """
+        memory = self.memory = self.pool.memory()
+        used = memory["footprint_mib"] + memory["pending"] * self.mem_per_vm_mib
+        live = memory["vms"] + memory["pending"]
+        # Acima do orcamento a sobra fica negativa e a capacidade cai
+        free = self.mem_budget_mib - used
+        self.capacity = max(0, min(self.pool.max_agents,
+                                   live + int(free // self.mem_per_vm_mib)))
+        return memory
+
+    def _fit_budget(self, wanted):
+        """Reparte `capacity` vagas: minimos primeiro, depois o maior deficit."""
+        if sum(wanted.values()) <= self.capacity:
+            return dict(wanted)
+        order = sorted(wanted, key=lambda fn: -wanted[fn])
+        allot = dict.fromkeys(wanted, 0)
+        free = self.capacity
+        for fn in order:
+            give = min(self.min_warm, wanted[fn], free)
+            allot[fn] += give
+            free -= give
+        while free > 0:
+            fn = max(order, key=lambda fn: wanted[fn] - allot[fn])
+            if wanted[fn] <= allot[fn]:
+                break
+            allot[fn] += 1
+            free -= 1
+        return allot
+
+    def tick(self):
+        """Uma rodada: le a demanda, preve e ajusta a capacidade de cada funcao."""
+        now = time.time()
+        elapsed = now - self._last_tick if self._last_tick else self.interval
+        self._last_tick = now
+        demand = self.pool.demand()
+        # A previsao olha adiante o tempo de bootar um agente
+        ahead = max(1.0, self.pool.stats()["boot_avg_s"] / self.interval)
+
+        wanted = {}
+        lookups = {}
+        for fn, counters in demand.items():
+            forecast = self._forecasts.get(fn)
+            if forecast is None:
+                forecast = self._forecasts[fn] = DemandForecast(self.window, self.alpha,
+                                                                self.beta)
+            lookups[fn] = forecast.update(counters, max(elapsed, 1e-6))
+            target = forecast.target(ahead, self.pct, self.headroom)
+            wanted[fn] = min(max(target, self.min_warm), self.max_warm)
+        memory = self._update_capacity()
+        targets = self._fit_budget(wanted)
+
+        instr = self.instrumentation
+        instr.gauge("autoscaler_capacity", self.capacity)
+        for kind in ("mem", "balloon", "footprint", "rss"):
+            instr.gauge("warm_memory_mib", memory[f"{kind}_mib"], kind=kind)
+        decisions = []
+        for fn, target in targets.items():
+            counters = demand[fn]
+            forecast = self._forecasts[fn]
+            live = counters["live"]
+            self.pool.set_reserve(fn, target)
+            started = 0
+            if target > live:
+                started = self.pool.provision(fn, target - live)
+                action = "up"
+            elif target < live:
+                action = "down"  # o pool despeja os ociosos a mais depois do idle_ttl
+            else:
+                action = "hold"
+            if target < wanted[fn]:
+                instr.inc("autoscaler_budget_limited", function=fn)
+            if self._targets.get(fn) != target and action != "hold":
+                print(f"[*] Autoscaler: {fn} {live} -> {target} agentes "
+                      f"({forecast.forecast(ahead):.2f} req/s previstas)")
+            self._targets[fn] = target
+
+            hit_ratio = forecast.hit_ratio()
+            row = {
+                "function": fn, "action": action, "target": target, "wanted": wanted[fn],
+                "live": live, "idle": counters["idle"], "started": started,
+                "rate_ewma": forecast.level or 0.0,
+                "rate_pct": forecast.rate_percentile(self.pct),
+                "forecast": forecast.forecast(ahead),
+                "peak_pct": forecast.peak_percentile(self.pct),
+                "service_s": forecast.service_s,
+                "hit_ratio": hit_ratio,
+                "arrivals": counters["arrivals"], "hits": counters["hits"],
+                "misses": counters["misses"], "fallbacks": counters["fallbacks"],
+                "provisioned": counters["provisioned"],
+            }
+            decisions.append(row)
+
+            instr.inc("autoscaler_decisions", function=fn, action=action)
+            for key, result in (("hits", "hit"), ("misses", "miss"), ("fallbacks", "fallback")):
+                if lookups[fn][key]:
+                    instr.inc("warm_requests", lookups[fn][key], function=fn, result=result)
+            if started:
+                instr.inc("autoscaler_provisioned", started, function=fn)
+            instr.gauge("warm_target", target, function=fn)
+            instr.gauge("warm_live", live, function=fn)
+            instr.gauge("warm_idle", counters["idle"], function=fn)
+            instr.gauge("arrival_rate", row["rate_ewma"], function=fn, stat="ewma")
+            instr.gauge("arrival_rate", row["rate_pct"], function=fn, stat=f"p{self.pct}")
+            instr.gauge("arrival_rate", row["forecast"], function=fn, stat="forecast")
+            if forecast.service_s is not None:
+                instr.gauge("service_seconds", forecast.service_s, function=fn)
+            if hit_ratio is not None:
+                instr.gauge("warm_hit_ratio", hit_ratio, function=fn)
+
+        with self._lock:
+            self._rows = {row["function"]: row for row in decisions}
+        return decisions
+
+    def report(self):
+        """Ultima decisao de cada funcao."""
+        with self._lock:
+            return [self._rows[fn] for fn in sorted(self._rows)]
+
+    def close(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10)
+
+
+def print_autoscaler_report(rows):
+    print(f"{'funcao':<28} {'req/s':>7} {'p95':>7} {'prev':>7} {'servico':>8} "
+          f"{'alvo':>5} {'vivos':>6} {'hits':>6}")
+    for row in rows:
+        service = f"{row['service_s'] * 1000:.0f}ms" if row["service_s"] is not None else "-"
+        hits = f"{row['hit_ratio'] * 100:.0f}%" if row["hit_ratio"] is not None else "-"
+        print(f"{row['function'][-28:]:<28} {row['rate_ewma']:>7.2f} {row['rate_pct']:>7.2f} "
+              f"{row['forecast']:>7.2f} {service:>8} {row['target']:>5} {row['live']:>6} "
+              f"{hits:>6}")
@@ -0,0 +1,184 @@
+"""
+balloon.py - Balao de memoria (virtio-balloon) para VMs ociosas
+
+O Firecracker reserva MEM_SIZE_MIB para a VM a vida toda e o guest
+nunca devolve uma pagina que ja tocou: um agente keep-alive ocioso
+segura o page cache do import e o heap do handler, e a memoria do host
+limita quantos agentes ficam quentes. Com o balao:
+
+- balloon_device() vai no PUT /balloon (ou no --config-file) antes do
+  boot: comeca vazio, com deflate_on_oom (o guest pega paginas de volta
+  se apertar) e estatisticas do guest a cada BALLOON_STATS_INTERVAL_S
+- numa VM ociosa, inflate_target() calcula quanto inflar: tudo menos o
+  que o guest usa de fato e BALLOON_HEADROOM_MIB (o page cache sai);
+  PATCH /balloon e o guest entrega as paginas, que o Firecracker
+  devolve ao host (madvise), e o RSS do processo cai
+- antes de atender de novo a VM desinfla (PATCH amount_mib 0)
+
+vm_memory() junta reserva, balao e RSS de uma VM para a contabilidade
+de memoria do host (AgentPool.memory(), Autoscaler); benchmark_density()
+mede VMs por GiB com e sem balao.
+
+O kernel do guest precisa de CONFIG_VIRTIO_BALLOON.
+
+Uso:
+    config["balloon"] = balloon_device()
+    stats = parse_balloon_stats(client.request("GET", "/balloon/statistics").json())
+    client.request("PATCH", "/balloon", {"amount_mib": inflate_target(stats, 256)})
+"""
+
+import time
+
+MIB = 1024 * 1024
+BALLOON_STATS_INTERVAL_S = 1
+# Memoria livre que fica com o guest alem da que ele usa
+BALLOON_HEADROOM_MIB = 32
+# Nunca deixa o guest com menos que isso
+BALLOON_GUEST_MIN_MIB = 64
+# Espera do guest entregar as paginas (benchmark)
+BALLOON_SETTLE_S = 10
+
+
+def balloon_device(amount_mib=0, stats_interval_s=BALLOON_STATS_INTERVAL_S):
+    """Corpo do PUT /balloon (secao "balloon" do --config-file)."""
+    return {
+        "amount_mib": amount_mib,
+        "deflate_on_oom": True,
+        "stats_polling_interval_s": stats_interval_s,
+    }
+
+
+def parse_balloon_stats(raw):
+    """
+    Resposta do GET /balloon/statistics em MiB.
+
+    As estatisticas do guest (total/available/...) so aparecem depois
+    do primeiro relatorio do driver; ate la ficam em 0. Com
+    deflate_on_oom as paginas do balao contam como usadas no guest:
+    used_mib ja desconta o balao.
+    """
+    def mib(key):
+        return raw.get(key, 0) / MIB
+
+    total = mib("total_memory")
+    available = mib("available_memory")
+    actual = raw.get("actual_mib", 0)
+    return {
+        "target_mib": raw.get("target_mib", 0),
+        "actual_mib": actual,
+        "total_mib": total,
+        "available_mib": available,
+        "free_mib": mib("free_memory"),
+        "caches_mib": mib("disk_caches"),
+        "used_mib": max(0.0, total - available - actual) if total else None,
+        "swap_in": raw.get("swap_in", 0),
+        "major_faults": raw.get("major_faults", 0),
+    }
+
+
+def inflate_target(stats, mem_size_mib, headroom_mib=BALLOON_HEADROOM_MIB,
+                   guest_min_mib=BALLOON_GUEST_MIN_MIB):
+    """
+    Tamanho do balao (MiB) numa VM ociosa: o guest fica com o que usa
+    mais `headroom_mib`, nunca menos que `guest_min_mib`. 0 enquanto o
+    guest nao mandou estatisticas.
+    """
+    if stats["used_mib"] is None:
+        return 0
+    keep = max(stats["used_mib"] + headroom_mib, guest_min_mib)
+    return max(0, int(mem_size_mib - keep))
+
+
+def process_rss_mib(pid):
+    """RSS do processo (VmRSS) em MiB; None se ele ja saiu."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def vm_memory(mem_size_mib, stats=None, rss_mib=None):
+    """
+    Memoria de uma VM para a contabilidade do host: a reserva, o que o
+    balao devolveu e o footprint (reserva - balao), que e o que o guest
+    ainda pode tocar.
+    """
+    balloon = stats["actual_mib"] if stats else 0
+    return {
+        "mem_mib": mem_size_mib,
+        "balloon_mib": balloon,
+        "footprint_mib": mem_size_mib - balloon,
+        "rss_mib": rss_mib,
+        "guest_used_mib": stats["used_mib"] if stats else None,
+    }
+
+
+def wait_inflated(runner, target_mib, timeout=BALLOON_SETTLE_S):
+    """Espera o balao do runner chegar a `target_mib`. Retorna as estatisticas."""
+    deadline = time.time() + timeout
+    while True:
+        stats = runner.balloon_stats()
+        if stats is None or stats["actual_mib"] >= target_mib or time.time() >= deadline:
+            return stats
+        time.sleep(0.2)
+
+
+def benchmark_density(runner_factory, function_path, input_data, count=4,
+                      settle_s=BALLOON_SETTLE_S):
+    """
+    VMs por GiB com e sem balao.
+
+    `runner_factory()` cria um runner com balao (NanoLambda(balloon=True)).
+    Boota `count` agentes da funcao e roda `input_data` em cada um (o
+    import e o handler sujam a memoria do guest); mede a reserva e o RSS
+    dos processos Firecracker. Depois infla o balao de todos, espera o
+    guest entregar as paginas e mede de novo, nas mesmas VMs.
+    """
+    runners = []
+    rows = []
+    try:
+        for _ in range(count):
+            runner = runner_factory()
+            runners.append(runner)
+            runner.start_agent(function_path)
+            runner.agent_invoke(input_data)
+        # O driver do guest precisa mandar as estatisticas antes do calculo do alvo
+        time.sleep(2 * BALLOON_STATS_INTERVAL_S)
+        rows.append(_density_row("sem balao", runners))
+        targets = [runner.inflate_balloon() for runner in runners]
+        for runner, target in zip(runners, targets):
+            wait_inflated(runner, target, settle_s)
+        rows.append(_density_row("com balao", runners))
+    finally:
+        for runner in runners:
+            runner.cleanup()
+    return rows
+
+
+def _density_row(scenario, runners):
+    usages = [runner.memory_usage() for runner in runners]
+    count = len(usages)
+    footprint = sum(u["footprint_mib"] for u in usages) / count
+    rss = sum(u["rss_mib"] or 0 for u in usages) / count
+    return {
+        "scenario": scenario,
+        "vms": count,
+        "balloon_mib": sum(u["balloon_mib"] for u in usages) / count,
+        "footprint_mib": footprint,
+        "rss_mib": rss,
+        "vms_per_gib_reserved": 1024 / footprint if footprint else 0.0,
+        "vms_per_gib_rss": 1024 / rss if rss else 0.0,
+    }
+
+
+def print_density_report(rows):
+    print(f"{'cenario':<12} {'VMs':>4} {'balao':>8} {'reserva':>9} {'RSS':>8} "
+          f"{'VMs/GiB (reserva)':>18} {'VMs/GiB (RSS)':>14}")
+    for row in rows:
+        print(f"{row['scenario']:<12} {row['vms']:>4} {row['balloon_mib']:>5.0f}MiB "
+              f"{row['footprint_mib']:>6.0f}MiB {row['rss_mib']:>5.0f}MiB "
+              f"{row['vms_per_gib_reserved']:>18.1f} {row['vms_per_gib_rss']:>14.1f}")
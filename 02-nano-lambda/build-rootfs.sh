@@ -6,6 +6,7 @@
 set -e
 
 # Configurações
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 ROOTFS_FILE="rootfs-python.ext4"
 ROOTFS_SIZE_MB=500
 MOUNT_POINT="/tmp/rootfs-mount-$$"
@@ -121,7 +122,8 @@ ${CONTAINER_CMD} run --rm -v "${MOUNT_POINT}:/rootfs:Z" "alpine:${ALPINE_VERSION
         openrc \
         python3 \
         py3-pillow \
-        py3-qrcode
+        py3-qrcode \
+        py3-pip
 '
 
 echo "[4/6] Configurando sistema..."
@@ -159,13 +161,37 @@ INITTAB
     # Script de execução
     cat > /run-function.sh << "SCRIPT"
 #!/bin/sh
+# Modo snapshot: importa o handler, o host tira o snapshot e depois
+# restaura a VM para cada invocacao (ver snapshot_store.py)
+if grep -q "nano_lambda.mode=snapshot" /proc/cmdline; then
+    python3 -u /snapshot-runner.py
+    sync
+    poweroff -f
+fi
+
 echo ""
 echo "=== nano-Lambda executando... ==="
 echo ""
 
+# Modo input-drive: handler e input chegam num tar no segundo drive
+if [ -b /dev/vdb ]; then
+    tar -xf /dev/vdb -C /functions
+fi
+
 if [ -f /functions/handler.py ]; then
     cd /functions
-    python3 handler.py
+    if grep -q "nano_lambda.mode=agent" /proc/cmdline; then
+        # Agente keep-alive: importa o handler uma vez e atende
+        # requisicoes pelo vsock ate o host desligar a VM
+        python3 -u /agent-runner.py
+    elif [ -f /functions/batch.jsonl ]; then
+        # Lote (invoke_many): um boot, o handler importado uma vez
+        python3 -u /batch-runner.py
+    else
+        # -m: usa o .pyc pre-compilado das imagens do registro (python3
+        # handler.py sempre compila o script principal)
+        python3 -m handler
+    fi
     RETVAL=$?
     echo ""
     echo "=== Execucao finalizada (exit: $RETVAL) ==="
@@ -179,10 +205,228 @@ sleep 1
 poweroff -f
 SCRIPT
     chmod +x /run-function.sh
+
+    # Runner do modo snapshot
+    cat > /snapshot-runner.py << "RUNNER"
+#!/usr/bin/env python3
+#
+# Modo snapshot do nano-Lambda:
+# 1. Importa o handler (os imports pesados ficam no snapshot)
+# 2. Imprime NANO_LAMBDA_READY: o host pausa a VM e tira o snapshot
+# 3. A cada restore o host troca o /dev/vdb e manda uma linha no console
+# 4. Extrai o input novo e chama handler.main()
+# 5. Volta ao READY: com caches aquecidos o host pode gravar um snapshot Diff
+import fcntl
+import importlib.util
+import os
+import sys
+import tarfile
+import termios
+import traceback
+
+READY_MARKER = "NANO_LAMBDA_READY"
+BLKFLSBUF = 0x1261
+
+
+def extract_drive():
+    # Descarta o cache do /dev/vdb: o host trocou o arquivo por tras
+    fd = os.open("/dev/vdb", os.O_RDONLY)
+    try:
+        fcntl.ioctl(fd, BLKFLSBUF)
+    finally:
+        os.close(fd)
+    with tarfile.open("/dev/vdb") as tar:
+        tar.extractall("/functions")
+
+
+def main():
+    extract_drive()
+    os.chdir("/functions")
+    sys.path.insert(0, "/functions")
+    spec = importlib.util.spec_from_file_location("handler", "/functions/handler.py")
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+
+    # Sem echo: a linha mandada pelo host nao volta no console
+    attrs = termios.tcgetattr(0)
+    attrs[3] &= ~termios.ECHO
+    termios.tcsetattr(0, termios.TCSANOW, attrs)
+
+    while True:
+        print(READY_MARKER, flush=True)
+        if not sys.stdin.readline():
+            break
+
+        extract_drive()
+        print("=== nano-Lambda executando (snapshot)... ===", flush=True)
+        code = 0
+        try:
+            handler.main()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        print("")
+        print("=== Execucao finalizada (exit: %d) ===" % code, flush=True)
+
+
+main()
+RUNNER
+    chmod +x /snapshot-runner.py
+
+    # Runner do lote (NanoLambda.invoke_many)
+    cat > /batch-runner.py << "RUNNER"
+#!/usr/bin/env python3
+#
+# Lote do nano-Lambda (invoke_many):
+# 1. Importa o handler uma vez
+# 2. Para cada linha de /functions/batch.jsonl grava o input.txt e chama
+#    handler.main(), com o stdout capturado
+# 3. Devolve cada item (resultado ou erro) com nanolambda.send_item, na
+#    hora: se a VM morrer no meio, o host fica com os itens ja feitos
+import importlib.util
+import json
+import os
+import sys
+
+import nanolambda
+
+BATCH_FILE = "/functions/batch.jsonl"
+
+
+def run_item(handler, item):
+    header, data = nanolambda.run_handler(handler, item["input"], item["index"])
+    nanolambda.send_item(header, data)
+    return header
+
+
+def main():
+    os.chdir("/functions")
+    sys.path.insert(0, "/functions")
+    spec = importlib.util.spec_from_file_location("handler", "/functions/handler.py")
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+
+    failures = 0
+    with open(BATCH_FILE) as f:
+        for line in f:
+            header = run_item(handler, json.loads(line))
+            failures += not header["success"]
+            print("[lote] item %d: %s (%.0fms)" % (
+                header["index"], "ok" if header["success"] else "erro",
+                header["elapsed_s"] * 1000), flush=True)
+    sys.exit(1 if failures else 0)
+
+
+main()
+RUNNER
+    chmod +x /batch-runner.py
+
+    # Agente keep-alive (agent_pool.py no host)
+    cat > /agent-runner.py << "RUNNER"
+#!/usr/bin/env python3
+#
+# Agente keep-alive do nano-Lambda (nano_lambda.mode=agent):
+# 1. Importa o handler uma vez
+# 2. Escuta no vsock (porta 10001) e imprime NANO_LAMBDA_AGENT_READY
+# 3. Para cada requisicao do host ({"input": ...}) grava o input.txt,
+#    chama handler.main() com o stdout capturado e responde com um item
+#    (mesmo frame do lote: cabecalho JSON + dados crus)
+# 4. Sem requisicao por nano_lambda.agent_idle segundos (o host sumiu),
+#    sai e o /run-function.sh desliga a VM. Um keepalive do host
+#    ({"ping": true}, resposta com item vazio) conta como requisicao
+import importlib.util
+import json
+import os
+import socket
+import sys
+
+import nanolambda
+
+AGENT_PORT = 10001
+READY_MARKER = "NANO_LAMBDA_AGENT_READY"
+
+
+def idle_timeout():
+    with open("/proc/cmdline") as f:
+        for arg in f.read().split():
+            if arg.startswith("nano_lambda.agent_idle="):
+                return int(arg.split("=", 1)[1]) or None
+    return None
+
+
+def recv_exact(conn, size):
+    buf = b""
+    while len(buf) < size:
+        chunk = conn.recv(size - len(buf))
+        if not chunk:
+            raise EOFError
+        buf += chunk
+    return buf
+
+
+def handle(handler, input_data):
+    header, data = nanolambda.run_handler(handler, input_data)
+    meta = json.dumps(header).encode("utf-8")
+    return nanolambda.ITEM_HEADER.pack(len(meta)) + meta + data
+
+
+def serve(handler, conn):
+    while True:
+        kind, size = nanolambda.HEADER.unpack(recv_exact(conn, nanolambda.HEADER.size))
+        request = json.loads(recv_exact(conn, size))
+        if "input" not in request:
+            # Keepalive do agente ocioso: so zera o timeout
+            conn.sendall(nanolambda.HEADER.pack(nanolambda.KIND_ITEM, 0))
+            continue
+        frame = handle(handler, request["input"])
+        conn.sendall(nanolambda.HEADER.pack(nanolambda.KIND_ITEM, len(frame)) + frame)
+
+
+def main():
+    os.chdir("/functions")
+    sys.path.insert(0, "/functions")
+    spec = importlib.util.spec_from_file_location("handler", "/functions/handler.py")
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+
+    server = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+    server.bind((socket.VMADDR_CID_ANY, AGENT_PORT))
+    server.listen(1)
+    server.settimeout(idle_timeout())
+    print(READY_MARKER, flush=True)
+    while True:
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            print("[agente] ocioso, desligando", flush=True)
+            return
+        conn.settimeout(server.gettimeout())
+        try:
+            serve(handler, conn)
+        except (EOFError, OSError):
+            # Host fechou a conexao (ou timeout ocioso): espera outra
+            pass
+        finally:
+            conn.close()
+
+
+main()
+RUNNER
+    chmod +x /agent-runner.py
 '
 
-echo "[5/6] Limpando caches..."
+# Biblioteca do guest para devolver resultados por vsock (import nanolambda)
+SITE_PACKAGES=$(ls -d "${MOUNT_POINT}"/usr/lib/python3*/site-packages | head -n 1)
+cp "${SCRIPT_DIR}/guest/nanolambda.py" "${SITE_PACKAGES}/"
+
+echo "[5/6] Pre-compilando bytecode e limpando caches..."
+# .pyc com hash nao verificado: o import nao compara com o .py (o rootfs
+# e um template imutavel). Sem -j: o chroot nao tem /dev/shm
 chroot "${MOUNT_POINT}" /bin/sh -c '
+    python3 -m compileall -q -f --invalidation-mode unchecked-hash /usr/lib/python3* \
+        || [ $? -eq 1 ]
     rm -rf /var/cache/apk/*
     rm -rf /tmp/*
 '
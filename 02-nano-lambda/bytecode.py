@@ -0,0 +1,161 @@
+"""
+bytecode.py - Bytecode pre-compilado e bundle de imports no rootfs do guest
+
+Boa parte do cold start e o Python do guest importando modulos: para
+cada import o interpretador procura o .py, compara o mtime com o .pyc do
+__pycache__ e, sem .pyc (o rootfs do Alpine nao traz), compila do zero
+e tenta gravar o cache. Aqui isso e feito uma vez so, na construcao da
+imagem, com o Python do proprio guest (chroot):
+
+- compileall com --invalidation-mode unchecked-hash: o .pyc e usado sem
+  olhar o .py (sem stat por modulo). Serve porque a imagem e imutavel;
+  quem mudar um .py dentro dela precisa recompilar.
+- bundle opcional: pacotes puros (sem extensoes C) das dependencias vao
+  num zip lido pelo zipimport, um arquivo aberto no lugar de uma arvore
+  de diretorios. Pacotes que leem dados pelo __file__ nao funcionam de
+  dentro do zip; por isso e opcional.
+- perfil de imports (-X importtime) do handler, sem e com bytecode.
+  Opcional e desligado por padrao: importar o handler executa o codigo
+  da funcao no host, como root, fora da VM (o chroot nao isola nada).
+
+Uso:
+    compile_tree(mount_point, ["/functions"])
+    profile = profile_imports(mount_point, "importtime.txt")
+    print(profile["import_s"], profile["import_nocache_s"])
+"""
+
+import re
+import subprocess
+import time
+
+PYC_INVALIDATION = "unchecked-hash"
+# Zip das dependencias dentro do guest (entra no sys.path por um .pth)
+DEPS_BUNDLE = "/usr/lib/nano-lambda/deps.zip"
+# Linhas do -X importtime guardadas no perfil (maiores tempos proprios)
+IMPORTTIME_TOP = 30
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+# Roda dentro do guest: separa os pacotes puros de /tmp/deps (pip --target)
+# num zip com .py + .pyc ao lado (layout que o zipimport procura); os com
+# extensoes C vao para o site-packages
+_BUNDLE_SCRIPT = r"""
+import os, py_compile, shutil, sys, sysconfig, zipfile
+src, bundle = sys.argv[1], sys.argv[2]
+site = sysconfig.get_paths()["purelib"]
+os.makedirs(os.path.dirname(bundle), exist_ok=True)
+zipped = []
+with zipfile.ZipFile(bundle, "w", zipfile.ZIP_STORED) as zf:
+    for name in sorted(os.listdir(src)):
+        path = os.path.join(src, name)
+        if name in ("bin", "__pycache__"):
+            continue
+        files = ([os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs]
+                 if os.path.isdir(path) else [path])
+        if any(f.endswith(".so") for f in files):
+            if os.path.isdir(path):
+                shutil.copytree(path, os.path.join(site, name), dirs_exist_ok=True)
+            else:
+                shutil.copy(path, site)
+            continue
+        for f in files:
+            if "__pycache__" in f or f.endswith(".pyc"):
+                continue
+            arc = os.path.relpath(f, src)
+            zf.write(f, arc)
+            if f.endswith(".py"):
+                pyc = py_compile.compile(
+                    f, cfile=f + "c", doraise=True,
+                    invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+                zf.write(pyc, arc + "c")
+        zipped.append(name)
+with open(os.path.join(site, "nano-lambda-deps.pth"), "w") as f:
+    f.write(bundle + "\n")
+shutil.rmtree(src)
+print(" ".join(zipped))
+"""
+
+
+def _chroot(mount_point, *args, cwd="/"):
+    return subprocess.run(["chroot", mount_point, "sh", "-c", f'cd {cwd} && exec "$@"', "sh",
+                           *args], capture_output=True, text=True)
+
+
+def site_packages(mount_point):
+    """site-packages do guest (caminho dentro do rootfs)."""
+    result = _chroot(mount_point, "python3", "-c",
+                     "import sysconfig; print(sysconfig.get_paths()['purelib'])")
+    if result.returncode != 0:
+        raise Exception(f"python3 do rootfs falhou:\n{result.stderr}")
+    return result.stdout.strip()
+
+
+def compile_tree(mount_point, paths):
+    """Pre-compila `paths` (dentro do guest) com hash nao verificado."""
+    # Sem -j: o ProcessPoolExecutor precisa do /dev/shm, que o chroot nao tem
+    result = _chroot(mount_point, "python3", "-m", "compileall", "-q", "-f",
+                     "--invalidation-mode", PYC_INVALIDATION, *paths)
+    # compileall sai com 1 se algum arquivo nao compila (ex: testes de
+    # pacotes com sintaxe de outra versao); o resto foi compilado
+    if result.returncode not in (0, 1):
+        raise Exception(f"compileall falhou no rootfs:\n{result.stdout}{result.stderr}")
+
+
+def bundle_deps(mount_point, deps_dir):
+    """
+    Empacota os pacotes puros de `deps_dir` (pip --target, caminho no
+    guest) no DEPS_BUNDLE. Retorna os nomes que foram para o zip.
+    """
+    result = _chroot(mount_point, "python3", "-c", _BUNDLE_SCRIPT, deps_dir, DEPS_BUNDLE)
+    if result.returncode != 0:
+        raise Exception(f"bundle das dependencias falhou:\n{result.stderr}")
+    return result.stdout.split()
+
+
+def _import_handler(mount_point, *flags):
+    """Importa o handler no guest; retorna (saida do -X importtime, segundos)."""
+    start = time.time()
+    result = _chroot(mount_point, "python3", *flags, "-X", "importtime",
+                     "-c", "import handler", cwd="/functions")
+    elapsed = time.time() - start
+    if result.returncode != 0:
+        raise Exception(f"import do handler falhou:\n{result.stderr}")
+    return result.stderr, elapsed
+
+
+def _handler_import_s(output):
+    """Tempo acumulado do import do handler (ultima linha do -X importtime)."""
+    for line in reversed(output.splitlines()):
+        match = _IMPORTTIME.match(line)
+        if match and match.group(4) == "handler":
+            return int(match.group(2)) / 1e6
+    return None
+
+
+def profile_imports(mount_point, output_file=None):
+    """
+    Mede o import do handler sem bytecode (pycache_prefix vazio, nada
+    gravado) e com o bytecode da imagem. Grava em `output_file` as
+    IMPORTTIME_TOP linhas com maior tempo proprio.
+
+    Retorna import_s/import_nocache_s (so imports) e startup_s/
+    startup_nocache_s (processo inteiro, com o interpretador).
+
+    Roda o codigo do handler no host (chroot, como root): so para
+    funcoes confiaveis.
+    """
+    nocache, nocache_s = _import_handler(
+        mount_point, "-B", "-X", "pycache_prefix=/tmp/nano-lambda-nopyc")
+    cached, cached_s = _import_handler(mount_point)
+    if output_file:
+        rows = [line for line in cached.splitlines() if _IMPORTTIME.match(line)]
+        rows.sort(key=lambda line: -int(_IMPORTTIME.match(line).group(1)))
+        with open(output_file, "w") as f:
+            f.write("import time: self [us] | cumulative | imported package\n")
+            f.write("\n".join(rows[:IMPORTTIME_TOP]) + "\n")
+    return {
+        "import_s": _handler_import_s(cached),
+        "import_nocache_s": _handler_import_s(nocache),
+        "startup_s": cached_s,
+        "startup_nocache_s": nocache_s,
+    }
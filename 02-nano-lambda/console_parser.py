@@ -0,0 +1,236 @@
+"""
+console_parser.py - Parser incremental do console serial da microVM
+
+O console era gravado num arquivo fixo, lido inteiro de volta e varrido
+com find() atras dos marcadores. Para outputs grandes isso significa
+varias copias em memoria mais I/O de disco.
+
+Aqui o output chega em pedacos direto do pipe do Firecracker e passa
+por uma maquina de estados:
+
+    LOG ---BASE64_IMAGE_START---> BASE64 ---BASE64_IMAGE_END---> LOG
+    LOG ---JSON_RESULT_START----> JSON   ---JSON_RESULT_END----> LOG
+
+- BASE64: decodifica conforme chega (nao guarda o texto base64); linha
+  fora do alfabeto base64 (log do kernel no meio do bloco) vai para o log
+- JSON: acumula ate um limite e faz json.loads no fim do bloco
+- LOG: as ultimas linhas ficam num ring buffer de tamanho fixo
+
+Blocos JSON {"batch_item": ...} sao itens de um lote (sem vsock, ver
+send_item do guest) e vao para `items` em vez de virar o resultado.
+
+Uso:
+    parser = ConsoleParser()
+    for chunk in pedacos_do_pipe:
+        parser.feed(chunk)
+    resultado = parser.result()
+"""
+
+import base64
+import binascii
+import collections
+import json
+
+BASE64_START = b"BASE64_IMAGE_START"
+BASE64_END = b"BASE64_IMAGE_END"
+JSON_START = b"JSON_RESULT_START"
+JSON_END = b"JSON_RESULT_END"
+
+STATE_LOG = "log"
+STATE_BASE64 = "base64"
+STATE_JSON = "json"
+
+# Alfabeto do base64 (com padding)
+_B64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+
+
+class ConsoleParser:
+    """
+    Parser incremental do console.
+
+    `max_log_lines` limita o ring buffer de log, `max_line_bytes` o
+    tamanho de cada linha guardada e `max_json_bytes` o bloco JSON.
+    Se `image_sink` for passado (objeto com write()), os bytes da
+    imagem vao para ele em vez de ficar em memoria.
+    """
+
+    def __init__(self, max_log_lines=500, max_line_bytes=4096,
+                 max_json_bytes=16 * 1024 * 1024, image_sink=None):
+        self.max_line_bytes = max_line_bytes
+        self.max_json_bytes = max_json_bytes
+        self.image_sink = image_sink
+
+        self.log = collections.deque(maxlen=max_log_lines)
+        self.state = STATE_LOG
+        self._line = bytearray()
+        self._pending = b""        # possivel prefixo do marcador de fim
+        self._b64_line = bytearray()  # linha do bloco base64 em aberto
+        self._b64_rest = b""       # base64 que ainda nao fecha 4 caracteres
+        self._json = bytearray()
+        self._json_overflow = False
+
+        self.image = bytearray() if image_sink is None else None
+        self.image_size = 0
+        self.image_complete = False
+        self.image_error = False
+        self.json_data = None
+        self.json_complete = False
+        self.items = []
+
+    def feed(self, chunk):
+        """Processa mais um pedaco do console (bytes)."""
+        while chunk:
+            if self.state == STATE_LOG:
+                chunk = self._feed_log(chunk)
+            elif self.state == STATE_BASE64:
+                chunk = self._feed_block(chunk, BASE64_END, self._on_base64,
+                                         self._end_base64)
+            else:
+                chunk = self._feed_block(chunk, JSON_END, self._on_json,
+                                         self._end_json)
+
+    def _feed_log(self, chunk):
+        """Consome linhas de log ate achar um marcador de inicio."""
+        start = 0
+        while True:
+            nl = chunk.find(b"\n", start)
+            if nl < 0:
+                self._append_line(chunk[start:])
+                return b""
+            self._append_line(chunk[start:nl])
+            line = bytes(self._line).strip()
+            self._line.clear()
+            start = nl + 1
+
+            if line == BASE64_START:
+                self.state = STATE_BASE64
+                return chunk[start:]
+            if line == JSON_START:
+                self.state = STATE_JSON
+                self._json.clear()
+                self._json_overflow = False
+                return chunk[start:]
+            self.log.append(line.decode("utf-8", errors="replace"))
+
+    def _append_line(self, data):
+        room = self.max_line_bytes - len(self._line)
+        if room > 0:
+            self._line += data[:room]
+
+    def _feed_block(self, chunk, end_marker, on_data, on_end):
+        """
+        Entrega dados de um bloco ate o marcador de fim.
+
+        O marcador pode chegar quebrado entre dois pedacos, entao os
+        ultimos bytes que podem ser o comeco dele ficam pendentes.
+        """
+        data = self._pending + chunk
+        idx = data.find(end_marker)
+        if idx >= 0:
+            self._pending = b""
+            on_data(data[:idx])
+            on_end()
+            self.state = STATE_LOG
+            # O resto da linha do marcador e descartado
+            return data[idx + len(end_marker):]
+
+        keep = len(end_marker) - 1
+        self._pending = data[-keep:]
+        on_data(data[:-keep])
+        return b""
+
+    def _on_base64(self, data):
+        """Separa o bloco em linhas; cada linha e validada inteira."""
+        start = 0
+        while True:
+            nl = data.find(b"\n", start)
+            if nl < 0:
+                self._b64_line += data[start:]
+                if len(self._b64_line) > self.max_line_bytes:
+                    # Base64 sem quebra de linha: decodifica o que ja chegou
+                    self._on_base64_line(bytes(self._b64_line))
+                    self._b64_line.clear()
+                return
+            self._b64_line += data[start:nl]
+            self._on_base64_line(bytes(self._b64_line))
+            self._b64_line.clear()
+            start = nl + 1
+
+    def _on_base64_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        if line.translate(None, _B64_ALPHABET):
+            # Nao e base64 (ex: printk do kernel no meio do bloco)
+            self.log.append(line[:self.max_line_bytes].decode("utf-8", errors="replace"))
+            return
+        data = self._b64_rest + line
+        usable = len(data) - len(data) % 4
+        self._b64_rest = data[usable:]
+        if usable:
+            self._decode_image(data[:usable])
+
+    def _decode_image(self, data):
+        if self.image_error:
+            return
+        try:
+            self._write_image(base64.b64decode(data, validate=True))
+        except binascii.Error as e:
+            self.image_error = True
+            self.log.append(f"[nano-lambda] base64 invalido: {e}")
+
+    def _end_base64(self):
+        self._on_base64_line(bytes(self._b64_line))
+        self._b64_line.clear()
+        if self._b64_rest:
+            # Padding faltando: completa para decodificar o que der
+            rest = self._b64_rest + b"=" * (-len(self._b64_rest) % 4)
+            self._b64_rest = b""
+            self._decode_image(rest)
+        self.image_complete = True
+
+    def _write_image(self, data):
+        self.image_size += len(data)
+        if self.image_sink is not None:
+            self.image_sink.write(data)
+        else:
+            self.image += data
+
+    def _on_json(self, data):
+        if len(self._json) + len(data) > self.max_json_bytes:
+            self._json_overflow = True
+            return
+        self._json += data
+
+    def _end_json(self):
+        if self._json_overflow:
+            self.log.append("[nano-lambda] bloco JSON maior que o limite, descartado")
+        else:
+            try:
+                data = json.loads(bytes(self._json))
+                if isinstance(data, dict) and "batch_item" in data:
+                    self.items.append(json.loads(base64.b64decode(data["batch_item"])))
+                else:
+                    self.json_data = data
+                    self.json_complete = True
+            except ValueError:
+                pass
+        self._json.clear()
+
+    def log_text(self):
+        """Linhas de log guardadas no ring buffer (mais a linha em aberto)."""
+        lines = list(self.log)
+        if self.state == STATE_LOG and self._line:
+            lines.append(bytes(self._line).decode("utf-8", errors="replace"))
+        return "\n".join(lines)
+
+    def result(self):
+        """Resultado no formato do parse_output (imagem ja decodificada)."""
+        if self.json_complete:
+            return {"success": True, "type": "json", "data": self.json_data,
+                    "log": self.log_text()}
+        if self.image_complete and not self.image_error:
+            data = bytes(self.image) if self.image is not None else None
+            return {"success": True, "type": "image", "data": data,
+                    "size": self.image_size, "log": self.log_text()}
+        return {"success": False, "type": "text", "data": self.log_text()}
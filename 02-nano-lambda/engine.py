@@ -0,0 +1,221 @@
+"""
+engine.py - Motor asyncio para invocacoes concorrentes do nano-Lambda
+
+Cada invocacao ganha um ID unico, e com ele seu proprio socket de API,
+pipe de console, clone de rootfs e drive de input: nada e compartilhado
+entre VMs. O motor roda varias VMs em paralelo, limitado por um
+orcamento de vCPUs e memoria do host.
+
+Uso:
+    engine = InvocationEngine(lambda inv_id: NanoLambda(vm_id=inv_id))
+    resultado = await engine.invoke("handler.py", "input")
+    relatorio = await engine.throughput_report("handler.py", "input")
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import time
+import uuid
+
+
+def host_memory_mib():
+    """Memoria disponivel no host (MemAvailable), em MiB."""
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) // 1024
+    return 0
+
+
+def new_invocation_id():
+    return uuid.uuid4().hex[:12]
+
+
+def percentile(values, pct):
+    """Percentil por vizinho mais proximo (values ja ordenado)."""
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+    return values[idx]
+
+
+class InvocationEngine:
+    """
+    Executa invocacoes em paralelo dentro do orcamento do host.
+
+    `runner_factory(invocation_id)` cria o runner (ex: NanoLambda) da
+    invocacao. Cada VM reserva `vcpus_per_vm` e `mem_per_vm_mib` do
+    orcamento; invocacoes que nao cabem esperam na fila.
+    """
+
+    def __init__(self, runner_factory, vcpus_per_vm=1, mem_per_vm_mib=256,
+                 max_vcpus=None, max_mem_mib=None):
+        self.runner_factory = runner_factory
+        self.vcpus_per_vm = vcpus_per_vm
+        self.mem_per_vm_mib = mem_per_vm_mib
+        self.max_vcpus = max_vcpus or os.cpu_count() or 1
+        # Por padrao deixa 20% da memoria livre para o host
+        self.max_mem_mib = max_mem_mib or int(host_memory_mib() * 0.8)
+
+        max_vms = max(1, min(self.max_vcpus // vcpus_per_vm,
+                             self.max_mem_mib // mem_per_vm_mib))
+        self.max_concurrency = max_vms
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_vms, thread_name_prefix="nano-lambda"
+        )
+        self._cond = None
+        self._vcpus_used = 0
+        self._mem_used = 0
+        self._running = 0
+        self._active = {}
+        self._closing = False
+
+    def _condition(self):
+        # Criada sob demanda para ficar no event loop em uso
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _fits(self):
+        return (self._vcpus_used + self.vcpus_per_vm <= self.max_vcpus
+                and self._mem_used + self.mem_per_vm_mib <= self.max_mem_mib)
+
+    async def _reserve(self):
+        cond = self._condition()
+        async with cond:
+            # Sempre deixa pelo menos uma VM rodar, mesmo com orcamento apertado
+            await cond.wait_for(lambda: self._fits() or self._running == 0)
+            self._running += 1
+            self._vcpus_used += self.vcpus_per_vm
+            self._mem_used += self.mem_per_vm_mib
+
+    async def _release(self):
+        cond = self._condition()
+        async with cond:
+            self._running -= 1
+            self._vcpus_used -= self.vcpus_per_vm
+            self._mem_used -= self.mem_per_vm_mib
+            cond.notify_all()
+
+    def _run(self, invocation_id, function_path, input_data):
+        runner = self.runner_factory(invocation_id)
+        self._active[invocation_id] = runner
+        try:
+            if self._closing:
+                # close() ja passou por aqui: a VM morre assim que subir
+                runner.kill()
+            return runner.invoke(function_path, input_data)
+        finally:
+            self._active.pop(invocation_id, None)
+
+    async def invoke(self, function_path, input_data, invocation_id=None):
+        """Invoca a funcao numa VM propria e retorna o resultado."""
+        invocation_id = invocation_id or new_invocation_id()
+        queued_at = time.time()
+        await self._reserve()
+        started_at = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self._executor, self._run, invocation_id, function_path, input_data
+            )
+        finally:
+            await self._release()
+
+        result["invocation_id"] = invocation_id
+        timings = result.setdefault("timings", {})
+        timings["queue"] = started_at - queued_at
+        timings["total"] = time.time() - queued_at
+        return result
+
+    async def invoke_many(self, function_path, inputs):
+        """
+        Invoca a funcao para cada input em paralelo (ordem preservada).
+
+        Uma invocacao que levanta excecao (spawn, API) vira um resultado
+        de falha: as outras nao se perdem.
+        """
+        ids = [new_invocation_id() for _ in inputs]
+        results = await asyncio.gather(
+            *(self.invoke(function_path, input_data, invocation_id)
+              for input_data, invocation_id in zip(inputs, ids)),
+            return_exceptions=True
+        )
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                results[i] = {"success": False, "type": "text",
+                              "data": f"erro na invocacao: {result}", "error": str(result),
+                              "log": "", "invocation_id": ids[i], "timings": {}}
+        return results
+
+    async def throughput_report(self, function_path, input_data,
+                                concurrencies=(1, 2, 4, 8), invocations=16):
+        """
+        Mede invocacoes por segundo para cada nivel de concorrencia.
+
+        Para cada nivel dispara `invocations` invocacoes com no maximo
+        `concurrency` em voo ao mesmo tempo.
+        """
+        report = []
+        for concurrency in concurrencies:
+            sem = asyncio.Semaphore(concurrency)
+            latencies = []
+            failures = 0
+
+            async def one():
+                nonlocal failures
+                async with sem:
+                    start = time.time()
+                    try:
+                        result = await self.invoke(function_path, input_data)
+                        if not result.get("success"):
+                            failures += 1
+                    except Exception:
+                        failures += 1
+                    latencies.append(time.time() - start)
+
+            start = time.time()
+            await asyncio.gather(*(one() for _ in range(invocations)))
+            elapsed = time.time() - start
+
+            latencies.sort()
+            report.append({
+                "concurrency": concurrency,
+                "invocations": invocations,
+                "failures": failures,
+                "elapsed_s": elapsed,
+                "invocations_per_s": invocations / elapsed if elapsed else 0.0,
+                "p50_s": percentile(latencies, 50),
+                "p95_s": percentile(latencies, 95),
+            })
+        return report
+
+    def stats(self):
+        return {
+            "running": self._running,
+            "vcpus_used": self._vcpus_used,
+            "max_vcpus": self.max_vcpus,
+            "mem_used_mib": self._mem_used,
+            "max_mem_mib": self.max_mem_mib,
+            "max_concurrency": self.max_concurrency,
+        }
+
+    def close(self):
+        """
+        Interrompe as VMs em andamento (ex: Ctrl+C) e encerra as threads.
+
+        Os runners so sao marcados (kill()): o cleanup() de cada VM fica
+        com a thread que a esta invocando, e o shutdown espera por elas.
+        """
+        self._closing = True
+        for runner in list(self._active.values()):
+            runner.kill()
+        self._executor.shutdown(wait=True)
+
+
+def print_throughput_report(report):
+    print(f"{'concorrencia':>12} {'invoc/s':>9} {'p50':>8} {'p95':>8} {'falhas':>7}")
+    for row in report:
+        print(f"{row['concurrency']:>12} {row['invocations_per_s']:>9.2f} "
+              f"{row['p50_s']:>7.3f}s {row['p95_s']:>7.3f}s {row['failures']:>7}")
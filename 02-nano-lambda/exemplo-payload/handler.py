@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Função nano-Lambda: gerador de payload para benchmark
+
+Lê "<bytes> <canal>" de /functions/input.txt e devolve essa
+quantidade de bytes aleatórios pelo canal pedido (vsock ou
+console). Usada pelo --payload-benchmark do nano-lambda.py.
+"""
+
+import os
+import sys
+
+import nanolambda
+
+
+def main():
+    try:
+        with open('/functions/input.txt', 'r') as f:
+            size, channel = f.read().split()
+    except (FileNotFoundError, ValueError):
+        print("ERRO: input deve ser '<bytes> <canal>'")
+        sys.exit(1)
+
+    data = os.urandom(int(size))
+    used = nanolambda.send_bytes(data, channel=channel)
+    print(f"{len(data)} bytes enviados via {used}")
+
+
+if __name__ == '__main__':
+    main()
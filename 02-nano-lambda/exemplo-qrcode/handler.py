@@ -3,14 +3,21 @@
 Função nano-Lambda: Gerador de QR Code
 
 Lê o texto de /functions/input.txt e gera um QR Code.
-O resultado é salvo em /output/qrcode.png e também
-impresso em base64 no stdout para captura externa.
+O resultado é salvo em /output/qrcode.png e devolvido ao host
+pelo vsock (biblioteca nanolambda) ou, sem ela, impresso em
+base64 no stdout para captura externa.
 """
 
 import qrcode
 import sys
 import base64
 
+try:
+    # Biblioteca do nano-Lambda no rootfs: resultado por vsock
+    import nanolambda
+except ImportError:
+    nanolambda = None
+
 
 def main():
     # Lê o input do arquivo padrão
@@ -47,16 +54,20 @@ def main():
     output_path = '/output/qrcode.png'
     img.save(output_path)
 
-    # Também imprime em base64 no stdout
-    # Isso permite capturar o resultado de fora da VM
     with open(output_path, 'rb') as f:
-        img_base64 = base64.b64encode(f.read()).decode('utf-8')
+        img_data = f.read()
 
     print(f"QR Code gerado com sucesso!")
 
+    # Devolve a imagem ao host: por vsock (binario) quando disponivel,
+    # senao em base64 no stdout (console serial)
+    if nanolambda:
+        nanolambda.send_image(img_data)
+        return
+
     # Marcadores para o nano-lambda.py encontrar a imagem
     print(f"BASE64_IMAGE_START")
-    print(img_base64)
+    print(base64.b64encode(img_data).decode('utf-8'))
     print(f"BASE64_IMAGE_END")
 
 
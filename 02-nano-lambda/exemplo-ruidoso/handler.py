@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Função nano-Lambda: vizinho barulhento para benchmark de QoS
+
+Lê "<segundos> <MiB>" de /functions/input.txt e passa esse tempo
+regravando um arquivo de <MiB> no rootfs com fsync a cada bloco,
+saturando o disco do host. Usada pelo --qos-benchmark do
+nano-lambda.py.
+"""
+
+import os
+import sys
+import time
+
+BLOCK = 1024 * 1024
+
+
+def main():
+    try:
+        with open('/functions/input.txt', 'r') as f:
+            seconds, size_mib = f.read().split()
+    except (FileNotFoundError, ValueError):
+        print("ERRO: input deve ser '<segundos> <MiB>'")
+        sys.exit(1)
+
+    block = os.urandom(BLOCK)
+    deadline = time.time() + float(seconds)
+    written = 0
+    fd = os.open('/tmp/ruido.bin', os.O_WRONLY | os.O_CREAT)
+    try:
+        while time.time() < deadline:
+            os.lseek(fd, 0, os.SEEK_SET)
+            for _ in range(int(size_mib)):
+                os.write(fd, block)
+                os.fsync(fd)
+                written += BLOCK
+                if time.time() >= deadline:
+                    break
+    finally:
+        os.close(fd)
+        os.remove('/tmp/ruido.bin')
+
+    print(f"{written // BLOCK} MiB gravados em {seconds}s")
+
+
+if __name__ == '__main__':
+    main()
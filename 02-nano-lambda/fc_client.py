@@ -0,0 +1,300 @@
+"""
+fc_client.py - Cliente HTTP/1.1 minimo para a API do Firecracker
+
+O requests_unixsocket cria uma Session (e uma conexao) nova a cada
+chamada, e so importar o requests ja pesa no startup do CLI. Este
+cliente fala HTTP/1.1 direto num socket AF_UNIX:
+
+- uma conexao persistente (keep-alive) por VM
+- pipeline(): envia varias chamadas de configuracao de uma vez e
+  le as respostas em ordem
+- render_config(): gera o JSON para iniciar o Firecracker com
+  --config-file, sem nenhuma chamada de API antes do boot
+
+Benchmark (requer root, Firecracker, kernel e rootfs):
+    sudo python3 fc_client.py --iterations 20
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+class ApiResponse:
+    """Resposta da API (subconjunto da interface do requests)."""
+
+    def __init__(self, status_code, reason, body):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = body
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content) if self.content else None
+
+
+class FirecrackerClient:
+    """Conexao HTTP/1.1 persistente com o socket de API de uma VM."""
+
+    def __init__(self, socket_path, timeout=10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._buf = b""
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self._sock = sock
+        self._buf = b""
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        self._buf = b""
+
+    def _encode(self, method, path, data=None):
+        body = json.dumps(data).encode("utf-8") if data is not None else b""
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            "Accept: application/json\r\n"
+        )
+        if data is not None:
+            head += "Content-Type: application/json\r\n"
+        head += f"Content-Length: {len(body)}\r\n\r\n"
+        return head.encode("ascii") + body
+
+    def _recv_more(self):
+        chunk = self._sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("Firecracker fechou a conexao da API")
+        self._buf += chunk
+
+    def _read_response(self):
+        while b"\r\n\r\n" not in self._buf:
+            self._recv_more()
+        head, self._buf = self._buf.split(b"\r\n\r\n", 1)
+        lines = head.decode("latin-1").split("\r\n")
+        _, status, *reason = lines[0].split(" ", 2)
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", "0"))
+        while len(self._buf) < length:
+            self._recv_more()
+        body, self._buf = self._buf[:length], self._buf[length:]
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return ApiResponse(int(status), reason[0] if reason else "", body)
+
+    def _exchange(self, payload, count):
+        """Envia payload (uma ou mais requisicoes) e le `count` respostas."""
+        reused = self._sock is not None
+        if not reused:
+            self._connect()
+        answered = False
+        try:
+            self._sock.sendall(payload)
+            # Ate o primeiro byte da resposta e seguro reenviar
+            if not self._buf:
+                self._recv_more()
+            answered = True
+            return [self._read_response() for _ in range(count)]
+        except (ConnectionError, BrokenPipeError):
+            self.close()
+            if not reused or answered:
+                # Com resposta a caminho o Firecracker pode ja ter aplicado a
+                # chamada (InstanceStart, snapshot/load): nao reenvia
+                raise
+            # A conexao reaproveitada tinha sido fechada do outro lado
+            # antes de responder: reconecta e tenta de novo uma vez
+            self._connect()
+            self._sock.sendall(payload)
+            return [self._read_response() for _ in range(count)]
+
+    @staticmethod
+    def _check(resp):
+        if resp.status_code >= 400:
+            raise Exception(f"API error {resp.status_code}: {resp.text}")
+        return resp
+
+    def request(self, method, path, data=None):
+        """Faz uma chamada e levanta Exception em erro HTTP."""
+        (resp,) = self._exchange(self._encode(method, path, data), 1)
+        return self._check(resp)
+
+    def pipeline(self, requests):
+        """
+        Envia varias chamadas (method, path, data) de uma vez.
+
+        As respostas chegam na ordem das requisicoes; levanta
+        Exception na primeira que falhar.
+        """
+        payload = b"".join(self._encode(m, p, d) for m, p, d in requests)
+        responses = self._exchange(payload, len(requests))
+        for resp in responses:
+            self._check(resp)
+        return responses
+
+
+def render_config(boot_source, drives, machine_config, network_interfaces=None,
+                  **extra):
+    """
+    Monta o JSON aceito por `firecracker --config-file`.
+
+    As chaves sao as mesmas dos endpoints da API (boot-source,
+    drives, machine-config, ...). `extra` aceita outras secoes,
+    ex: vsock=..., balloon=... (use _ no lugar de -).
+    """
+    config = {
+        "boot-source": boot_source,
+        "drives": drives,
+        "machine-config": machine_config,
+    }
+    if network_interfaces:
+        config["network-interfaces"] = network_interfaces
+    for key, value in extra.items():
+        if value is not None:
+            config[key.replace("_", "-")] = value
+    return config
+
+
+def write_config(config, directory=None):
+    """Grava o config num arquivo temporario e retorna o caminho."""
+    fd, path = tempfile.mkstemp(suffix=".json", prefix="fc-config-", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        json.dump(config, f)
+    return path
+
+
+def _wait_socket(path, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(path):
+            return
+        time.sleep(0.001)
+    raise Exception("Timeout esperando socket do Firecracker")
+
+
+def _legacy_call(socket_path, method, path, data=None):
+    """Caminho antigo: uma Session do requests_unixsocket por chamada."""
+    import requests_unixsocket
+
+    session = requests_unixsocket.Session()
+    url = f"http+unix://{socket_path.replace('/', '%2F')}{path}"
+    resp = session.request(method, url, json=data)
+    if resp.status_code >= 400:
+        raise Exception(f"API error {resp.status_code}: {resp.text}")
+    return resp
+
+
+def benchmark(firecracker_bin, kernel, rootfs, iterations=10):
+    """
+    Mede spawn + configuracao da VM em cada modo de API.
+
+    Modos: legacy (requests_unixsocket), keepalive, pipeline e
+    config-file. A VM nao recebe InstanceStart (exceto no
+    config-file, onde o boot e automatico); medimos ate a API
+    confirmar a configuracao.
+    """
+    socket_path = f"/tmp/fc-client-bench-{os.getpid()}.socket"
+    requests = [
+        ("PUT", "/boot-source", {
+            "kernel_image_path": kernel,
+            "boot_args": "console=ttyS0 reboot=k panic=1 pci=off quiet"
+        }),
+        ("PUT", "/drives/rootfs", {
+            "drive_id": "rootfs",
+            "path_on_host": rootfs,
+            "is_root_device": True,
+            "is_read_only": True
+        }),
+        ("PUT", "/machine-config", {"vcpu_count": 1, "mem_size_mib": 128}),
+    ]
+    config = render_config(requests[0][2], [requests[1][2]], requests[2][2])
+    config_file = write_config(config)
+
+    results = {}
+    try:
+        for mode in ("legacy", "keepalive", "pipeline", "config-file"):
+            times = []
+            for _ in range(iterations):
+                if os.path.exists(socket_path):
+                    os.remove(socket_path)
+                cmd = [firecracker_bin, "--api-sock", socket_path]
+                if mode == "config-file":
+                    cmd += ["--config-file", config_file]
+
+                start = time.time()
+                proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+                try:
+                    _wait_socket(socket_path)
+                    client = FirecrackerClient(socket_path)
+                    if mode == "legacy":
+                        for method, path, data in requests:
+                            _legacy_call(socket_path, method, path, data)
+                    elif mode == "keepalive":
+                        for method, path, data in requests:
+                            client.request(method, path, data)
+                    elif mode == "pipeline":
+                        client.pipeline(requests)
+                    else:
+                        client.request("GET", "/machine-config")
+                    times.append(time.time() - start)
+                    client.close()
+                finally:
+                    proc.kill()
+                    proc.wait()
+
+            times.sort()
+            results[mode] = {
+                "avg_s": sum(times) / len(times),
+                "p50_s": times[len(times) // 2],
+                "max_s": times[-1],
+            }
+    finally:
+        os.remove(config_file)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos modos de API do Firecracker")
+    parser.add_argument("--firecracker", default="./firecracker")
+    parser.add_argument("--kernel", default="./vmlinux.bin")
+    parser.add_argument("--rootfs", default="./rootfs-python.ext4")
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    if os.geteuid() != 0:
+        print("Erro: Execute como root (sudo)")
+        sys.exit(1)
+
+    results = benchmark(os.path.abspath(args.firecracker), os.path.abspath(args.kernel),
+                        os.path.abspath(args.rootfs), args.iterations)
+
+    print(f"{'modo':<12} {'media':>9} {'p50':>9} {'max':>9}")
+    for mode, r in results.items():
+        print(f"{mode:<12} {r['avg_s'] * 1000:>7.1f}ms {r['p50_s'] * 1000:>7.1f}ms "
+              f"{r['max_s'] * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
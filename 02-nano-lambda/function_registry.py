@@ -0,0 +1,411 @@
+"""
+function_registry.py - Registro de funcoes com rootfs pre-construido
+
+Sem o registro, cada invocacao clona o rootfs generico do build-rootfs.sh
+e copia o handler para dentro; dependencias extras nao tem onde ficar.
+Aqui registrar uma funcao (handler + requirements.txt) constroi uma vez
+uma imagem imutavel: clone do rootfs base com o handler em /functions e
+as dependencias instaladas com pip (chroot), tudo pre-compilado para .pyc
+(ver bytecode.py). As invocacoes usam a imagem pelo nome da funcao ou
+pelo ID e so entregam o input.
+
+Layout:
+
+    REGISTRY_DIR/
+        names/<nome>.json        {"id": ..., "qos": ...}: versao atual (troca
+                                 atomica) e perfil de QoS (qos.py)
+        images/<id>/
+            rootfs.ext4          imagem da funcao (somente leitura)
+            handler.py           copias das entradas, para reconstruir a
+            requirements.txt     imagem se ela for despejada
+            meta.json            gravado antes de publicar o diretorio
+            importtime.txt       perfil de imports do handler (-X importtime),
+                                 so com import_profile
+            .lease               flock compartilhado = em uso
+
+O ID e o hash do conteudo do handler, dos requirements, do bundle e da
+identidade do rootfs base: registrar de novo o mesmo conteudo nao reconstroi nada.
+Uma versao nova e construida ao lado e so entao o nome passa a apontar
+para ela; invocacoes em andamento seguram um lease na versao antiga.
+
+As imagens respeitam uma cota de disco: passando dela, as menos usadas
+recentemente (mtime do .lease) perdem o rootfs.ext4. As que ainda tem
+nome sao reconstruidas no proximo uso; as sem nome sao apagadas.
+
+Uso:
+    registry = FunctionRegistry("./registry", "./rootfs-python.ext4")
+    image, built = registry.register("qrcode", "exemplo-qrcode/handler.py")
+    image = registry.acquire("qrcode")   # lease
+    ...  # clona image.rootfs, roda a VM
+    image.release()
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from bytecode import bundle_deps, compile_tree, profile_imports, site_packages
+from rootfs_clone import clone_rootfs
+from snapshot_store import allocated_bytes, file_fingerprint
+
+REGISTRY_DIR = "./registry"
+REGISTRY_QUOTA_MIB = 4096
+
+_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+class RegistryError(Exception):
+    pass
+
+
+class Image:
+    """Uma versao construida de uma funcao. release() solta o lease."""
+
+    def __init__(self, directory):
+        self.dir = directory
+        self.id = os.path.basename(directory)
+        self.rootfs = os.path.join(directory, "rootfs.ext4")
+        self.handler = os.path.join(directory, "handler.py")
+        self.requirements = os.path.join(directory, "requirements.txt")
+        self.meta_file = os.path.join(directory, "meta.json")
+        self.importtime_file = os.path.join(directory, "importtime.txt")
+        self.lease_file = os.path.join(directory, ".lease")
+        self._lease = None
+
+    def load_meta(self):
+        with open(self.meta_file) as f:
+            return json.load(f)
+
+    def release(self):
+        if self._lease:
+            fcntl.flock(self._lease, fcntl.LOCK_UN)
+            self._lease.close()
+            self._lease = None
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+class FunctionRegistry:
+    """Registro de funcoes e cache das imagens (LRU com cota de disco)."""
+
+    def __init__(self, root=REGISTRY_DIR, base_image=None,
+                 quota_bytes=REGISTRY_QUOTA_MIB * 1024 * 1024, on_evict=None):
+        self.root = root
+        self.base_image = base_image
+        self.quota_bytes = quota_bytes
+        # on_evict(image): chamado quando uma imagem e despejada (ex:
+        # invalidar snapshots tirados dela)
+        self.on_evict = on_evict
+        self.names_dir = os.path.join(root, "names")
+        self.images_dir = os.path.join(root, "images")
+        os.makedirs(self.names_dir, exist_ok=True)
+        os.makedirs(self.images_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, name=".lock"):
+        """Lock do registro (nomes, builds e despejo), entre processos."""
+        with open(os.path.join(self.root, name), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def image_id(self, handler, requirements, bundle=False):
+        h = hashlib.sha256()
+        for part in (handler, requirements or b""):
+            h.update(hashlib.sha256(part).digest())
+        if bundle:
+            h.update(b"bundle")
+        h.update(json.dumps(file_fingerprint(self.base_image), sort_keys=True).encode())
+        return h.hexdigest()[:16]
+
+    def _name_file(self, name):
+        if not _NAME.match(name):
+            raise RegistryError(f"nome de funcao invalido: {name}")
+        return os.path.join(self.names_dir, f"{name}.json")
+
+    def lookup(self, ref):
+        """ID da imagem de `ref` (nome registrado ou ID), ou None."""
+        if _NAME.match(ref):
+            try:
+                with open(self._name_file(ref)) as f:
+                    return json.load(f)["id"]
+            except FileNotFoundError:
+                pass
+            if os.path.isdir(os.path.join(self.images_dir, ref)):
+                return ref
+        return None
+
+    def qos_profile(self, ref):
+        """Perfil de QoS registrado para o nome `ref` (None se nao houver)."""
+        if not _NAME.match(ref):
+            return None
+        try:
+            with open(self._name_file(ref)) as f:
+                return json.load(f).get("qos")
+        except FileNotFoundError:
+            return None
+
+    def register(self, name, handler_path, requirements_path=None, bundle=False, qos=None,
+                 import_profile=False):
+        """
+        Registra (ou atualiza) a funcao `name`. Retorna (Image, construida_agora).
+
+        A imagem e construida antes do nome mudar de versao: quem ja
+        resolveu o nome segue com a versao antiga. Com `bundle` as
+        dependencias puras vao num zip (zipimport, ver bytecode.py).
+        `qos` e o perfil de QoS da funcao; sem ele fica o que ja estava.
+        O perfil nao entra no ID: trocar so o perfil nao reconstroi nada.
+
+        `import_profile` mede o import do handler (ver bytecode.py) com o
+        rootfs montado no host: o codigo da funcao roda fora da VM, como
+        root. So para funcoes confiaveis; desligado por padrao.
+        """
+        name_file = self._name_file(name)
+        with open(handler_path, "rb") as f:
+            handler = f.read()
+        requirements = None
+        if requirements_path:
+            with open(requirements_path, "rb") as f:
+                requirements = f.read()
+        image_id = self.image_id(handler, requirements, bundle)
+        image = Image(os.path.join(self.images_dir, image_id))
+
+        built = False
+        with self._locked(".build.lock"):
+            if not os.path.exists(image.rootfs):
+                self._build(image, name, handler, requirements, bundle, import_profile)
+                built = True
+        with self._locked():
+            qos = qos or self.qos_profile(name)
+            _write_json(name_file, {"id": image_id, "registered_at": time.time(), "qos": qos})
+            os.utime(self._touch(image))
+        if built:
+            self.evict(keep={image_id})
+        return image, built
+
+    def _touch(self, image):
+        if not os.path.exists(image.lease_file):
+            open(image.lease_file, "a").close()
+        return image.lease_file
+
+    def _build(self, image, name, handler, requirements, bundle=False,
+               import_profile=False):
+        """Clone do rootfs base + handler + pip install, publicado de uma vez."""
+        print(f"[*] Construindo imagem {image.id} da funcao {name}...")
+        start = time.time()
+        if os.path.isdir(image.dir):
+            # Imagem despejada: so o rootfs.ext4 falta
+            meta = image.load_meta()
+            work_dir = image.dir
+        else:
+            meta = {"name": name, "base_image": file_fingerprint(self.base_image),
+                    "handler_sha256": hashlib.sha256(handler).hexdigest(),
+                    "requirements": (requirements or b"").decode("utf-8"),
+                    "bundle": bundle}
+            work_dir = tempfile.mkdtemp(prefix=f".tmp-{image.id}-", dir=self.images_dir)
+            os.chmod(work_dir, 0o755)
+        try:
+            clone = clone_rootfs(self.base_image, clone_dir=work_dir)
+            try:
+                importtime_file = (os.path.join(work_dir, "importtime.txt")
+                                   if import_profile else None)
+                meta.update(self._install(clone.path, handler, requirements, bundle,
+                                          importtime_file))
+                os.chmod(clone.path, 0o444)
+            except BaseException:
+                clone.release()
+                raise
+            if work_dir != image.dir:
+                with open(os.path.join(work_dir, "handler.py"), "wb") as f:
+                    f.write(handler)
+                if requirements:
+                    with open(os.path.join(work_dir, "requirements.txt"), "wb") as f:
+                        f.write(requirements)
+            meta.update({"build_s": time.time() - start, "built_at": time.time(),
+                         "clone_backend": clone.backend})
+            _write_json(os.path.join(work_dir, "meta.json"), meta)
+            os.rename(clone.path, os.path.join(work_dir, "rootfs.ext4"))
+            if work_dir != image.dir:
+                os.rename(work_dir, image.dir)
+        except BaseException:
+            if work_dir != image.dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        print(f"    Imagem pronta ({meta['build_s']:.1f}s)")
+        if meta.get("import_s") is not None and meta.get("import_nocache_s") is not None:
+            print(f"    Import do handler: {meta['import_nocache_s'] * 1000:.0f}ms sem bytecode, "
+                  f"{meta['import_s'] * 1000:.0f}ms com bytecode")
+
+    def _install(self, rootfs, handler, requirements, bundle, importtime_file=None):
+        """
+        Handler, dependencias e bytecode dentro do rootfs. Retorna o que
+        vai para o meta (pacotes no bundle, perfil de imports). O perfil
+        so e medido com `importtime_file` (ver register()).
+        """
+        info = {}
+        mount_point = tempfile.mkdtemp()
+        subprocess.run(["mount", rootfs, mount_point], check=True)
+        try:
+            functions = os.path.join(mount_point, "functions")
+            os.makedirs(functions, exist_ok=True)
+            with open(os.path.join(functions, "handler.py"), "wb") as f:
+                f.write(handler)
+            if requirements:
+                target = "/tmp/deps" if bundle else None
+                self._pip_install(mount_point, requirements, target)
+                if bundle:
+                    info["bundled"] = bundle_deps(mount_point, target)
+            compile_tree(mount_point, ["/functions", site_packages(mount_point)])
+            if importtime_file:
+                try:
+                    info.update(profile_imports(mount_point, importtime_file))
+                except Exception as e:
+                    # O handler pode depender do ambiente da VM; a imagem fica
+                    print(f"[!] Perfil de imports indisponivel: {e}")
+        finally:
+            subprocess.run(["umount", mount_point], check=True)
+            os.rmdir(mount_point)
+        return info
+
+    def _pip_install(self, mount_point, requirements, target=None):
+        """pip do proprio rootfs (musl, Python do guest) via chroot."""
+        req = os.path.join(mount_point, "tmp", "requirements.txt")
+        resolv = os.path.join(mount_point, "etc", "resolv.conf")
+        os.makedirs(os.path.dirname(req), exist_ok=True)
+        with open(req, "wb") as f:
+            f.write(requirements)
+        had_resolv = os.path.exists(resolv)
+        if not had_resolv and os.path.exists("/etc/resolv.conf"):
+            shutil.copy("/etc/resolv.conf", resolv)
+        # --target: tudo num diretorio so, para o bundle separar
+        target_args = ["--target", target, "--no-compile"] if target else []
+        try:
+            result = subprocess.run(
+                ["chroot", mount_point, "python3", "-m", "pip", "install",
+                 "--no-cache-dir", "--break-system-packages", "--root-user-action=ignore",
+                 *target_args, "-r", "/tmp/requirements.txt"],
+                capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RegistryError("pip install falhou no rootfs (o rootfs base precisa "
+                                    f"do py3-pip):\n{result.stdout}{result.stderr}")
+        finally:
+            os.remove(req)
+            if not had_resolv and os.path.exists(resolv):
+                os.remove(resolv)
+
+    def acquire(self, ref):
+        """
+        Imagem de `ref` (nome ou ID) com lease; reconstroi se tiver sido
+        despejada. Solte com image.release().
+        """
+        previous = None
+        while True:
+            image_id = self.lookup(ref)
+            if image_id is None:
+                raise RegistryError(f"funcao nao registrada: {ref}")
+            if image_id == previous:
+                raise RegistryError(f"imagem {image_id} de {ref} nao existe mais; "
+                                    "registre a funcao de novo")
+            previous = image_id
+            image = Image(os.path.join(self.images_dir, image_id))
+            try:
+                lease = open(image.lease_file, "a")
+            except FileNotFoundError:
+                continue  # o nome mudou de versao e a antiga foi apagada
+            fcntl.flock(lease, fcntl.LOCK_SH)
+            if not os.path.isdir(image.dir):
+                lease.close()
+                continue
+            image._lease = lease
+            os.utime(image.lease_file)
+            if not os.path.exists(image.rootfs):
+                # Despejada: reconstroi com o lease compartilhado seguro
+                meta = image.load_meta()
+                requirements = None
+                if os.path.exists(image.requirements):
+                    with open(image.requirements, "rb") as f:
+                        requirements = f.read()
+                with open(image.handler, "rb") as f:
+                    handler = f.read()
+                with self._locked(".build.lock"):
+                    if not os.path.exists(image.rootfs):
+                        self._build(image, meta["name"], handler, requirements,
+                                    meta.get("bundle", False))
+                self.evict(keep={image.id})
+            return image
+
+    def _referenced(self):
+        ids = set()
+        for name in os.listdir(self.names_dir):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.names_dir, name)) as f:
+                        ids.add(json.load(f)["id"])
+                except (OSError, ValueError):
+                    continue
+        return ids
+
+    def images(self):
+        """Imagens com rootfs, da usada ha mais tempo para a mais recente."""
+        rows = []
+        for image_id in os.listdir(self.images_dir):
+            image = Image(os.path.join(self.images_dir, image_id))
+            if image_id.startswith(".") or not os.path.exists(image.meta_file):
+                continue
+            try:
+                last_used = os.stat(image.lease_file).st_mtime
+            except FileNotFoundError:
+                last_used = 0
+            size = allocated_bytes(image.rootfs) if os.path.exists(image.rootfs) else 0
+            rows.append((last_used, size, image))
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def usage(self):
+        return sum(size for _, size, _ in self.images())
+
+    def evict(self, keep=()):
+        """
+        Despeja imagens (LRU) ate caber na cota. Imagens em uso (lease)
+        ficam. Retorna os IDs despejados.
+        """
+        evicted = []
+        with self._locked():
+            rows = self.images()
+            referenced = self._referenced()
+            total = sum(size for _, size, _ in rows)
+            for _, size, image in rows:
+                if total <= self.quota_bytes:
+                    break
+                if image.id in keep or size == 0:
+                    continue
+                with open(image.lease_file, "a") as lease:
+                    try:
+                        fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # em uso
+                    if image.id in referenced:
+                        os.remove(image.rootfs)
+                    else:
+                        shutil.rmtree(image.dir, ignore_errors=True)
+                total -= size
+                evicted.append(image.id)
+                print(f"[*] Imagem {image.id} despejada do registro "
+                      f"({size / (1024 * 1024):.1f} MiB)")
+                if self.on_evict:
+                    self.on_evict(image)
+        return evicted
@@ -0,0 +1,353 @@
+"""
+gateway.py - Gateway HTTP asyncio para o nano-Lambda
+
+Servico de longa duracao na frente do motor de invocacoes (engine.py):
+
+    POST /invoke/<funcao>   corpo = input; roda <functions_dir>/<funcao>/handler.py
+                            ou a funcao registrada com esse nome
+    GET  /metrics           metricas no formato texto do Prometheus
+    GET  /health            estado da fila (JSON)
+
+As requisicoes entram numa fila com profundidade maxima. Workers (tantos
+quanto o orcamento do motor permite) tiram da fila e invocam. Com a fila
+cheia o gateway responde 429 com Retry-After em vez de criar mais
+processos Firecracker. O resultado volta em chunks (Transfer-Encoding:
+chunked), com o ID e os tempos da invocacao nos headers.
+
+Uso (via nano-lambda.py):
+    sudo python3 nano-lambda.py --serve 127.0.0.1:8080 --functions-dir .
+    curl -X POST --data "https://fogonacaixadagua.com.br" \\
+        http://127.0.0.1:8080/invoke/exemplo-qrcode -o qrcode.png
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+import signal
+import time
+
+from instrumentation import DISABLED, Histogram
+
+QUEUE_DEPTH = 64
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_FUNCTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 429: "Too Many Requests",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+_CONTENT_TYPES = {
+    "image": "image/png",
+    "json": "application/json",
+    "binary": "application/octet-stream",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Gateway:
+    """
+    Gateway HTTP na frente de um InvocationEngine.
+
+    `functions_dir` contem uma pasta por funcao com o handler.py
+    (ex: exemplo-qrcode/handler.py vira POST /invoke/exemplo-qrcode).
+    As metricas de `instrumentation` (fases das VMs, ver
+    instrumentation.py) saem junto no /metrics.
+    """
+
+    def __init__(self, engine, functions_dir, queue_depth=QUEUE_DEPTH, workers=None,
+                 instrumentation=DISABLED, registry=None):
+        self.engine = engine
+        self.registry = registry
+        self.instrumentation = instrumentation
+        self.functions_dir = functions_dir
+        self.queue_depth = queue_depth
+        self.workers = workers or engine.max_concurrency
+        self._queue = None
+        self._worker_tasks = []
+        self._server = None
+        self._in_flight = 0
+
+        self.latency = {}     # endpoint -> Histogram
+        self.requests = {}    # (endpoint, status) -> contador
+        self.rejected = 0
+
+    # --- fila e workers ---
+
+    async def _worker(self):
+        while True:
+            function_path, input_data, future = await self._queue.get()
+            try:
+                if not future.cancelled():
+                    self._in_flight += 1
+                    try:
+                        result = await self.engine.invoke(function_path, input_data)
+                        if not future.cancelled():
+                            future.set_result(result)
+                    finally:
+                        self._in_flight -= 1
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _retry_after(self):
+        """Estimativa (segundos) de quando a fila deve ter espaco."""
+        invokes = [h for e, h in self.latency.items() if e.startswith("/invoke/")]
+        count = sum(h.count for h in invokes)
+        avg = sum(h.sum for h in invokes) / count if count else 1.0
+        waiting = self._queue.qsize() + self._in_flight
+        return max(1, math.ceil(avg * waiting / self.workers))
+
+    async def submit(self, function_path, input_data):
+        """Enfileira a invocacao; HttpError 429 se a fila estiver cheia."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((function_path, input_data, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HttpError(429, "fila cheia, tente novamente",
+                            {"Retry-After": str(self._retry_after())})
+        return await future
+
+    # --- HTTP ---
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(400, "headers grandes demais")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "linha de requisicao invalida")
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(400, "corpo chunked nao suportado, use Content-Length")
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HttpError(400, "Content-Length invalido")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, f"input maior que {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method, target.split("?", 1)[0], version, headers, body
+
+    def _write_head(self, writer, status, headers):
+        head = f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        for name, value in headers.items():
+            head += f"{name}: {value}\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n")
+
+    async def _respond(self, writer, status, body, content_type="text/plain; charset=utf-8",
+                       headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        all_headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+        all_headers.update(headers or {})
+        self._write_head(writer, status, all_headers)
+        writer.write(body)
+        await writer.drain()
+
+    async def _stream(self, writer, status, body, content_type, headers):
+        """Envia o corpo em chunks, respeitando o buffer do socket."""
+        all_headers = {"Content-Type": content_type, "Transfer-Encoding": "chunked"}
+        all_headers.update(headers)
+        self._write_head(writer, status, all_headers)
+        view = memoryview(body)
+        for start in range(0, len(view), CHUNK_SIZE):
+            chunk = view[start:start + CHUNK_SIZE]
+            writer.write(b"%x\r\n" % len(chunk) + bytes(chunk) + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _function_path(self, name):
+        if not _FUNCTION_NAME.match(name):
+            raise HttpError(400, f"nome de funcao invalido: {name}")
+        path = os.path.join(self.functions_dir, name, "handler.py")
+        if os.path.isfile(path):
+            return path
+        # Funcao registrada: o runner resolve o nome para a imagem
+        if self.registry and self.registry.lookup(name):
+            return name
+        raise HttpError(404, f"funcao nao encontrada: {name}")
+
+    def _exists(self, name):
+        return os.path.isfile(os.path.join(self.functions_dir, name, "handler.py")) or bool(
+            self.registry and self.registry.lookup(name))
+
+    async def _invoke(self, writer, name, body):
+        function_path = self._function_path(name)
+        result = await self.submit(function_path, body.decode("utf-8", errors="replace"))
+
+        headers = {
+            "X-Invocation-Id": result.get("invocation_id", ""),
+            "X-Nano-Lambda-Timings": json.dumps(
+                {k: round(v, 6) for k, v in result.get("timings", {}).items()},
+                separators=(",", ":")
+            ),
+        }
+        if result["success"]:
+            status = 200
+            data = result["data"]
+            if result["type"] == "json":
+                data = json.dumps(data).encode("utf-8")
+            content_type = _CONTENT_TYPES.get(result["type"], "text/plain; charset=utf-8")
+        else:
+            # Sem resultado: devolve o log da VM para depuracao
+            status = 500
+            data = result["data"].encode("utf-8")
+            content_type = "text/plain; charset=utf-8"
+        await self._stream(writer, status, data, content_type, headers)
+        return status
+
+    def _metrics(self):
+        lines = [
+            "# HELP nano_lambda_gateway_request_duration_seconds Latencia por endpoint",
+            "# TYPE nano_lambda_gateway_request_duration_seconds histogram",
+        ]
+        for endpoint, hist in sorted(self.latency.items()):
+            lines += hist.render("nano_lambda_gateway_request_duration_seconds",
+                                 f'endpoint="{endpoint}"')
+        lines += [
+            "# HELP nano_lambda_gateway_requests_total Requisicoes por endpoint e status",
+            "# TYPE nano_lambda_gateway_requests_total counter",
+        ]
+        for (endpoint, status), count in sorted(self.requests.items()):
+            lines.append(f'nano_lambda_gateway_requests_total{{endpoint="{endpoint}",'
+                         f'status="{status}"}} {count}')
+        lines += [
+            "# TYPE nano_lambda_gateway_rejected_total counter",
+            f"nano_lambda_gateway_rejected_total {self.rejected}",
+            "# TYPE nano_lambda_gateway_queue_depth gauge",
+            f"nano_lambda_gateway_queue_depth {self._queue.qsize()}",
+            "# TYPE nano_lambda_gateway_in_flight gauge",
+            f"nano_lambda_gateway_in_flight {self._in_flight}",
+        ]
+        return "\n".join(lines) + "\n" + self.instrumentation.render()
+
+    def _health(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_max": self.queue_depth,
+            "in_flight": self._in_flight,
+            "workers": self.workers,
+            "engine": self.engine.stats(),
+        }
+
+    def _endpoint(self, path):
+        """Rotulo do endpoint nas metricas (funcoes inexistentes nao criam series)."""
+        if path.startswith("/invoke/"):
+            name = path[len("/invoke/"):]
+            if _FUNCTION_NAME.match(name) and self._exists(name):
+                return path
+            return "/invoke/*"
+        if path in ("/metrics", "/health"):
+            return path
+        return "other"
+
+    async def _dispatch(self, writer, method, path, body):
+        """Roteia a requisicao e retorna o status enviado."""
+        if path.startswith("/invoke/"):
+            if method != "POST":
+                raise HttpError(405, "use POST", {"Allow": "POST"})
+            return await self._invoke(writer, path[len("/invoke/"):], body)
+        if path == "/metrics" and method == "GET":
+            await self._respond(writer, 200, self._metrics(),
+                                "text/plain; version=0.0.4; charset=utf-8")
+            return 200
+        if path == "/health" and method == "GET":
+            await self._respond(writer, 200, json.dumps(self._health()), "application/json")
+            return 200
+        raise HttpError(404, "rota nao encontrada")
+
+    def _record(self, endpoint, status, elapsed):
+        self.latency.setdefault(endpoint, Histogram()).observe(elapsed)
+        key = (endpoint, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    method, path, version, headers, body = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return  # cliente fechou a conexao
+                except HttpError as e:
+                    await self._respond(writer, e.status, str(e) + "\n",
+                                        headers={"Connection": "close"})
+                    return
+
+                start = time.time()
+                try:
+                    status = await self._dispatch(writer, method, path, body)
+                except HttpError as e:
+                    status = e.status
+                    await self._respond(writer, e.status, str(e) + "\n", headers=e.headers)
+                except Exception as e:
+                    status = 500
+                    await self._respond(writer, 500, f"erro na invocacao: {e}\n")
+                self._record(self._endpoint(path), status, time.time() - start)
+
+                keep_alive = (version == "HTTP/1.1"
+                              and headers.get("connection", "").lower() != "close")
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    # --- ciclo de vida ---
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self._queue = asyncio.Queue(maxsize=self.queue_depth)
+        self._worker_tasks = [asyncio.create_task(self._worker())
+                              for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._handle, host, port,
+                                                  limit=MAX_HEADER_BYTES)
+        print(f"[*] Gateway ouvindo em http://{host}:{port} "
+              f"({self.workers} workers, fila de {self.queue_depth})")
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self.engine.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        """Roda ate receber SIGINT/SIGTERM."""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await self.start(host, port)
+        try:
+            await stop.wait()
+        finally:
+            print("\n[*] Encerrando gateway...")
+            await self.close()
@@ -0,0 +1,186 @@
+"""
+nanolambda.py - Biblioteca do guest para devolver resultados ao host
+
+Instalada no rootfs pelo build-rootfs.sh. O handler chama
+send_image(), send_json() ou send_bytes() e o resultado vai por
+virtio-vsock num frame binario (sem base64); o console serial fica
+so para logs.
+
+Frame: 1 byte de tipo + 8 bytes de tamanho (big-endian) + payload.
+O host responde 1 byte depois de ler o frame inteiro, entao quando
+send_*() retorna o resultado ja chegou.
+
+Sem vsock (kernel sem suporte, rootfs antigo, modo snapshot) cai
+para os marcadores no console (BASE64_IMAGE_START, JSON_RESULT_START).
+
+Em lote (/batch-runner.py) cada item volta num frame KIND_ITEM:
+4 bytes com o tamanho do cabecalho JSON + cabecalho + dados crus do
+resultado (send_item). run_handler() roda o handler uma vez e monta o
+cabecalho e os dados do item; o /batch-runner.py e o /agent-runner.py
+usam ele.
+
+Uso:
+    import nanolambda
+    nanolambda.send_image(png_bytes)
+"""
+
+import base64
+import contextlib
+import io
+import json
+import socket
+import struct
+import sys
+import time
+import traceback
+
+HOST_CID = 2
+RESULT_PORT = 10000
+
+KIND_BYTES = 1
+KIND_IMAGE = 2
+KIND_JSON = 3
+KIND_ITEM = 4
+
+HEADER = struct.Struct(">BQ")
+ITEM_HEADER = struct.Struct(">I")
+SEND_TIMEOUT = 30
+
+INPUT_FILE = "/functions/input.txt"
+# Fim do stdout do handler que vai no cabecalho do item
+LOG_TAIL = 2000
+TYPES = {KIND_BYTES: "binary", KIND_IMAGE: "image", KIND_JSON: "json"}
+
+# Lista do run_handler em andamento: send() guarda o resultado nela
+_captured = None
+
+
+def _send_vsock(kind, payload):
+    sock = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(SEND_TIMEOUT)
+        sock.connect((HOST_CID, RESULT_PORT))
+        sock.sendall(HEADER.pack(kind, len(payload)))
+        sock.sendall(payload)
+        # Espera a confirmacao do host
+        if not sock.recv(1):
+            raise ConnectionError("host fechou o canal sem confirmar o resultado")
+    finally:
+        sock.close()
+
+
+def _send_console(kind, payload):
+    out = sys.stdout
+    if kind == KIND_JSON:
+        out.write("JSON_RESULT_START\n")
+        out.write(payload.decode("utf-8"))
+        out.write("\nJSON_RESULT_END\n")
+    else:
+        # O console so tem o bloco de imagem: bytes crus vao por ele tambem
+        encoded = base64.b64encode(payload).decode("ascii")
+        out.write("BASE64_IMAGE_START\n")
+        for i in range(0, len(encoded), 76):
+            out.write(encoded[i:i + 76] + "\n")
+        out.write("BASE64_IMAGE_END\n")
+    out.flush()
+
+
+def send(kind, payload, channel="auto"):
+    """
+    Envia o resultado. `channel`: auto (vsock, senao console),
+    vsock ou console. Retorna o canal usado.
+    """
+    if _captured is not None:
+        # Dentro do run_handler: o resultado vai no item
+        _captured.append((kind, bytes(payload)))
+        return "item"
+    if channel in ("auto", "vsock"):
+        try:
+            _send_vsock(kind, payload)
+            return "vsock"
+        except (OSError, AttributeError):
+            # AttributeError: Python sem socket.AF_VSOCK
+            if channel == "vsock":
+                raise
+    _send_console(kind, payload)
+    return "console"
+
+
+def send_bytes(data, channel="auto"):
+    return send(KIND_BYTES, bytes(data), channel)
+
+
+def send_image(data, channel="auto"):
+    return send(KIND_IMAGE, bytes(data), channel)
+
+
+def send_json(obj, channel="auto"):
+    return send(KIND_JSON, json.dumps(obj).encode("utf-8"), channel)
+
+
+def send_item(header, data=b"", channel="auto"):
+    """
+    Resultado de um item do lote: `header` (dict com index, success,
+    type, ...) e os bytes do resultado. No console vai como um bloco
+    JSON com o item inteiro em base64: o log do handler pode conter os
+    proprios marcadores e nao pode fechar o bloco antes da hora.
+    """
+    meta = json.dumps(header).encode("utf-8")
+    if channel in ("auto", "vsock"):
+        try:
+            _send_vsock(KIND_ITEM, ITEM_HEADER.pack(len(meta)) + meta + bytes(data))
+            return "vsock"
+        except (OSError, AttributeError):
+            if channel == "vsock":
+                raise
+    item = dict(header, data_b64=base64.b64encode(bytes(data)).decode("ascii"))
+    encoded = base64.b64encode(json.dumps(item).encode("utf-8")).decode("ascii")
+    _send_console(KIND_JSON, json.dumps({"batch_item": encoded}).encode("utf-8"))
+    return "console"
+
+
+def _console_result(text):
+    """Resultado de um handler sem a biblioteca: marcadores no stdout."""
+    if "JSON_RESULT_START" in text:
+        block = text.split("JSON_RESULT_START", 1)[1].split("JSON_RESULT_END", 1)[0]
+        return KIND_JSON, block.strip().encode("utf-8")
+    if "BASE64_IMAGE_START" in text:
+        block = text.split("BASE64_IMAGE_START", 1)[1].split("BASE64_IMAGE_END", 1)[0]
+        return KIND_IMAGE, base64.b64decode("".join(block.split()))
+    return None
+
+
+def run_handler(handler, input_data, index=0):
+    """
+    Grava o input e chama handler.main() com o stdout capturado.
+
+    O send_*() do handler e guardado em vez de enviado. Retorna
+    (cabecalho, dados) do item: o cabecalho traz index, success, type,
+    elapsed_s, error e o fim do log; os dados sao os bytes crus do
+    resultado (vazios se o handler nao devolveu nada).
+    """
+    global _captured
+    with open(INPUT_FILE, "w") as f:
+        f.write(input_data)
+    captured = _captured = []
+    out = io.StringIO()
+    code, error = 0, None
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(out):
+            try:
+                handler.main()
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception:
+                code, error = 1, traceback.format_exc()
+    finally:
+        _captured = None
+    elapsed = time.time() - start
+    result = captured[-1] if captured else _console_result(out.getvalue())
+    if code and error is None:
+        error = "exit %d" % code
+    header = {"index": index, "success": code == 0 and result is not None,
+              "type": TYPES.get(result[0], "binary") if result else "text",
+              "elapsed_s": elapsed, "error": error, "log": out.getvalue()[-LOG_TAIL:]}
+    return header, result[1] if result else b""
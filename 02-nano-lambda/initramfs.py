@@ -0,0 +1,264 @@
+"""
+initramfs.py - Engine de boot so com initramfs (sem drive de bloco)
+
+Para handlers pequenos e sem estado, anexar um ext4 de 500MB e montar
+o root e desperdicio: o kernel pode rodar tudo direto do initramfs,
+sem virtio-block nem mount no caminho do boot.
+
+O initrd e um cpio "newc" montado em camadas (o kernel aceita varios
+arquivos cpio concatenados):
+
+    runtime   runtime Python minimo extraido do rootfs template + /init
+    funcao    /functions/handler.py
+    input     /functions/input.txt (por invocacao)
+
+Runtime e runtime+funcao ficam em cache (INITRD_CACHE_DIR), com a
+chave calculada pelo conteudo; cada invocacao clona o initrd da funcao
+(reflink quando possivel, ver rootfs_clone.py) e anexa o input.
+
+Requer um kernel com CONFIG_BLK_DEV_INITRD.
+"""
+
+import fnmatch
+import hashlib
+import io
+import os
+import stat
+import subprocess
+import tempfile
+import time
+
+from rootfs_clone import clone_rootfs
+
+# Fora do runtime minimo (caminhos relativos a raiz do rootfs)
+RUNTIME_EXCLUDE = [
+    "boot", "home", "media", "mnt", "opt", "srv", "root", "lost+found",
+    "var/cache/*", "var/log/*", "tmp/*",
+    "usr/include", "usr/share/doc", "usr/share/man", "usr/share/info",
+    "usr/lib/python3*/test", "usr/lib/python3*/idlelib",
+    "usr/lib/python3*/tkinter", "usr/lib/python3*/turtledemo",
+    "usr/lib/python3*/ensurepip", "usr/lib/python3*/lib2to3",
+    "usr/lib/python3*/pydoc_data", "usr/lib/python3*/site-packages/pip*",
+    "etc/init.d", "etc/runlevels", "lib/rc", "sbin/openrc*",
+    "run-function.sh", "snapshot-runner.py", "functions/*",
+]
+
+# /init do initramfs: sem openrc, sem rootfs
+INIT_SCRIPT = b"""#!/bin/sh
+mount -t proc proc /proc
+mount -t sysfs sysfs /sys
+mount -t devtmpfs devtmpfs /dev
+mkdir -p /tmp /output
+
+echo ""
+echo "=== nano-Lambda executando (initramfs)... ==="
+echo ""
+
+if [ -f /functions/handler.py ]; then
+    cd /functions
+    python3 handler.py
+    RETVAL=$?
+    echo ""
+    echo "=== Execucao finalizada (exit: $RETVAL) ==="
+else
+    echo "ERRO: handler.py nao encontrado"
+fi
+
+echo ""
+poweroff -f
+"""
+
+INITRD_CACHE_DIR = "./initrd-cache"
+
+
+class CpioWriter:
+    """Escreve um arquivo cpio no formato newc (o que o kernel entende)."""
+
+    def __init__(self, out):
+        self.out = out
+        self._ino = 1
+
+    def _pad(self, size):
+        self.out.write(b"\0" * (-size % 4))
+
+    def _header(self, name, mode, size, mtime=0, rdev=(0, 0)):
+        name = name.encode("utf-8") + b"\0"
+        fields = [self._ino, mode, 0, 0, 1, int(mtime), size,
+                  0, 0, rdev[0], rdev[1], len(name), 0]
+        self._ino += 1
+        header = b"070701" + b"".join(b"%08X" % f for f in fields)
+        self.out.write(header + name)
+        self._pad(len(header) + len(name))
+
+    def add_dir(self, name, mode=0o755, mtime=0):
+        self._header(name, stat.S_IFDIR | mode, 0, mtime)
+
+    def add_file(self, name, data, mode=0o644, mtime=0):
+        self._header(name, stat.S_IFREG | mode, len(data), mtime)
+        self.out.write(data)
+        self._pad(len(data))
+
+    def add_path(self, name, path, st):
+        """Copia um arquivo do host sem carregar tudo em memoria."""
+        self._header(name, stat.S_IFREG | stat.S_IMODE(st.st_mode), st.st_size, st.st_mtime)
+        with open(path, "rb") as f:
+            remaining = st.st_size
+            while remaining:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise IOError(f"{path} encolheu durante a copia")
+                self.out.write(chunk)
+                remaining -= len(chunk)
+        self._pad(st.st_size)
+
+    def add_symlink(self, name, target, mtime=0):
+        target = target.encode("utf-8")
+        self._header(name, stat.S_IFLNK | 0o777, len(target), mtime)
+        self.out.write(target)
+        self._pad(len(target))
+
+    def add_chardev(self, name, major, minor, mode=0o600):
+        self._header(name, stat.S_IFCHR | mode, 0, rdev=(major, minor))
+
+    def close(self):
+        self._header("TRAILER!!!", 0, 0)
+
+
+def _excluded(rel):
+    return any(fnmatch.fnmatch(rel, pattern) for pattern in RUNTIME_EXCLUDE)
+
+
+def write_tree(writer, root):
+    """Adiciona a arvore `root` ao cpio (arquivos, diretorios e symlinks)."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        keep = []
+        for name in sorted(dirnames) + sorted(filenames):
+            path = os.path.join(dirpath, name)
+            rel = name if rel_dir == "." else os.path.join(rel_dir, name)
+            if _excluded(rel):
+                continue
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                writer.add_symlink(rel, os.readlink(path), st.st_mtime)
+            elif stat.S_ISDIR(st.st_mode):
+                writer.add_dir(rel, stat.S_IMODE(st.st_mode), st.st_mtime)
+                keep.append(name)
+            elif stat.S_ISREG(st.st_mode):
+                writer.add_path(rel, path, st)
+            # Devices, sockets e fifos ficam de fora (o /init monta o devtmpfs)
+        dirnames[:] = [d for d in dirnames if d in keep]
+
+
+def layer(files):
+    """Camada cpio em memoria com arquivos em /functions."""
+    buf = io.BytesIO()
+    writer = CpioWriter(buf)
+    now = time.time()
+    for name, content in files.items():
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        writer.add_file(f"functions/{name}", content, mtime=now)
+    writer.close()
+    return buf.getvalue()
+
+
+def _atomic_write(path, write_fn):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_fn(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class InitrdCache:
+    """Cache de initrds por funcao, com a chave pelo conteudo."""
+
+    def __init__(self, cache_dir=INITRD_CACHE_DIR, rootfs_template=None):
+        self.cache_dir = cache_dir
+        self.rootfs_template = rootfs_template
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _runtime_key(self):
+        st = os.stat(self.rootfs_template)
+        h = hashlib.sha256()
+        h.update(f"{os.path.abspath(self.rootfs_template)}:{st.st_size}:"
+                 f"{st.st_mtime_ns}:{st.st_ino}".encode())
+        h.update(INIT_SCRIPT)
+        h.update(repr(RUNTIME_EXCLUDE).encode())
+        return h.hexdigest()[:16]
+
+    def runtime_layer(self):
+        """Camada do runtime: extraida do rootfs template uma vez so."""
+        path = os.path.join(self.cache_dir, f"runtime-{self._runtime_key()}.cpio")
+        if os.path.exists(path):
+            return path
+
+        print(f"[*] Gerando runtime do initramfs a partir de {self.rootfs_template}...")
+        mount_point = tempfile.mkdtemp()
+        subprocess.run(["mount", "-o", "loop,ro", self.rootfs_template, mount_point],
+                       check=True)
+        try:
+            def write(f):
+                writer = CpioWriter(f)
+                write_tree(writer, mount_point)
+                writer.add_chardev("dev/console", 5, 1)
+                writer.add_file("init", INIT_SCRIPT, mode=0o755)
+                writer.close()
+            _atomic_write(path, write)
+        finally:
+            subprocess.run(["umount", mount_point], check=True)
+            os.rmdir(mount_point)
+        return path
+
+    def _function_prefix(self, function_path):
+        path = os.path.abspath(function_path)
+        name = os.path.basename(os.path.dirname(path)) or "funcao"
+        return f"{name}-{hashlib.sha256(path.encode()).hexdigest()[:8]}-"
+
+    def function_initrd(self, function_path):
+        """
+        Runtime + handler, em cache. Retorna (caminho, gerado_agora).
+
+        Versoes antigas do initrd da mesma funcao sao removidas.
+        """
+        runtime = self.runtime_layer()
+        with open(function_path, "rb") as f:
+            handler = f.read()
+        key = hashlib.sha256(os.path.basename(runtime).encode() + handler).hexdigest()[:16]
+        prefix = self._function_prefix(function_path)
+        path = os.path.join(self.cache_dir, f"{prefix}{key}.cpio")
+        if os.path.exists(path):
+            return path, False
+
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix):
+                os.remove(os.path.join(self.cache_dir, name))
+
+        def write(f):
+            with open(runtime, "rb") as src:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            f.write(layer({"handler.py": handler}))
+        _atomic_write(path, write)
+        return path, True
+
+    def invocation_initrd(self, function_path, input_data):
+        """
+        Initrd da invocacao: clone do initrd da funcao + camada de input.
+
+        Retorna (RootfsClone, gerado_agora). O clone e liberado com
+        release(), como os clones de rootfs. Sempre reflink ou copia
+        esparsa: o arquivo recebe o input no fim (dm-snapshot nao serve).
+        """
+        base, built = self.function_initrd(function_path)
+        clone = clone_rootfs(base, suffix=".cpio")
+        with open(clone.path, "ab") as f:
+            f.write(layer({"input.txt": input_data}))
+        return clone, built
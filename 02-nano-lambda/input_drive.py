@@ -0,0 +1,75 @@
+"""
+input_drive.py - Entrega handler e input num drive secundario
+
+No modo tradicional cada invocacao monta o rootfs, escreve
+/functions/handler.py e /functions/input.txt e desmonta: dois syscalls
+privilegiados mais um flush do journal ext4 no caminho critico.
+
+Aqui o nano-Lambda monta um tar em memoria com os arquivos da
+invocacao e anexa como segundo drive do Firecracker (/dev/vdb,
+somente leitura). O /run-function.sh do guest extrai o tar em
+/functions antes de rodar o handler. O rootfs nao e tocado pelo host.
+"""
+
+import io
+import os
+import tarfile
+import tempfile
+import time
+
+SECTOR_SIZE = 512
+
+# /dev/shm mantem a imagem em memoria; se nao existir usa o tmp padrao
+INPUT_DRIVE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def build_input_image(files):
+    """
+    Gera a imagem (tar) com os arquivos da invocacao.
+
+    `files` mapeia nome -> conteudo (bytes ou str). Retorna bytes
+    com tamanho multiplo de 512 (o virtio-block trabalha em setores).
+    """
+    buf = io.BytesIO()
+    now = time.time()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.USTAR_FORMAT) as tar:
+        for name, content in files.items():
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = now
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(content))
+
+    image = buf.getvalue()
+    padding = -len(image) % SECTOR_SIZE
+    return image + b"\0" * padding
+
+
+def write_input_drive(files, directory=INPUT_DRIVE_DIR, size=None):
+    """
+    Grava a imagem de input num arquivo temporario e retorna o caminho.
+
+    Com `size`, o arquivo e completado (esparso) ate esse tamanho: no
+    modo snapshot o drive e trocado depois do restore e o guest ja
+    conhece o tamanho do disco.
+    """
+    image = build_input_image(files)
+    if size is not None and len(image) > size:
+        raise ValueError(f"Input maior que o drive de input ({len(image)} > {size} bytes)")
+    fd, path = tempfile.mkstemp(suffix=".tar", prefix="nano-lambda-input-", dir=directory)
+    try:
+        os.write(fd, image)
+        if size is not None:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+    return path
+
+
+def function_files(function_path, input_data):
+    """Arquivos padrao de uma invocacao: handler.py e input.txt."""
+    with open(function_path, "rb") as f:
+        handler = f.read()
+    return {"handler.py": handler, "input.txt": input_data}
@@ -0,0 +1,304 @@
+"""
+instrumentation.py - Spans, contadores e histogramas do nano-Lambda
+
+Os "[*] ..." do NanoLambda dizem o que esta acontecendo, mas nao quanto
+tempo cada fase leva em producao. Aqui cada fase do ciclo de vida
+(prepare, spawn, config, run, parse, teardown, restore...) vira um span
+com inicio e fim, e os spans alimentam um histograma de latencia por
+fase. Contadores registram invocacoes e erros; gauges guardam o ultimo
+valor de algo que sobe e desce (capacidade quente do autoscaler).
+
+Saidas:
+    render()     metricas no formato texto do Prometheus (GET /metrics
+                 do gateway, ou um arquivo para o textfile collector)
+    JsonlSink    um span por linha (trace_id, span_id, parent_id,
+                 inicio, fim, atributos)
+
+Desligada (DISABLED, o padrao do NanoLambda) a instrumentacao nao faz
+nada: o @traced chama o metodo direto, sem criar span.
+
+Uso:
+    instr = Instrumentation(sinks=[JsonlSink("trace.jsonl")])
+    runner = NanoLambda(instrumentation=instr)
+    runner.invoke("handler.py", "input")
+    print(instr.render())
+    instr.close()
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+# Limites dos buckets dos histogramas de latencia (segundos)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "nano_lambda"
+
+
+class Histogram:
+    """Histograma cumulativo no estilo do Prometheus."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def render(self, name, labels):
+        sep = "," if labels else ""
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+def _labels(labels):
+    """Tupla ordenada (chave estavel) a partir dos labels."""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _render_labels(labels):
+    def escape(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{escape(v)}"' for k, v in labels)
+
+
+class Span:
+    """Uma fase com inicio e fim. Use via Instrumentation.span()."""
+
+    def __init__(self, instr, name, trace_id, attrs):
+        self._instr = instr
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = None
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = self._instr._stack()
+        if stack:
+            parent = stack[-1]
+            # Span aninhado fica no trace do pai
+            self.parent_id = parent.span_id
+            self.trace_id = parent.trace_id
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time()
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        stack = self._instr._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self._instr._finish(self)
+        return False
+
+    def record(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_s": self.end - self.start,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation:
+    """
+    Registro de spans e metricas, seguro entre threads.
+
+    `sinks` recebem cada span terminado (objetos com write(record)
+    e close(), ex: JsonlSink).
+    """
+
+    enabled = True
+
+    def __init__(self, sinks=(), buckets=LATENCY_BUCKETS, prefix=PREFIX):
+        self.sinks = list(sinks)
+        self.buckets = buckets
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}     # (nome, labels) -> valor
+        self._gauges = {}       # (nome, labels) -> ultimo valor
+        self._histograms = {}   # (nome, labels) -> Histogram
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, trace_id=None, **attrs):
+        """Span `name`; o trace_id so vale para spans sem pai na thread."""
+        return Span(self, name, trace_id, attrs)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(self.buckets)
+            hist.observe(value)
+
+    def _finish(self, span):
+        self.observe("phase_duration_seconds", span.end - span.start, phase=span.name)
+        if span.error:
+            self.inc("phase_errors", phase=span.name)
+        if self.sinks:
+            record = span.record()
+            for sink in self.sinks:
+                sink.write(record)
+
+    def render(self):
+        """Metricas no formato texto do Prometheus."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            lines = []
+            last = None
+            for (name, labels), value in counters:
+                metric = f"{self.prefix}_{name}_total"
+                if metric != last:
+                    lines.append(f"# TYPE {metric} counter")
+                    last = metric
+                labels = _render_labels(labels)
+                lines.append(f"{metric}{{{labels}}} {value}" if labels else f"{metric} {value}")
+            for (name, labels), value in gauges:
+                metric = f"{self.prefix}_{name}"
+                if metric != last:
+                    lines.append(f"# TYPE {metric} gauge")
+                    last = metric
+                labels = _render_labels(labels)
+                lines.append(f"{metric}{{{labels}}} {value}" if labels else f"{metric} {value}")
+            for (name, labels), hist in histograms:
+                metric = f"{self.prefix}_{name}"
+                if metric != last:
+                    lines.append(f"# TYPE {metric} histogram")
+                    last = metric
+                lines += hist.render(metric, _render_labels(labels))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def write_metrics(self, path):
+        """Grava o render() atomicamente (textfile collector do node_exporter)."""
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class DisabledInstrumentation(Instrumentation):
+    """Instrumentacao desligada: nenhuma chamada registra nada."""
+
+    enabled = False
+
+    def span(self, name, trace_id=None, **attrs):
+        return _NULL_SPAN
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def gauge(self, name, value, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+DISABLED = DisabledInstrumentation()
+
+
+class JsonlSink:
+    """Grava um span por linha num arquivo JSONL (append)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def traced(name):
+    """
+    Decorator de metodo: roda o metodo dentro do span `name`.
+
+    O objeto precisa ter `instrumentation` e `vm_id` (usado como
+    trace_id). Com a instrumentacao desligada o metodo e chamado direto.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instr = self.instrumentation
+            if not instr.enabled:
+                return method(self, *args, **kwargs)
+            with instr.span(name, trace_id=self.vm_id):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -10,27 +10,160 @@ Uso:
 Exemplo:
     sudo python3 nano-lambda.py exemplo-qrcode/handler.py "https://fogonacaixadagua.com.br"
 
+    # Varios inputs reaproveitando um pool de microVMs pre-aquecidas
+    sudo python3 nano-lambda.py --pool 2 exemplo-qrcode/handler.py "texto 1" "texto 2"
+
+    # Restaura um snapshot da funcao (ja com imports feitos) em vez de bootar
+    sudo python3 nano-lambda.py --mode snapshot exemplo-qrcode/handler.py "texto"
+
+    # Aquece o guest com um input e grava so as paginas sujas (snapshot Diff)
+    sudo python3 nano-lambda.py --refresh-snapshot exemplo-qrcode/handler.py "aquecimento"
+
+    # Registra a funcao (rootfs com handler e dependencias) e invoca pelo nome
+    sudo python3 nano-lambda.py --register minha-funcao --requirements minha-funcao/requirements.txt minha-funcao/handler.py
+    sudo python3 nano-lambda.py minha-funcao "texto"
+
+    # Gateway HTTP: POST /invoke/<funcao> (ver gateway.py)
+    sudo python3 nano-lambda.py --serve 127.0.0.1:8080 --functions-dir .
+
 Requer execução como root (para montar rootfs e executar Firecracker).
 """
 
+import argparse
+import asyncio
+import base64
+import json
 import subprocess
-import requests_unixsocket
 import time
 import shutil
 import tempfile
-import base64
+import threading
 import signal
 import sys
 import os
+import uuid
+
+from agent_pool import AgentConnection, AgentPool
+from autoscaler import Autoscaler, print_autoscaler_report
+from balloon import (balloon_device, benchmark_density, inflate_target, parse_balloon_stats,
+                     print_density_report, process_rss_mib, vm_memory)
+from fc_client import FirecrackerClient, render_config, write_config
+from initramfs import InitrdCache, INITRD_CACHE_DIR
+from instrumentation import DISABLED, Instrumentation, JsonlSink, traced
+from console_parser import ConsoleParser
+from engine import InvocationEngine, print_throughput_report
+from function_registry import FunctionRegistry, RegistryError
+from gateway import Gateway, QUEUE_DEPTH
+from input_drive import function_files, write_input_drive
+from page_store import PAGE_STORE_CHUNK, PageStore, print_dedup_report
+from qos import (QOS_PROFILE, QOS_PROFILES, benchmark_noisy_neighbor, drive_limiter,
+                 get_profile, print_noisy_report, qos_calls)
+from result_channel import ResultChannel, benchmark_payloads, decode_item, print_payload_report
+from rootfs_clone import clone_rootfs, CLONE_BACKENDS
+from snapshot_store import SNAPSHOT_CHAIN_MAX, SnapshotStore, allocated_bytes, file_fingerprint
+from uffd_server import PageServer
+from vm_wait import DONE_MARKER, VmWatcher, wait_for_socket
+from warm_pool import WarmPool
 
 # Configurações - ajuste conforme necessário
 FIRECRACKER_BIN = "./firecracker"
 KERNEL_PATH = "./vmlinux.bin"
 ROOTFS_TEMPLATE = "./rootfs-python.ext4"
-SOCKET_PATH = "/tmp/firecracker-nanolambda.socket"
+# Como clonar o rootfs por invocacao: auto (reflink, senao sparse),
+# reflink, sparse ou dm-snapshot. Ver rootfs_clone.py
+ROOTFS_CLONE_BACKEND = "auto"
+# Como entregar funcao e input ao guest: "mount" (monta o rootfs e copia)
+# ou "drive" (tar em memoria anexado como /dev/vdb, ver input_drive.py)
+INPUT_MODE = "mount"
+# Como falar com a API do Firecracker:
+#   legacy      - requests_unixsocket, uma conexao por chamada
+#   keepalive   - conexao HTTP/1.1 persistente por VM (fc_client.py)
+#   pipeline    - keepalive + configuracao enviada numa tacada so
+#   config-file - gera o JSON e inicia com --config-file (sem chamadas antes do boot)
+API_MODE = "keepalive"
+API_MODES = ["legacy", "keepalive", "pipeline", "config-file"]
+# Cada invocacao ganha seu proprio socket: /tmp/firecracker-nanolambda-<id>.socket
+SOCKET_DIR = "/tmp"
+BOOT_ARGS = "console=ttyS0 reboot=k panic=1 pci=off quiet"
 VCPU_COUNT = 1
 MEM_SIZE_MIB = 256
 
+# Engine de boot:
+#   rootfs    - clone do ext4 template como drive raiz (padrao)
+#   initramfs - so um initrd em memoria com runtime + handler + input,
+#               sem nenhum drive de bloco (ver initramfs.py)
+ENGINE = "rootfs"
+ENGINES = ["rootfs", "initramfs"]
+
+# Por onde o resultado volta: "vsock" (frame binario, ver result_channel.py;
+# o handler usa a biblioteca guest/nanolambda.py) ou "console" (so o
+# serial, com base64). O console continua levando os logs
+RESULT_CHANNEL = "vsock"
+RESULT_CHANNELS = ["vsock", "console"]
+VSOCK_GUEST_CID = 3
+
+# Como executar cada invocacao:
+#   boot     - boota uma VM nova (cold start)
+#   snapshot - restaura o snapshot da funcao tirado apos os imports
+#              (ver snapshot_store.py)
+INVOKE_MODE = "boot"
+INVOKE_MODES = ["boot", "snapshot"]
+SNAPSHOT_DIR = "./snapshots"
+# Memoria dos snapshots em chunks deduplicados entre funcoes (page_store.py)
+SNAPSHOT_PAGE_STORE = False
+PAGE_STORE_DIR = os.path.join(SNAPSHOT_DIR, ".pages")
+# Vai no cmdline do kernel: o /run-function.sh do guest entra no modo snapshot
+SNAPSHOT_BOOT_ARG = "nano_lambda.mode=snapshot"
+# Impresso pelo guest quando termina o boot e vai rodar o handler
+# (separa as fases "boot" e "handler" nos timings)
+EXEC_MARKER = b"=== nano-Lambda executando"
+# Impresso pelo guest depois de importar o handler (ponto do snapshot)
+SNAPSHOT_READY_MARKER = b"NANO_LAMBDA_READY"
+SNAPSHOT_BOOT_TIMEOUT = 60
+# O drive de input e trocado apos o restore, sempre com o mesmo tamanho
+SNAPSHOT_INPUT_DRIVE_SIZE = 1024 * 1024
+# Como o restore entrega a memoria ao guest:
+#   File - o Firecracker mapeia o vm_mem (page faults do kernel)
+#   Uffd - servidor de paginas no host com prefetch do working set
+#          (ver uffd_server.py)
+SNAPSHOT_MEM_BACKEND = "File"
+MEM_BACKENDS = ["File", "Uffd"]
+
+# Pool de microVMs pre-aquecidas (processo Firecracker ja iniciado e configurado)
+POOL_SIZE = 2
+POOL_MAX_IDLE_AGE = 300  # segundos ate uma VM ociosa ser descartada
+
+# Funcoes registradas (--register): rootfs pre-construido por funcao,
+# com as dependencias instaladas; invocadas pelo nome ou ID
+# (ver function_registry.py). Imagens alem da cota saem por LRU
+REGISTRY_DIR = "./registry"
+REGISTRY_QUOTA_MIB = 4096
+
+# Timeout do boot + execucao de uma invocacao
+RUN_TIMEOUT = 30
+# Lotes (invoke_many): o primeiro tem BATCH_INITIAL itens; os seguintes
+# sao dimensionados pelo tempo por item observado para o handler rodar
+# uns BATCH_TARGET_S por boot
+BATCH_INITIAL = 8
+BATCH_MAX = 1000
+BATCH_TARGET_S = 20
+BATCH_TIMEOUT = 60
+
+# Agentes keep-alive (agent_pool.py): com nano_lambda.mode=agent no
+# cmdline o guest importa o handler uma vez e atende requisicoes pelo
+# vsock ate ser despejado (ocioso ha AGENT_IDLE_TTL) ou reciclado (depois
+# de AGENT_MAX_REQUESTS requisicoes)
+AGENT_BOOT_ARG = "nano_lambda.mode=agent"
+# Impresso pelo guest quando o agente ja escuta no vsock
+AGENT_READY_MARKER = b"NANO_LAMBDA_AGENT_READY"
+AGENT_BOOT_TIMEOUT = 60
+AGENT_MAX = 4
+AGENT_IDLE_TTL = 60
+AGENT_MAX_REQUESTS = 1000
+# Balao de memoria (balloon.py): infla o balao do agente ocioso ha
+# AGENT_BALLOON_IDLE segundos e desinfla antes da proxima requisicao
+AGENT_BALLOON_IDLE = 10
+
 
 class NanoLambda:
     """
@@ -42,11 +175,71 @@ class NanoLambda:
     - Limpa recursos
     """
 
-    def __init__(self):
-        self.socket_path = SOCKET_PATH
+    def __init__(self, vm_id=None, clone_backend=ROOTFS_CLONE_BACKEND,
+                 input_mode=INPUT_MODE, api_mode=API_MODE,
+                 invoke_mode=INVOKE_MODE, snapshot_store=None,
+                 result_channel=RESULT_CHANNEL, engine=ENGINE,
+                 instrumentation=DISABLED, mem_backend=SNAPSHOT_MEM_BACKEND,
+                 registry=None, qos=None, agents=None, balloon=False):
+        # Cada VM ganha um ID unico e, com ele, seu proprio socket.
+        # Console (pipe), clone do rootfs e drive de input ja sao
+        # unicos por instancia: VMs concorrentes nao se atropelam
+        self.vm_id = vm_id or uuid.uuid4().hex[:12]
+        self.socket_path = os.path.join(SOCKET_DIR, f"firecracker-nanolambda-{self.vm_id}.socket")
         self.fc_process = None
         self.temp_rootfs = None
-        self.output_file = "/tmp/firecracker-output.log"
+        self.rootfs_clone = None
+        self.clone_backend = clone_backend
+        self.input_mode = input_mode
+        self.input_drive = None
+        self.api_mode = api_mode
+        self.api_client = None
+        self.config_file = None
+        self.invoke_mode = invoke_mode
+        self.mem_backend = mem_backend
+        self.page_server = None
+        self.page_server_stats = None
+        self.uffd_path = os.path.join(SOCKET_DIR, f"firecracker-nanolambda-{self.vm_id}.uffd")
+        self.result_channel = result_channel
+        self.engine = engine
+        self.initrd = None
+        self.vsock_path = os.path.join(SOCKET_DIR, f"firecracker-nanolambda-{self.vm_id}.vsock")
+        self.results = None
+        # Inputs do lote em andamento (invoke_many); None = um input so
+        self.batch = None
+        self.snapshot_store = snapshot_store or create_snapshot_store()
+        # Funcao registrada: o rootfs dela substitui o template generico
+        self.registry = registry
+        self.image = None
+        self.rootfs_template = ROOTFS_TEMPLATE
+        # Perfil de QoS (qos.py): `qos` vale para qualquer funcao; sem
+        # ele, o perfil da funcao registrada ou o QOS_PROFILE
+        if qos:
+            get_profile(qos)
+        self.qos = qos
+        self.qos_profile = qos or QOS_PROFILE
+        self.running = False
+        # Marcada pelo kill() (outra thread): o processo morre assim que sobe
+        self.killed = False
+        # Agentes keep-alive (AgentPool): tentados antes de bootar uma VM
+        # avulsa. agent_mode/agent sao desta VM quando ela e um agente
+        self.agents = agents
+        self.agent_mode = False
+        self.agent_idle = None
+        self.agent = None
+        self.agent_requests = 0
+        self._console_thread = None
+        # Balao de memoria (balloon.py): anexado antes do boot; o agente
+        # ocioso infla e devolve a memoria ao host
+        self.balloon = balloon
+        self.balloon_mib = 0
+        # Spans e metricas por fase (instrumentation.py); desligado por padrao
+        self.instrumentation = instrumentation
+        self.console = ConsoleParser()
+        self.timings = {}
+        self._exec_at = None
+        self._console_tail = b""
+        self.warm = False
 
     def _api_url(self, path):
         """Converte path para URL do socket Unix."""
@@ -55,11 +248,21 @@ class NanoLambda:
 
     def _call_api(self, method, path, data=None):
         """Faz chamada para a API REST do Firecracker via socket Unix."""
+        if self.api_mode != "legacy":
+            if self.api_client is None:
+                self.api_client = FirecrackerClient(self.socket_path)
+            return self.api_client.request(method, path, data)
+
+        # Importado so aqui: o requests pesa no startup do CLI
+        import requests_unixsocket
+
         session = requests_unixsocket.Session()
         url = self._api_url(path)
 
         if method == "PUT":
             resp = session.put(url, json=data)
+        elif method == "PATCH":
+            resp = session.patch(url, json=data)
         elif method == "GET":
             resp = session.get(url)
         else:
@@ -70,22 +273,60 @@ class NanoLambda:
 
         return resp
 
+    @traced("prepare")
     def prepare_rootfs(self, function_path, input_data):
         """
         Prepara o rootfs com a função e input.
 
-        Cria uma cópia temporária do rootfs template, monta,
-        e copia a função e dados de entrada para dentro.
+        Cria um clone temporário do rootfs template (reflink ou cópia
+        esparsa, ver rootfs_clone.py), monta, e copia a função e dados
+        de entrada para dentro.
+
+        No modo "drive" o rootfs não é montado: função e input vão
+        num tar em memória anexado como segundo drive.
         """
-        # Cria cópia temporária do rootfs
-        self.temp_rootfs = tempfile.NamedTemporaryFile(
-            suffix='.ext4',
-            delete=False
-        ).name
+        start = time.time()
+
+        # Clona o rootfs template
+        print(f"[*] Clonando rootfs template...")
+        self.rootfs_clone = clone_rootfs(self.rootfs_template, backend=self.clone_backend)
+        self.temp_rootfs = self.rootfs_clone.path
+        self.timings["clone"] = self.rootfs_clone.elapsed
+        print(f"    Rootfs clonado via {self.rootfs_clone.backend} "
+              f"({self.rootfs_clone.elapsed:.3f}s)")
+
+        if self.input_mode == "drive":
+            print(f"[*] Gerando drive de input: {function_path}")
+            # A imagem de uma funcao registrada ja traz o handler
+            files = ({"input.txt": input_data} if self.image
+                     else function_files(function_path, input_data))
+            if self.batch is not None:
+                files["batch.jsonl"] = self._batch_jsonl()
+            self.input_drive = write_input_drive(files)
+        else:
+            self._copy_into_rootfs(function_path, input_data)
 
-        print(f"[*] Copiando rootfs template...")
-        shutil.copy(ROOTFS_TEMPLATE, self.temp_rootfs)
+        self.timings["prepare"] = time.time() - start
 
+    @traced("prepare")
+    def prepare_initrd(self, function_path, input_data):
+        """
+        Prepara o initrd da invocacao (engine initramfs).
+
+        O initrd da funcao (runtime + handler) vem do cache; a
+        invocacao clona ele e anexa uma camada cpio com o input.
+        """
+        start = time.time()
+        print(f"[*] Preparando initrd: {function_path}")
+        cache = InitrdCache(INITRD_CACHE_DIR, self.rootfs_template)
+        self.initrd, built = cache.invocation_initrd(function_path, input_data)
+        self.timings["clone"] = self.initrd.elapsed
+        if built:
+            print(f"    Initrd da funcao gerado e guardado em cache")
+        self.timings["prepare"] = time.time() - start
+
+    def _copy_into_rootfs(self, function_path, input_data):
+        """Monta o clone do rootfs e copia função e input para /functions."""
         # Monta e copia arquivos
         mount_point = tempfile.mkdtemp()
 
@@ -97,106 +338,340 @@ class NanoLambda:
             )
 
             # Copia a funcao para /functions/handler.py
-            print(f"[*] Copiando funcao: {function_path}")
-            func_dest = os.path.join(mount_point, "functions", "handler.py")
-            shutil.copy(function_path, func_dest)
+            if not self.image:
+                print(f"[*] Copiando funcao: {function_path}")
+                func_dest = os.path.join(mount_point, "functions", "handler.py")
+                shutil.copy(function_path, func_dest)
 
             # Escreve o input em /functions/input.txt
             input_dest = os.path.join(mount_point, "functions", "input.txt")
             with open(input_dest, 'w') as f:
                 f.write(input_data)
 
+            if self.batch is not None:
+                with open(os.path.join(mount_point, "functions", "batch.jsonl"), "w") as f:
+                    f.write(self._batch_jsonl())
+
         finally:
             subprocess.run(["umount", mount_point], check=True)
             os.rmdir(mount_point)
 
-    def start_firecracker(self):
+    @traced("spawn")
+    def start_firecracker(self, config_file=None):
         """
         Inicia o processo Firecracker.
 
         O Firecracker escuta em um socket Unix e espera
         comandos via API REST. O output do console serial
-        é redirecionado para um arquivo de log.
+        sai por um pipe, lido pelo run_vm.
+
+        Com config_file, a VM já sobe configurada e bootando.
         """
         # Remove socket antigo se existir
         if os.path.exists(self.socket_path):
             os.remove(self.socket_path)
 
-        # Remove arquivo de output antigo
-        if os.path.exists(self.output_file):
-            os.remove(self.output_file)
-
         print("[*] Iniciando Firecracker...")
-
-        # Redireciona stdout e stderr para arquivo
-        # Isso captura o console serial da VM
-        self.output_handle = open(self.output_file, 'w')
+        start = time.time()
+
+        # Redireciona stdout e stderr para um pipe
+        # Isso captura o console serial da VM. O stdin vira a entrada
+        # do console (usado no modo snapshot para acordar o guest)
+        cmd = [FIRECRACKER_BIN, "--api-sock", self.socket_path]
+        if config_file:
+            cmd += ["--config-file", config_file]
         self.fc_process = subprocess.Popen(
-            [FIRECRACKER_BIN, "--api-sock", self.socket_path],
-            stdout=self.output_handle,
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT
         )
+        if self.killed:
+            # kill() chegou antes do processo existir
+            self.fc_process.kill()
 
-        # Espera socket ficar disponível
-        for _ in range(50):
-            if os.path.exists(self.socket_path):
-                break
-            time.sleep(0.1)
-        else:
-            raise Exception("Timeout esperando socket do Firecracker")
-
-        time.sleep(0.2)  # Pausa extra para garantir
+        # Espera o socket aceitar conexões (sem sleep fixo)
+        wait_for_socket(self.socket_path).close()
+        self.timings["spawn"] = time.time() - start
 
+    @traced("config")
     def configure_vm(self):
         """
         Configura a microVM via API REST.
 
         Define kernel, rootfs e recursos (CPU/memória).
+        No modo pipeline as três chamadas vão numa tacada só.
         """
-        print(f"[*] Configurando kernel...")
-        self._call_api("PUT", "/boot-source", {
+        if self.api_mode == "pipeline":
+            print(f"[*] Configurando VM (pipeline)...")
+            if self.api_client is None:
+                self.api_client = FirecrackerClient(self.socket_path)
+            vsock = [("PUT", "/vsock", self._vsock())] if self._use_vsock() else []
+            balloon = [("PUT", "/balloon", balloon_device())] if self.balloon else []
+            self.api_client.pipeline(
+                [("PUT", "/boot-source", self._boot_source())]
+                + [("PUT", f"/drives/{d['drive_id']}", d) for d in self._drives()]
+                + [("PUT", "/machine-config", self._machine_config())]
+                + vsock
+                + balloon
+            )
+            return
+
+        self.configure_kernel()
+        self.configure_rootfs()
+        self.configure_machine()
+        self.configure_vsock()
+        self.configure_balloon()
+
+    def _boot_source(self):
+        boot_args = BOOT_ARGS
+        if self.invoke_mode == "snapshot":
+            boot_args += " " + SNAPSHOT_BOOT_ARG
+        if self.agent_mode:
+            boot_args += f" {AGENT_BOOT_ARG} nano_lambda.agent_idle={int(self.agent_idle or 0)}"
+        boot_source = {
             "kernel_image_path": KERNEL_PATH,
-            "boot_args": "console=ttyS0 reboot=k panic=1 pci=off quiet"
-        })
-
-        print(f"[*] Configurando rootfs...")
-        self._call_api("PUT", "/drives/rootfs", {
+            "boot_args": boot_args
+        }
+        if self.initrd:
+            boot_source["initrd_path"] = self.initrd.path
+        return boot_source
+
+    def _drives(self):
+        if self.temp_rootfs is None:
+            return []  # engine initramfs: nenhum drive de bloco
+        drives = [{
             "drive_id": "rootfs",
             "path_on_host": self.temp_rootfs,
             "is_root_device": True,
             "is_read_only": False
-        })
-
-        print(f"[*] Configurando recursos ({VCPU_COUNT} vCPU, {MEM_SIZE_MIB}MB RAM)...")
-        self._call_api("PUT", "/machine-config", {
+        }]
+        if self.input_drive:
+            drives.append({
+                "drive_id": "input",
+                "path_on_host": self.input_drive,
+                "is_root_device": False,
+                "is_read_only": True
+            })
+        limiter = drive_limiter(self.qos_profile)
+        if limiter:
+            for drive in drives:
+                drive["rate_limiter"] = limiter
+        return drives
+
+    def _machine_config(self):
+        return {
             "vcpu_count": VCPU_COUNT,
             "mem_size_mib": MEM_SIZE_MIB
-        })
+        }
+
+    def _use_vsock(self):
+        # No modo snapshot todas as VMs restauradas teriam o mesmo
+        # uds_path do snapshot: o resultado volta pelo console. O agente
+        # so fala pelo vsock
+        return self.agent_mode or (self.result_channel == "vsock"
+                                   and self.invoke_mode != "snapshot")
+
+    def _vsock(self):
+        return {
+            "guest_cid": VSOCK_GUEST_CID,
+            "uds_path": self.vsock_path
+        }
+
+    def configure_kernel(self):
+        """Define o kernel e os argumentos de boot."""
+        print(f"[*] Configurando kernel...")
+        self._call_api("PUT", "/boot-source", self._boot_source())
+
+    def configure_rootfs(self):
+        """Anexa o rootfs preparado para esta invocacao (e o drive de input)."""
+        for drive in self._drives():
+            print(f"[*] Configurando drive {drive['drive_id']}...")
+            self._call_api("PUT", f"/drives/{drive['drive_id']}", drive)
 
-    def run_vm(self, timeout=30):
+    def configure_machine(self):
+        """Define vCPUs e memoria da microVM."""
+        print(f"[*] Configurando recursos ({VCPU_COUNT} vCPU, {MEM_SIZE_MIB}MB RAM)...")
+        self._call_api("PUT", "/machine-config", self._machine_config())
+
+    def set_qos(self, profile):
+        """
+        Troca o perfil de QoS. Com a VM rodando os limites dos drives
+        mudam na hora (PATCH, numa conexao propria: o invoke pode estar
+        usando a dele em outra thread); antes do boot valem no PUT.
+        """
+        get_profile(profile)
+        self.qos_profile = profile
+        if not self.running:
+            return
+        print(f"[*] QoS ao vivo: perfil {profile}")
+        client = FirecrackerClient(self.socket_path)
+        try:
+            for method, path, data in qos_calls(profile, [d["drive_id"] for d in self._drives()]):
+                client.request(method, path, data)
+        finally:
+            client.close()
+
+    def configure_vsock(self):
+        """Anexa o virtio-vsock usado como canal de resultado."""
+        if self._use_vsock():
+            print(f"[*] Configurando vsock (CID {VSOCK_GUEST_CID})...")
+            self._call_api("PUT", "/vsock", self._vsock())
+
+    def configure_balloon(self):
+        """Anexa o balao de memoria (vazio, com estatisticas do guest)."""
+        if self.balloon:
+            print(f"[*] Configurando balao de memoria...")
+            self._call_api("PUT", "/balloon", balloon_device())
+
+    def _balloon_call(self, method, path, data=None):
+        # Conexao propria, como no set_qos: o agente pode estar atendendo
+        # pela conexao da VM em outra thread
+        client = FirecrackerClient(self.socket_path)
+        try:
+            return client.request(method, path, data)
+        finally:
+            client.close()
+
+    def balloon_stats(self):
+        """Estatisticas do balao e do guest (parse_balloon_stats); None sem balao."""
+        if not (self.balloon and self.running):
+            return None
+        return parse_balloon_stats(self._balloon_call("GET", "/balloon/statistics").json())
+
+    def inflate_balloon(self):
+        """
+        Infla o balao da VM ociosa ate o guest ficar so com o que usa
+        (inflate_target). Retorna o tamanho pedido, em MiB.
+        """
+        stats = self.balloon_stats()
+        if stats is None:
+            return 0
+        target = inflate_target(stats, MEM_SIZE_MIB)
+        if target != self.balloon_mib:
+            self._balloon_call("PATCH", "/balloon", {"amount_mib": target})
+            self.balloon_mib = target
+        return target
+
+    def deflate_balloon(self):
+        """Esvazia o balao: a memoria volta ao guest antes da proxima requisicao."""
+        if self.balloon_mib and self.running:
+            self._balloon_call("PATCH", "/balloon", {"amount_mib": 0})
+        self.balloon_mib = 0
+
+    def memory_usage(self):
+        """Reserva, balao e RSS da VM para a contabilidade do host (vm_memory)."""
+        stats = None
+        rss = None
+        if self.running:
+            try:
+                stats = self.balloon_stats()
+            except Exception:
+                pass  # a VM pode estar saindo; conta a reserva inteira
+            process = self.fc_process
+            if process is not None:
+                rss = process_rss_mib(process.pid)
+        return vm_memory(MEM_SIZE_MIB, stats, rss)
+
+    def launch_with_config_file(self):
+        """
+        Inicia o Firecracker já configurado via --config-file.
+
+        Nenhuma chamada de API antes do boot: o Firecracker lê o
+        JSON e sobe a VM direto (sem InstanceStart).
+        """
+        config = render_config(self._boot_source(), self._drives(), self._machine_config(),
+                               vsock=self._vsock() if self._use_vsock() else None,
+                               balloon=balloon_device() if self.balloon else None)
+        self.config_file = write_config(config)
+        print(f"[*] Iniciando Firecracker com --config-file...")
+        self.start_firecracker(config_file=self.config_file)
+
+    @traced("warm_up")
+    def warm_up(self):
+        """
+        Pre-aquece a microVM para uso pelo pool.
+
+        Inicia o Firecracker e configura tudo que nao depende da
+        invocacao (kernel e recursos). Falta so o rootfs, que leva
+        a funcao e o input, e o InstanceStart.
+
+        No modo snapshot so o processo e iniciado: o /snapshot/load
+        exige uma VM ainda nao configurada.
+        """
+        self.start_firecracker()
+        if self.invoke_mode != "snapshot":
+            self.configure_kernel()
+            self.configure_machine()
+            self.configure_vsock()
+            self.configure_balloon()
+        self.warm = True
+
+    def is_warm(self):
+        """Indica se a VM esta pre-aquecida e o processo ainda vivo."""
+        return (
+            self.warm
+            and self.fc_process is not None
+            and self.fc_process.poll() is None
+        )
+
+    @traced("run")
+    def run_vm(self, timeout=RUN_TIMEOUT, already_started=False):
         """
         Inicia a VM e aguarda a execução.
 
         A VM executa a função e desliga automaticamente.
-        Capturamos o output do console serial do arquivo de log.
+        O console serial é lido do pipe direto pelo parser
+        incremental (console_parser.py), sem arquivo temporário.
+        Encerramos assim que o processo sai ou o guest avisa
+        que a função terminou (sem esperar o poweroff).
+
+        Retorna o ConsoleParser com o resultado.
         """
-        print(f"[*] Iniciando microVM...")
-        self._call_api("PUT", "/actions", {"action_type": "InstanceStart"})
+        start = time.time()
+        if not already_started:
+            print(f"[*] Iniciando microVM...")
+            self._call_api("PUT", "/actions", {"action_type": "InstanceStart"})
+        self.running = True
 
         print(f"[*] Aguardando execução (timeout: {timeout}s)...")
 
-        # Aguarda VM terminar ou timeout
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if self.fc_process.poll() is not None:
-                # Processo terminou
-                break
-            time.sleep(0.5)
+        # Aguarda VM terminar, marcador de fim ou timeout
+        self._exec_at = None
+        reason = self._watch(timeout)
+        end = time.time()
+        if reason == "marker":
+            print(f"[*] Funcao finalizada, encerrando microVM...")
+        elif reason == "timeout":
+            print(f"[!] Timeout apos {timeout}s")
 
-        # Fecha o handle do arquivo de output
-        self.output_handle.close()
+        # Boot e handler separados pelo aviso do guest (se apareceu)
+        if self._exec_at is not None:
+            self.timings["boot"] = self._exec_at - start
+            self.timings["handler"] = end - self._exec_at
 
         # Se o processo ainda estiver rodando, mata
+        self.running = False
+        self._stop_firecracker()
+
+        return self.console
+
+    def _on_console(self, chunk):
+        if self._exec_at is None:
+            # O marcador pode chegar quebrado entre dois pedacos
+            if EXEC_MARKER in self._console_tail + chunk:
+                self._exec_at = time.time()
+            self._console_tail = chunk[-len(EXEC_MARKER):]
+        self.console.feed(chunk)
+
+    def _watch(self, timeout, done_marker=DONE_MARKER):
+        """Le o console ate o marcador, o fim do processo ou o timeout."""
+        self._console_tail = b""
+        watcher = VmWatcher(self.fc_process, self.fc_process.stdout,
+                            self._on_console, done_marker)
+        return watcher.wait(timeout)
+
+    def _stop_firecracker(self):
         if self.fc_process.poll() is None:
             self.fc_process.terminate()
             try:
@@ -205,22 +680,175 @@ class NanoLambda:
                 self.fc_process.kill()
                 self.fc_process.wait()
 
-        # Lê output do arquivo
-        if os.path.exists(self.output_file):
-            with open(self.output_file, 'r') as f:
-                output = f.read()
+    def start_result_channel(self):
+        """Escuta o vsock antes do boot (o guest conecta durante a execucao)."""
+        if self._use_vsock():
+            self.results = ResultChannel(self.vsock_path)
+            self.results.start()
+
+    @traced("parse")
+    def collect_result(self, console):
+        """Resultado pelo vsock; se o guest nao usou o canal, pelo console."""
+        if self.batch is not None:
+            return self._batch_result(console)
+        result = None
+        if self.results:
+            result = self.results.result(console.log_text())
+        if result is None:
+            result = console.result()
+        return result
+
+    def _snapshot_fingerprint(self):
+        """Tudo (alem do handler) que invalida o snapshot de uma funcao."""
+        return {
+            "rootfs": file_fingerprint(self.rootfs_template),
+            "kernel": file_fingerprint(KERNEL_PATH),
+            "boot_source": self._boot_source(),
+            "machine_config": self._machine_config(),
+        }
+
+    @traced("snapshot_create")
+    def create_snapshot(self, function_path, entry):
+        """
+        Boota a funcao uma vez e tira o snapshot apos os imports.
+
+        O guest (modo snapshot do /run-function.sh) importa o handler,
+        imprime SNAPSHOT_READY_MARKER e fica esperando uma linha no
+        console. A VM e pausada nesse ponto e gravada em `entry`.
+        O rootfs usado no boot fica junto do snapshot: o estado em
+        memoria do guest (page cache, ext4) corresponde a ele.
+
+        Retorna o meta da entrada (tempo de boot ate o READY).
+        """
+        print(f"[*] Criando snapshot da funcao: {function_path}")
+        start = time.time()
+
+        # Sempre uma copia real (reflink/esparsa): o arquivo e persistente
+        clone = clone_rootfs(self.rootfs_template, clone_dir=entry.dir)
+        os.rename(clone.path, entry.rootfs)
+        with open(function_path, "rb") as f:
+            handler = f.read()
+        input_drive = write_input_drive({"handler.py": handler}, directory=entry.dir,
+                                        size=SNAPSHOT_INPUT_DRIVE_SIZE)
+        os.rename(input_drive, entry.input_drive)
+
+        try:
+            boot_start = time.time()
+            self.start_firecracker()
+            self.configure_kernel()
+            self._call_api("PUT", "/drives/rootfs", {
+                "drive_id": "rootfs",
+                "path_on_host": entry.rootfs,
+                "is_root_device": True,
+                "is_read_only": False
+            })
+            self._call_api("PUT", "/drives/input", {
+                "drive_id": "input",
+                "path_on_host": entry.input_drive,
+                "is_root_device": False,
+                "is_read_only": True
+            })
+            self.configure_machine()
+            self._call_api("PUT", "/actions", {"action_type": "InstanceStart"})
+
+            reason = self._watch(SNAPSHOT_BOOT_TIMEOUT, SNAPSHOT_READY_MARKER)
+            if reason != "marker":
+                raise Exception(f"Guest nao ficou pronto para o snapshot ({reason}):\n"
+                                f"{self.console.log_text()}")
+            boot_time = time.time() - boot_start
+
+            print("[*] Guest pronto, criando snapshot...")
+            self._call_api("PATCH", "/vm", {"state": "Paused"})
+            self._call_api("PUT", "/snapshot/create", {
+                "snapshot_type": "Full",
+                "snapshot_path": entry.state_file,
+                "mem_file_path": entry.mem_file
+            })
+        finally:
+            self.cleanup()
+
+        return {"boot_s": boot_time, "create_s": time.time() - start,
+                "mem_bytes": allocated_bytes(entry.mem_file)}
+
+    @traced("restore")
+    def restore_snapshot(self, entry, track_dirty_pages=False):
+        """
+        Restaura o snapshot com o rootfs e o input desta invocacao.
+
+        A VM e carregada pausada, os drives sao trocados pelos da
+        invocacao e so entao ela e retomada. Usa a cabeca da cadeia de
+        snapshots Diff; com track_dirty_pages a VM pode gerar um Diff.
+        """
+        print(f"[*] Restaurando snapshot {entry.key} (camada {entry.head_layer()})...")
+        mem_backend = {"backend_type": "File", "backend_path": entry.head_mem_file()}
+        if self.mem_backend == "Uffd" and not track_dirty_pages:
+            # O servidor precisa estar ouvindo antes do /snapshot/load
+            self.page_server = PageServer(entry.head_mem_file(), self.uffd_path,
+                                          entry.working_set_file()).start()
+            mem_backend = {"backend_type": "Uffd", "backend_path": self.uffd_path}
+        # O perfil de QoS entra junto com a troca dos drives; buckets
+        # desligados limpam o que o snapshot tiver guardado
+        limiter = drive_limiter(self.qos_profile, live=True)
+        drives = [{"drive_id": "rootfs", "path_on_host": self.temp_rootfs, "rate_limiter": limiter},
+                  {"drive_id": "input", "path_on_host": self.input_drive, "rate_limiter": limiter}]
+        calls = [
+            ("PUT", "/snapshot/load", {
+                "snapshot_path": entry.head_state_file(),
+                "mem_backend": mem_backend,
+                "enable_diff_snapshots": track_dirty_pages,
+                "resume_vm": False
+            }),
+            *[("PATCH", f"/drives/{drive['drive_id']}", drive) for drive in drives],
+            ("PATCH", "/vm", {"state": "Resumed"}),
+        ]
+        if self.page_server:
+            # O working set entra antes do resume (VM pausada)
+            self._send_calls(calls[:1])
+            start = time.time()
+            self.page_server.wait_prefetch()
+            self.timings["prefetch"] = time.time() - start
+            calls = calls[1:]
+        self._send_calls(calls)
+
+    def _send_calls(self, calls):
+        if self.api_mode == "pipeline":
+            if self.api_client is None:
+                self.api_client = FirecrackerClient(self.socket_path)
+            self.api_client.pipeline(calls)
         else:
-            output = ""
+            for method, path, data in calls:
+                self._call_api(method, path, data)
+
+    @traced("teardown")
+    def kill(self):
+        """
+        Interrompe a invocacao em andamento a partir de outra thread.
 
-        return output
+        So mata o processo Firecracker: o run_vm ve o fim do processo e a
+        thread dona da invocacao faz o cleanup().
+        """
+        self.killed = True
+        process = self.fc_process
+        if process and process.poll() is None:
+            process.kill()
 
     def cleanup(self):
         """Remove recursos temporários."""
         print(f"[*] Limpando...")
+        self.warm = False
+        self.running = False
+        self.balloon_mib = 0
+
+        # Fecha a conexao com o agente
+        if self.agent:
+            self.agent.close()
+            self.agent = None
+        self.agent_mode = False
 
-        # Fecha handle do arquivo se ainda estiver aberto
-        if hasattr(self, 'output_handle') and not self.output_handle.closed:
-            self.output_handle.close()
+        # Fecha a conexao com a API
+        if self.api_client:
+            self.api_client.close()
+            self.api_client = None
 
         # Para o processo Firecracker se ainda estiver rodando
         if self.fc_process and self.fc_process.poll() is None:
@@ -230,58 +858,870 @@ class NanoLambda:
             except subprocess.TimeoutExpired:
                 self.fc_process.kill()
 
-        # Remove rootfs temporário
-        if self.temp_rootfs and os.path.exists(self.temp_rootfs):
-            os.remove(self.temp_rootfs)
+        # A leitura do console do agente termina com o fim do processo
+        if self._console_thread:
+            self._console_thread.join(timeout=5)
+            self._console_thread = None
+
+        # Para o servidor de paginas (grava o working set do restore)
+        if self.page_server:
+            stats = self.page_server_stats = self.page_server.stop()
+            self.page_server = None
+            self.instrumentation.inc("uffd_pages", stats["faults"], source="fault")
+            self.instrumentation.inc("uffd_pages", stats["prefetched_pages"], source="prefetch")
+            print(f"[*] Servidor de paginas: {stats['prefetched_pages']} paginas "
+                  f"antecipadas, {stats['faults']} faults")
+            if "error" in stats:
+                print(f"[!] Falha no servidor de paginas: {stats['error']}")
+
+        # Fecha os pipes do console
+        if self.fc_process and self.fc_process.stdout:
+            self.fc_process.stdout.close()
+        if self.fc_process and self.fc_process.stdin:
+            self.fc_process.stdin.close()
+
+        # Remove o clone do rootfs
+        if self.rootfs_clone:
+            self.rootfs_clone.release()
+            self.rootfs_clone = None
+        self.temp_rootfs = None
+
+        # Remove o initrd da invocacao
+        if self.initrd:
+            self.initrd.release()
+            self.initrd = None
+
+        # Remove o drive de input
+        if self.input_drive and os.path.exists(self.input_drive):
+            os.remove(self.input_drive)
+        self.input_drive = None
+
+        # Fecha o canal de resultado
+        if self.results:
+            self.results.close()
+            self.results = None
+        if os.path.exists(self.vsock_path):
+            os.remove(self.vsock_path)
+
+        # Remove o config usado no --config-file
+        if self.config_file and os.path.exists(self.config_file):
+            os.remove(self.config_file)
+        self.config_file = None
 
         # Remove socket
         if os.path.exists(self.socket_path):
             os.remove(self.socket_path)
 
-        # Remove arquivo de output
-        if os.path.exists(self.output_file):
-            os.remove(self.output_file)
+        self._release_image()
 
+    def _resolve_function(self, function_path):
+        """
+        Handler a executar. Um nome (ou ID) registrado no lugar do
+        arquivo usa a imagem da funcao como rootfs, com um lease ate o
+        cleanup: atualizar ou despejar a funcao nao afeta esta invocacao.
+        """
+        self._release_image()
+        self.rootfs_template = ROOTFS_TEMPLATE
+        self.qos_profile = self.qos or QOS_PROFILE
+        if self.registry is None or os.path.isfile(function_path):
+            return function_path
+        self.image = self.registry.acquire(function_path)
+        self.rootfs_template = self.image.rootfs
+        self.qos_profile = self.qos or self.registry.qos_profile(function_path) or QOS_PROFILE
+        print(f"[*] Funcao registrada: {function_path} (imagem {self.image.id})")
+        return self.image.handler
+
+    def _release_image(self):
+        if self.image:
+            self.image.release()
+            self.image = None
+
+    @traced("invoke")
     def invoke(self, function_path, input_data):
         """
         Invoca uma função Lambda-style.
 
         Orquestra todo o ciclo: preparação, execução e limpeza.
+        Se a VM veio pre-aquecida do pool, pula o start e a
+        configuracao ja feitos e so anexa o rootfs.
         """
+        if self.agents is not None and self.batch is None:
+            # Um agente vivo da funcao atende sem boot; sem vaga, VM avulsa
+            result = self.agents.invoke(function_path, input_data)
+            if result is not None:
+                self._count_invocation(result)
+                return result
+        self.console = ConsoleParser()
+        self.timings = {}
+        self.page_server_stats = None
+        function_path = self._resolve_function(function_path)
+        if self.invoke_mode == "snapshot":
+            return self.invoke_snapshot(function_path, input_data)
         try:
-            self.prepare_rootfs(function_path, input_data)
-            self.start_firecracker()
-            self.configure_vm()
-            output = self.run_vm()
-            return self.parse_output(output)
+            if self.engine == "initramfs":
+                self.prepare_initrd(function_path, input_data)
+            else:
+                self.prepare_rootfs(function_path, input_data)
+            self.start_result_channel()
+
+            # Start + configuracao (medido para comparar os modos de API)
+            start = time.time()
+            already_started = False
+            if self.is_warm():
+                if self.initrd:
+                    # O boot-source do pool nao tinha o initrd desta invocacao
+                    self.configure_kernel()
+                self.configure_rootfs()
+                self.timings["config"] = time.time() - start
+            elif self.api_mode == "config-file":
+                self.launch_with_config_file()
+                already_started = True
+            else:
+                self.start_firecracker()
+                config_start = time.time()
+                self.configure_vm()
+                self.timings["config"] = time.time() - config_start
+            self.timings["launch"] = time.time() - start
+
+            # Boot + execucao, ate o marcador de fim
+            start = time.time()
+            timeout = BATCH_TIMEOUT if self.batch is not None else RUN_TIMEOUT
+            console = self.run_vm(timeout=timeout, already_started=already_started)
+            self.timings["run"] = time.time() - start
+
+            start = time.time()
+            result = self.collect_result(console)
+            self.timings["parse"] = time.time() - start
+        finally:
+            start = time.time()
+            self.cleanup()
+            self.timings["teardown"] = time.time() - start
+
+        result["timings"] = dict(self.timings)
+        self._count_invocation(result)
+        return result
+
+    @traced("agent_boot")
+    def start_agent(self, function_path, idle_timeout=None):
+        """
+        Boota a VM como agente keep-alive da funcao.
+
+        O /agent-runner.py do guest importa o handler, escuta no vsock e
+        imprime AGENT_READY_MARKER; a VM fica de pe atendendo
+        agent_invoke() ate o cleanup(). Com `idle_timeout` o proprio
+        guest desliga se ficar esse tempo sem requisicao (o host sumiu).
+        """
+        if self.engine != "rootfs":
+            raise Exception("o agente keep-alive precisa da engine rootfs")
+        self.console = ConsoleParser()
+        self.timings = {}
+        self.agent_mode = True
+        self.agent_idle = idle_timeout
+        self.agent_requests = 0
+        start = time.time()
+        try:
+            function_path = self._resolve_function(function_path)
+            self.prepare_rootfs(function_path, "")
+            if self.api_mode == "config-file":
+                self.launch_with_config_file()
+            else:
+                self.start_firecracker()
+                self.configure_vm()
+                print(f"[*] Iniciando agente...")
+                self._call_api("PUT", "/actions", {"action_type": "InstanceStart"})
+            self.running = True
+
+            reason = self._watch(AGENT_BOOT_TIMEOUT, AGENT_READY_MARKER)
+            if reason != "marker":
+                raise Exception(f"Agente nao ficou pronto ({reason}):\n"
+                                f"{self.console.log_text()}")
+            self.agent = AgentConnection(self.vsock_path).connect()
+            # O console precisa continuar sendo lido: com o pipe cheio o
+            # guest trava escrevendo no serial
+            self._console_thread = threading.Thread(
+                target=self._read_console, name=f"console-{self.vm_id}", daemon=True)
+            self._console_thread.start()
+        except Exception:
+            self.cleanup()
+            raise
+        self.timings["agent_boot"] = time.time() - start
+        print(f"[*] Agente pronto em {self.timings['agent_boot']:.3f}s")
+
+    def _read_console(self):
+        fd = self.fc_process.stdout.fileno()
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            self.console.feed(chunk)
+
+    def is_agent_alive(self):
+        """
+        Indica se o agente esta conectado e o processo ainda vivo. O
+        guest fecha a conexao quando fica ocioso demais: um agente com
+        o processo de pe mas sem conexao nao atende mais.
+        """
+        return (
+            self.agent is not None
+            and self.fc_process is not None
+            and self.fc_process.poll() is None
+            and self.agent.is_open()
+        )
+
+    def agent_ping(self):
+        """Keepalive do agente ocioso (zera o timeout ocioso do guest)."""
+        try:
+            self.agent.ping()
+        except Exception:
+            self.agent.close()
+            self.agent = None
+            raise
+
+    @traced("agent_invoke")
+    def agent_invoke(self, input_data, timeout=RUN_TIMEOUT):
+        """Uma requisicao no agente ja bootado (sem boot nem import)."""
+        start = time.time()
+        self.agent_requests += 1
+        try:
+            item = self.agent.request(input_data, timeout)
+        except Exception:
+            # Timeout ou conexao quebrada: o estado do agente e
+            # desconhecido, a VM nao atende mais ninguem
+            self.agent.close()
+            self.agent = None
+            raise
+        result = {"success": item["success"], "type": item["type"], "data": item["data"],
+                  "size": item["size"], "log": item["log"],
+                  "timings": {"agent": time.time() - start, "handler": item["elapsed_s"],
+                              "agent_requests": self.agent_requests}}
+        if item["error"]:
+            result["error"] = item["error"]
+        if not item["success"]:
+            # Como no boot avulso, a falha volta como texto: o handler pode
+            # ter capturado um resultado binario antes de sair com erro
+            log = item["log"] or ""
+            result.update(type="text",
+                          data=f"{item['error']}\n{log}" if item["error"] else log)
+        return result
+
+    def invoke_many(self, function_path, inputs, batch_size=None):
+        """
+        Roda `inputs` em lotes, cada lote num boot so.
+
+        Os inputs vao num /functions/batch.jsonl; o /batch-runner.py do
+        guest importa o handler uma vez e chama handler.main() por item,
+        devolvendo cada resultado (ou erro) na hora. Sem `batch_size` o
+        primeiro lote tem BATCH_INITIAL itens e os seguintes o que cabe
+        em BATCH_TARGET_S pelo tempo por item observado (media movel).
+
+        Retorna um resultado por input (mesma ordem, com "error" e
+        "elapsed_s"), os lotes e a vazao em itens/s.
+        """
+        if self.invoke_mode != "boot" or self.engine != "rootfs":
+            raise Exception("invoke_many precisa do modo boot com a engine rootfs")
+        results = []
+        batches = []
+        size = batch_size or BATCH_INITIAL
+        per_item = None
+        start = time.time()
+        while len(results) < len(inputs):
+            chunk = inputs[len(results):len(results) + size]
+            self.batch = chunk
+            try:
+                result = self.invoke(function_path, "")
+            finally:
+                self.batch = None
+            items = result["items"]
+            for index in range(len(chunk)):
+                results.append(items.get(index) or {
+                    "index": index, "success": False, "type": "text", "data": None,
+                    "error": "sem resultado: a VM terminou antes do item",
+                    "elapsed_s": None, "log": ""})
+            done = [item["elapsed_s"] for item in items.values() if item["elapsed_s"]]
+            if done:
+                observed = sum(done) / len(done)
+                per_item = observed if per_item is None else 0.5 * per_item + 0.5 * observed
+            batches.append({"size": len(chunk),
+                            "ok": sum(1 for item in results[-len(chunk):] if item["success"]),
+                            "boot_s": result["timings"].get("boot"),
+                            "run_s": result["timings"].get("run"),
+                            "per_item_s": per_item})
+            if batch_size is None:
+                if per_item:
+                    size = max(1, min(BATCH_MAX, int(BATCH_TARGET_S / per_item)))
+                if len(items) < len(chunk):
+                    # Lote incompleto (timeout ou a VM caiu): nao passa do que rodou
+                    size = max(1, min(size, len(items) or len(chunk) // 2))
+        elapsed = time.time() - start
+        for index, item in enumerate(results):
+            item["index"] = index
+        return {"results": results, "batches": batches, "elapsed_s": elapsed,
+                "items_per_s": len(inputs) / elapsed if elapsed else 0.0}
+
+    def _batch_jsonl(self):
+        return "".join(json.dumps({"index": i, "input": input_data}) + "\n"
+                       for i, input_data in enumerate(self.batch))
+
+    def _batch_result(self, console):
+        """Itens do lote pelo vsock e, sem ele, pelos blocos JSON do console."""
+        items = self.results.items() if self.results else {}
+        for header in console.items:
+            item = decode_item(header, base64.b64decode(header.get("data_b64", "")))
+            items.setdefault(item["index"], item)
+        return {"success": bool(items) and all(item["success"] for item in items.values()),
+                "type": "batch", "items": items, "log": console.log_text()}
+
+    def _count_invocation(self, result):
+        self.instrumentation.inc("invocations", engine=self.engine, mode=self.invoke_mode,
+                                 status="ok" if result["success"] else "error")
+
+    def _snapshot_entry(self, function_path):
+        """Snapshot da funcao (criado por uma VM separada na primeira vez)."""
+        creator = NanoLambda(clone_backend=self.clone_backend,
+                             api_mode=self.api_mode, invoke_mode="snapshot",
+                             snapshot_store=self.snapshot_store,
+                             instrumentation=self.instrumentation)
+        creator.rootfs_template = self.rootfs_template
+        entry, created = self.snapshot_store.get_or_create(
+            function_path, self._snapshot_fingerprint(),
+            lambda entry: creator.create_snapshot(function_path, entry)
+        )
+        self.instrumentation.inc("snapshot_lookups", result="created" if created else "hit")
+        return entry, created
+
+    @traced("snapshot_refresh")
+    def refresh_snapshot(self, function_path, input_data):
+        """
+        Atualiza o snapshot da funcao com uma camada Diff.
+
+        Restaura a cabeca da cadeia com dirty page tracking, roda o
+        handler com `input_data` (aquece caches dentro do guest) e,
+        quando o guest volta ao READY, grava so as paginas sujas. Com
+        mais de SNAPSHOT_CHAIN_MAX camadas a cadeia e mesclada em
+        background. Retorna o meta da camada, com o tempo e os bytes do
+        snapshot Full para comparar.
+        """
+        self.console = ConsoleParser()
+        self.timings = {}
+        try:
+            function_path = self._resolve_function(function_path)
+            entry, _ = self._snapshot_entry(function_path)
+            info = self.snapshot_store.add_diff(
+                entry, lambda entry, layer: self._create_diff(entry, layer, input_data))
+        finally:
+            self._release_image()
+        entry.load_meta()
+        if self.snapshot_store.needs_merge(entry, SNAPSHOT_CHAIN_MAX):
+            self.snapshot_store.merge_async(entry)
+        info.update({"chain_length": len(entry.chain),
+                     "full_create_s": entry.meta["create_s"],
+                     "full_bytes": entry.meta.get("mem_bytes")})
+        return info
+
+    def _create_diff(self, entry, layer, input_data):
+        """Gera a camada `layer` a partir da cabeca atual (ver refresh_snapshot)."""
+        print(f"[*] Criando snapshot Diff (camada {layer})...")
+        try:
+            # Rootfs e input da camada em caminhos estaveis: o vm_state
+            # guarda os paths dos drives
+            with self.snapshot_store.restoring(entry) as entry:
+                clone = clone_rootfs(entry.head_rootfs(), clone_dir=entry.dir)
+                os.rename(clone.path, entry.layer_rootfs(layer))
+                self.temp_rootfs = entry.layer_rootfs(layer)
+                self.input_drive = write_input_drive({"input.txt": input_data},
+                                                     directory=entry.dir,
+                                                     size=SNAPSHOT_INPUT_DRIVE_SIZE)
+                os.rename(self.input_drive, entry.layer_input_drive(layer))
+                self.input_drive = entry.layer_input_drive(layer)
+                self.start_firecracker()
+                self.restore_snapshot(entry, track_dirty_pages=True)
+
+            # Roda o handler; o guest volta a esperar no READY
+            start = time.time()
+            self.fc_process.stdin.write(b"\n")
+            self.fc_process.stdin.flush()
+            reason = self._watch(SNAPSHOT_BOOT_TIMEOUT, SNAPSHOT_READY_MARKER)
+            if reason != "marker":
+                raise Exception(f"Guest nao voltou ao READY ({reason}):\n"
+                                f"{self.console.log_text()}")
+            run_time = time.time() - start
+
+            start = time.time()
+            self._call_api("PATCH", "/vm", {"state": "Paused"})
+            self._call_api("PUT", "/snapshot/create", {
+                "snapshot_type": "Diff",
+                "snapshot_path": entry.layer_state_file(layer),
+                "mem_file_path": entry.layer_diff_file(layer)
+            })
+            create_time = time.time() - start
+        finally:
+            # Os arquivos da camada ficam; o store apaga se der erro
+            self.temp_rootfs = None
+            self.input_drive = None
+            self.cleanup()
+        return {"run_s": run_time, "create_s": create_time}
+
+    def invoke_snapshot(self, function_path, input_data):
+        """
+        Invoca restaurando o snapshot da funcao (criado na primeira vez).
+
+        O input vai no drive trocado antes do resume; depois do resume
+        uma linha no console avisa o guest para ler o drive e chamar
+        o handler. Os timings trazem o restore e, para comparar, o
+        boot frio ate o READY medido quando o snapshot foi criado
+        ("cold_boot").
+        """
+        try:
+            entry, created = self._snapshot_entry(function_path)
+            if created:
+                self.timings["snapshot_create"] = entry.meta["create_s"]
+
+            # Lock compartilhado: um merge da cadeia nao apaga a cabeca
+            # antes do Firecracker abrir os arquivos
+            with self.snapshot_store.restoring(entry) as entry:
+                start = time.time()
+                self.rootfs_clone = clone_rootfs(entry.head_rootfs(), backend=self.clone_backend)
+                self.temp_rootfs = self.rootfs_clone.path
+                self.timings["clone"] = self.rootfs_clone.elapsed
+                self.input_drive = write_input_drive({"input.txt": input_data},
+                                                     size=SNAPSHOT_INPUT_DRIVE_SIZE)
+                self.timings["prepare"] = time.time() - start
+
+                if not self.is_warm():
+                    self.start_firecracker()
+                start = time.time()
+                self.restore_snapshot(entry)
+                self.timings["restore"] = time.time() - start
+            self.timings["cold_boot"] = entry.meta["boot_s"]
+
+            # Acorda o guest: o input ja esta no drive
+            self.fc_process.stdin.write(b"\n")
+            self.fc_process.stdin.flush()
+
+            start = time.time()
+            console = self.run_vm(already_started=True)
+            self.timings["run"] = time.time() - start
+
+            start = time.time()
+            result = self.collect_result(console)
+            self.timings["parse"] = time.time() - start
         finally:
+            start = time.time()
             self.cleanup()
+            self.timings["teardown"] = time.time() - start
+
+        result["timings"] = dict(self.timings)
+        if self.page_server_stats:
+            result["page_server"] = self.page_server_stats
+        self._count_invocation(result)
+        return result
 
     def parse_output(self, raw_output):
         """
-        Extrai resultado do output bruto.
+        Extrai resultado de um output bruto já completo.
 
         Procura por marcadores especiais para dados binários (base64).
+        O invoke usa o mesmo parser de forma incremental.
         """
-        # Procura pelo marcador de imagem base64
-        if "BASE64_IMAGE_START" in raw_output and "BASE64_IMAGE_END" in raw_output:
-            start = raw_output.find("BASE64_IMAGE_START") + len("BASE64_IMAGE_START")
-            end = raw_output.find("BASE64_IMAGE_END")
-            base64_data = raw_output[start:end].strip()
-            return {
-                "success": True,
-                "type": "image",
-                "data": base64_data
-            }
+        parser = ConsoleParser()
+        parser.feed(raw_output.encode("utf-8"))
+        return parser.result()
+
+
+def create_snapshot_store(page_store=SNAPSHOT_PAGE_STORE, chunk_size=PAGE_STORE_CHUNK):
+    """Store de snapshots; com page_store a memoria e deduplicada."""
+    pages = PageStore(PAGE_STORE_DIR, chunk_size) if page_store else None
+    return SnapshotStore(SNAPSHOT_DIR, page_store=pages)
+
+
+def create_registry(quota_mib=REGISTRY_QUOTA_MIB, snapshot_store=None):
+    """Registro de funcoes; despejar uma imagem invalida os snapshots dela."""
+    store = snapshot_store or create_snapshot_store()
+    return FunctionRegistry(REGISTRY_DIR, ROOTFS_TEMPLATE,
+                            quota_bytes=quota_mib * 1024 * 1024,
+                            on_evict=lambda image: store.invalidate(image.handler))
+
+
+def create_warm_pool(size=POOL_SIZE, max_idle_age=POOL_MAX_IDLE_AGE, name="default",
+                     clone_backend=ROOTFS_CLONE_BACKEND, input_mode=INPUT_MODE,
+                     api_mode=API_MODE, invoke_mode=INVOKE_MODE,
+                     result_channel=RESULT_CHANNEL, engine=ENGINE,
+                     instrumentation=DISABLED, snapshot_store=None,
+                     mem_backend=SNAPSHOT_MEM_BACKEND, registry=None, qos=None):
+    """Cria um pool de microVMs pre-aquecidas."""
+    # VMs do pool sao configuradas via API antes do boot, entao o
+    # --config-file nao se aplica (cai para keepalive)
+    if api_mode == "config-file":
+        api_mode = "keepalive"
+    store = snapshot_store or create_snapshot_store()
+    return WarmPool(
+        lambda vm_id: NanoLambda(vm_id=vm_id, clone_backend=clone_backend,
+                                 input_mode=input_mode, api_mode=api_mode,
+                                 invoke_mode=invoke_mode, snapshot_store=store,
+                                 result_channel=result_channel, engine=engine,
+                                 instrumentation=instrumentation,
+                                 mem_backend=mem_backend, registry=registry, qos=qos),
+        size=size,
+        max_idle_age=max_idle_age,
+        name=name
+    )
+
+
+def create_agent_pool(max_agents=AGENT_MAX, idle_ttl=AGENT_IDLE_TTL,
+                      max_requests=AGENT_MAX_REQUESTS, clone_backend=ROOTFS_CLONE_BACKEND,
+                      input_mode=INPUT_MODE, api_mode=API_MODE,
+                      instrumentation=DISABLED, snapshot_store=None, registry=None,
+                      qos=None, balloon_idle=None):
+    """
+    Cria o pool de agentes keep-alive (sempre engine rootfs e vsock).
+    Com `balloon_idle` os agentes ganham o balao de memoria, inflado
+    depois desse tempo ociosos.
+    """
+    store = snapshot_store or create_snapshot_store()
+    return AgentPool(
+        lambda vm_id: NanoLambda(vm_id=vm_id, clone_backend=clone_backend,
+                                 input_mode=input_mode, api_mode=api_mode,
+                                 snapshot_store=store,
+                                 instrumentation=instrumentation,
+                                 registry=registry, qos=qos,
+                                 balloon=balloon_idle is not None),
+        max_agents=max_agents,
+        idle_ttl=idle_ttl,
+        max_requests=max_requests,
+        balloon_idle=balloon_idle
+    )
+
+
+def create_autoscaler(agents, min_warm=0, max_warm=None, mem_budget_mib=None,
+                      instrumentation=DISABLED):
+    """Autoscaler da capacidade quente dos agentes (ver autoscaler.py)."""
+    return Autoscaler(agents, min_warm=min_warm, max_warm=max_warm,
+                      mem_budget_mib=mem_budget_mib, mem_per_vm_mib=MEM_SIZE_MIB,
+                      instrumentation=instrumentation)
+
+
+def create_engine(clone_backend=ROOTFS_CLONE_BACKEND, input_mode=INPUT_MODE,
+                  api_mode=API_MODE, invoke_mode=INVOKE_MODE,
+                  result_channel=RESULT_CHANNEL, engine=ENGINE,
+                  max_vcpus=None, max_mem_mib=None, instrumentation=DISABLED,
+                  snapshot_store=None, mem_backend=SNAPSHOT_MEM_BACKEND, registry=None,
+                  qos=None, agents=None):
+    """Cria o motor de invocacoes concorrentes (uma VM por invocacao)."""
+    store = snapshot_store or create_snapshot_store()
+    return InvocationEngine(
+        lambda invocation_id: NanoLambda(vm_id=invocation_id,
+                                         clone_backend=clone_backend,
+                                         input_mode=input_mode, api_mode=api_mode,
+                                         invoke_mode=invoke_mode,
+                                         snapshot_store=store,
+                                         result_channel=result_channel,
+                                         engine=engine,
+                                         instrumentation=instrumentation,
+                                         mem_backend=mem_backend,
+                                         registry=registry,
+                                         qos=qos,
+                                         agents=agents),
+        vcpus_per_vm=VCPU_COUNT,
+        mem_per_vm_mib=MEM_SIZE_MIB,
+        max_vcpus=max_vcpus,
+        max_mem_mib=max_mem_mib
+    )
+
+
+def compare_engines(runner_factory, function_path, input_data, iterations=5):
+    """
+    Mede preparo, start e boot + execucao em cada engine.
 
-        return {
-            "success": False,
-            "type": "text",
-            "data": raw_output
-        }
+    `runner_factory(engine)` cria o runner. A primeira invocacao de
+    cada engine aquece os caches (initrd da funcao) e fica de fora.
+    """
+    report = []
+    for engine in ENGINES:
+        runner_factory(engine).invoke(function_path, input_data)
+        rows = [runner_factory(engine).invoke(function_path, input_data)["timings"]
+                for _ in range(iterations)]
+        report.append({
+            "engine": engine,
+            **{key: sum(t[key] for t in rows) / len(rows)
+               for key in ("prepare", "launch", "run")}
+        })
+    return report
+
+
+def print_result(result, output_file="resultado-qrcode.png"):
+    """Mostra o resultado de uma invocacao (salva imagens em disco)."""
+    if result["success"] and result["type"] == "image":
+        # Salva a imagem (o parser já decodificou o base64)
+        img_data = result["data"]
+        with open(output_file, "wb") as f:
+            f.write(img_data)
+        print(f"QR Code salvo em: {output_file}")
+        print(f"Tamanho: {len(img_data)} bytes")
+        print()
+        print("Escaneie com seu celular para testar!")
+    elif result["success"] and result["type"] == "binary":
+        print(f"Resultado binario: {result['size']} bytes")
+    else:
+        print("Output bruto da VM:")
+        print(result["data"])
+
+
+def print_batch_report(report, output_dir=None):
+    """Lotes, vazao e falhas de um invoke_many (grava os itens em output_dir)."""
+    print(f"{'lote':>4} {'itens':>6} {'ok':>6} {'boot':>8} {'boot+exec':>10} {'por item':>9}")
+    for i, batch in enumerate(report["batches"]):
+        boot = f"{batch['boot_s']:.3f}s" if batch["boot_s"] is not None else "-"
+        per_item = f"{batch['per_item_s'] * 1000:.0f}ms" if batch["per_item_s"] else "-"
+        print(f"{i + 1:>4} {batch['size']:>6} {batch['ok']:>6} {boot:>8} "
+              f"{batch['run_s']:>9.3f}s {per_item:>9}")
+    results = report["results"]
+    failed = [item for item in results if not item["success"]]
+    print(f"Total: {len(results)} itens, {len(failed)} falhas, {report['elapsed_s']:.2f}s "
+          f"({report['items_per_s']:.1f} itens/s)")
+    for item in failed[:5]:
+        lines = (item["error"] or "erro").strip().splitlines() or ["erro"]
+        print(f"  item {item['index']}: {lines[-1]}")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        extensions = {"image": "png", "json": "json", "binary": "bin"}
+        for item in results:
+            if item["success"] and item["type"] in extensions:
+                path = os.path.join(output_dir, f"{item['index']}.{extensions[item['type']]}")
+                with open(path, "w" if item["type"] == "json" else "wb") as f:
+                    if item["type"] == "json":
+                        json.dump(item["data"], f)
+                    else:
+                        f.write(item["data"])
+        print(f"Resultados em {output_dir}/")
+
+
+def print_registry(registry):
+    """Funcoes registradas e imagens em cache (LRU primeiro)."""
+    mib = 1024 * 1024
+    names = {}
+    for name in sorted(os.listdir(registry.names_dir)):
+        if name.endswith(".json"):
+            name = name[:-len(".json")]
+            qos = registry.qos_profile(name)
+            names.setdefault(registry.lookup(name), []).append(
+                f"{name}({qos})" if qos and qos != QOS_PROFILE else name)
+    print(f"{'imagem':<18} {'funcoes':<24} {'MiB':>8} {'import (sem/com .pyc)':>22} "
+          f"{'ultimo uso':>20}")
+    rows = registry.images()
+    for last_used, size, image in rows:
+        used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_used)) if last_used else "-"
+        state = f"{size / mib:>8.1f}" if size else f"{'despejada':>8}"
+        meta = image.load_meta()
+        imports = "-"
+        if meta.get("import_s") is not None and meta.get("import_nocache_s") is not None:
+            imports = f"{meta['import_nocache_s'] * 1000:.0f}ms / {meta['import_s'] * 1000:.0f}ms"
+        print(f"{image.id:<18} {','.join(names.get(image.id, [])) or '-':<24} "
+              f"{state} {imports:>22} {used:>20}")
+    total = sum(size for _, size, _ in rows)
+    print(f"Total: {total / mib:.1f} MiB de {registry.quota_bytes / mib:.0f} MiB")
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="nano-Lambda: executa funcoes Python em microVMs isoladas"
+    )
+    parser.add_argument("function_path", metavar="funcao.py", nargs="?")
+    parser.add_argument("inputs", metavar="input", nargs="*")
+    parser.add_argument(
+        "--pool", type=int, default=0, metavar="N",
+        help="mantem N microVMs pre-aquecidas e reaproveita entre os inputs"
+    )
+    parser.add_argument(
+        "--pool-max-idle", type=float, default=POOL_MAX_IDLE_AGE, metavar="SEG",
+        help="idade maxima de uma VM ociosa no pool"
+    )
+    parser.add_argument(
+        "--clone-backend", default=ROOTFS_CLONE_BACKEND,
+        choices=["auto"] + sorted(CLONE_BACKENDS),
+        help="como clonar o rootfs template por invocacao"
+    )
+    parser.add_argument(
+        "--input-mode", default=INPUT_MODE, choices=["mount", "drive"],
+        help="entrega funcao e input montando o rootfs ou num drive secundario"
+    )
+    parser.add_argument(
+        "--api-mode", default=API_MODE, choices=API_MODES,
+        help="como configurar a VM (ver fc_client.py)"
+    )
+    parser.add_argument(
+        "--mode", default=INVOKE_MODE, choices=INVOKE_MODES,
+        help="boot: cold start por invocacao; snapshot: restaura o snapshot da funcao"
+    )
+    parser.add_argument(
+        "--mem-backend", default=SNAPSHOT_MEM_BACKEND, choices=MEM_BACKENDS,
+        help="memoria do restore no modo snapshot: File (mmap) ou Uffd (servidor de paginas)"
+    )
+    parser.add_argument(
+        "--engine", default=ENGINE, choices=ENGINES,
+        help="rootfs (ext4 como drive raiz) ou initramfs (sem drive de bloco)"
+    )
+    parser.add_argument(
+        "--compare-engines", type=int, default=0, metavar="N",
+        help="mede o tempo de boot das engines com N invocacoes do primeiro input"
+    )
+    parser.add_argument(
+        "--result-channel", default=RESULT_CHANNEL, choices=RESULT_CHANNELS,
+        help="por onde o resultado volta: vsock (binario) ou console (base64)"
+    )
+    parser.add_argument(
+        "--payload-benchmark", metavar="MIB1,MIB2,...",
+        help="compara vsock x console devolvendo payloads desses tamanhos (exemplo-payload)"
+    )
+    parser.add_argument(
+        "--parallel", action="store_true",
+        help="executa todos os inputs em paralelo (motor asyncio, ver engine.py)"
+    )
+    parser.add_argument(
+        "--max-vcpus", type=int, default=None,
+        help="orcamento de vCPUs do host para VMs concorrentes (padrao: CPUs do host)"
+    )
+    parser.add_argument(
+        "--max-mem", type=int, default=None, metavar="MIB",
+        help="orcamento de memoria para VMs concorrentes (padrao: 80%% da disponivel)"
+    )
+    parser.add_argument(
+        "--serve", metavar="HOST:PORTA",
+        help="sobe o gateway HTTP (POST /invoke/<funcao>, GET /metrics)"
+    )
+    parser.add_argument(
+        "--functions-dir", default=".", metavar="DIR",
+        help="diretorio com uma pasta por funcao (<DIR>/<funcao>/handler.py) para o --serve"
+    )
+    parser.add_argument(
+        "--queue-depth", type=int, default=QUEUE_DEPTH, metavar="N",
+        help="requisicoes na fila do gateway antes de responder 429"
+    )
+    parser.add_argument(
+        "--throughput", metavar="N1,N2,...",
+        help="mede invocacoes/s com o primeiro input em cada nivel de concorrencia"
+    )
+    parser.add_argument(
+        "--throughput-invocations", type=int, default=16, metavar="N",
+        help="invocacoes por nivel de concorrencia no --throughput"
+    )
+    parser.add_argument(
+        "--refresh-snapshot", action="store_true",
+        help="roda cada input no snapshot da funcao e grava um snapshot Diff (cadeia)"
+    )
+    parser.add_argument(
+        "--trace", metavar="ARQUIVO",
+        help="grava um span por fase de cada VM (JSONL, ver instrumentation.py)"
+    )
+    parser.add_argument(
+        "--metrics-file", metavar="ARQUIVO",
+        help="grava as metricas por fase no formato do Prometheus ao terminar"
+    )
+    parser.add_argument(
+        "--page-store", action="store_true",
+        help="deduplica a memoria dos snapshots em chunks por hash (ver page_store.py)"
+    )
+    parser.add_argument(
+        "--page-chunk", type=int, default=PAGE_STORE_CHUNK // 1024, choices=[4, 2048],
+        metavar="KIB", help="tamanho do chunk do --page-store: 4 ou 2048 KiB"
+    )
+    parser.add_argument(
+        "--page-store-report", action="store_true",
+        help="mostra a taxa de deduplicacao da memoria dos snapshots e sai"
+    )
+    parser.add_argument(
+        "--register", metavar="NOME",
+        help="registra funcao.py com esse nome e constroi o rootfs dela (ver function_registry.py)"
+    )
+    parser.add_argument(
+        "--requirements", metavar="ARQUIVO",
+        help="requirements.txt instalado com pip no rootfs da funcao do --register"
+    )
+    parser.add_argument(
+        "--bundle-deps", action="store_true",
+        help="no --register, empacota as dependencias puras num zip (zipimport, ver bytecode.py)"
+    )
+    parser.add_argument(
+        "--profile-imports", action="store_true",
+        help="no --register, mede o import do handler (-X importtime). Roda o codigo da "
+             "funcao no host, como root, fora da VM: so para funcoes confiaveis"
+    )
+    parser.add_argument(
+        "--list-functions", action="store_true",
+        help="lista as funcoes registradas e o cache de imagens e sai"
+    )
+    parser.add_argument(
+        "--registry-quota", type=int, default=REGISTRY_QUOTA_MIB, metavar="MIB",
+        help="espaco maximo das imagens do registro (LRU)"
+    )
+    parser.add_argument(
+        "--batch", action="store_true",
+        help="roda os inputs em lotes, cada lote num boot so (invoke_many)"
+    )
+    parser.add_argument(
+        "--batch-file", metavar="ARQUIVO",
+        help="inputs do --batch, um por linha (somados aos da linha de comando)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=None, metavar="N",
+        help="itens por lote no --batch (padrao: adaptativo pelo tempo por item)"
+    )
+    parser.add_argument(
+        "--batch-output", metavar="DIR",
+        help="grava o resultado de cada item do --batch em DIR"
+    )
+    parser.add_argument(
+        "--agents", type=int, default=0, metavar="N",
+        help="ate N VMs como agentes keep-alive (handler importado uma vez, ver agent_pool.py)"
+    )
+    parser.add_argument(
+        "--agent-idle", type=float, default=AGENT_IDLE_TTL, metavar="SEG",
+        help="desliga um agente ocioso ha SEG segundos"
+    )
+    parser.add_argument(
+        "--agent-max-requests", type=int, default=AGENT_MAX_REQUESTS, metavar="N",
+        help="recicla o agente (VM nova) depois de N requisicoes"
+    )
+    parser.add_argument(
+        "--balloon", action="store_true",
+        help="balao de memoria nos agentes: o ocioso devolve a memoria ao host (ver balloon.py)"
+    )
+    parser.add_argument(
+        "--balloon-idle", type=float, default=AGENT_BALLOON_IDLE, metavar="SEG",
+        help="infla o balao do agente ocioso ha SEG segundos"
+    )
+    parser.add_argument(
+        "--density-benchmark", type=int, default=0, metavar="N",
+        help="VMs por GiB com e sem balao: N agentes rodando o primeiro input"
+    )
+    parser.add_argument(
+        "--autoscale", action="store_true",
+        help="preve a demanda por funcao e boota agentes antes dela (ate --agents VMs)"
+    )
+    parser.add_argument(
+        "--autoscale-min", type=int, default=0, metavar="N",
+        help="agentes quentes minimos por funcao no --autoscale"
+    )
+    parser.add_argument(
+        "--autoscale-max", type=int, default=None, metavar="N",
+        help="agentes quentes maximos por funcao no --autoscale (padrao: --agents)"
+    )
+    parser.add_argument(
+        "--autoscale-mem", type=int, default=None, metavar="MIB",
+        help="memoria do host para agentes quentes (padrao: 80%% da disponivel)"
+    )
+    parser.add_argument(
+        "--qos", choices=sorted(QOS_PROFILES), metavar="PERFIL",
+        help="limites de disco da VM (ver qos.py); com --register fica gravado na funcao"
+    )
+    parser.add_argument(
+        "--qos-benchmark", type=int, default=0, metavar="N",
+        help="latencia de N invocacoes do primeiro input com um vizinho barulhento "
+             "(exemplo-ruidoso), sem e com o perfil do --qos"
+    )
+
     # Verifica se esta rodando como root
     if os.geteuid() != 0:
         print("Erro: Este script precisa ser executado como root.")
@@ -289,16 +1729,146 @@ def main():
         sys.exit(1)
 
     # Valida argumentos
-    if len(sys.argv) < 3:
+    if len(sys.argv) < 2:
         print("Uso: sudo python3 nano-lambda.py <funcao.py> <input>")
         print("Exemplo: sudo python3 nano-lambda.py exemplo-qrcode/handler.py 'https://meusite.com'")
         sys.exit(1)
 
-    function_path = sys.argv[1]
-    input_data = sys.argv[2]
-
-    # Valida se a funcao existe
-    if not os.path.exists(function_path):
+    args = parser.parse_args()
+
+    if args.payload_benchmark:
+        sizes = [float(n) for n in args.payload_benchmark.split(",")]
+        handler = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "exemplo-payload", "handler.py")
+        rows = benchmark_payloads(
+            lambda channel: NanoLambda(clone_backend=args.clone_backend,
+                                       input_mode=args.input_mode,
+                                       api_mode=args.api_mode,
+                                       result_channel=channel),
+            handler, sizes
+        )
+        print()
+        print("=" * 50)
+        print("Payload: vsock x console")
+        print("=" * 50)
+        print_payload_report(rows)
+        return
+
+    if args.page_store_report:
+        print("=" * 50)
+        print("Page store: memoria dos snapshots")
+        print("=" * 50)
+        print_dedup_report(create_snapshot_store(page_store=True).page_stats())
+        return
+
+    snapshot_store = create_snapshot_store(args.page_store, args.page_chunk * 1024)
+
+    # Registro de funcoes: so e aberto quando usado (cria o REGISTRY_DIR)
+    registry = None
+    if (args.register or args.list_functions or args.serve
+            or (args.function_path and not os.path.isfile(args.function_path))):
+        registry = create_registry(args.registry_quota, snapshot_store)
+
+    if args.register:
+        if not args.function_path:
+            parser.error("informe o handler da funcao do --register")
+        try:
+            image, built = registry.register(args.register, args.function_path,
+                                             args.requirements, bundle=args.bundle_deps,
+                                             qos=args.qos,
+                                             import_profile=args.profile_imports)
+        except RegistryError as e:
+            print(f"Erro: {e}")
+            sys.exit(1)
+        print(f"Funcao {args.register} -> imagem {image.id}"
+              f"{'' if built else ' (ja construida)'}")
+        return
+
+    if args.list_functions:
+        print_registry(registry)
+        return
+
+    # Spans e metricas por fase: so quando alguem vai ler (o gateway
+    # expoe no /metrics); senao fica desligado e nao custa nada
+    instrumentation = DISABLED
+    if args.trace or args.metrics_file or args.serve:
+        instrumentation = Instrumentation(sinks=[JsonlSink(args.trace)] if args.trace else [])
+
+    def flush_instrumentation():
+        if args.metrics_file:
+            instrumentation.write_metrics(args.metrics_file)
+        instrumentation.close()
+
+    # Agentes keep-alive: o NanoLambda tenta um deles antes de bootar
+    agents = None
+    if args.agents > 0:
+        agents = create_agent_pool(max_agents=args.agents, idle_ttl=args.agent_idle,
+                                   max_requests=args.agent_max_requests,
+                                   clone_backend=args.clone_backend,
+                                   input_mode=args.input_mode,
+                                   api_mode=args.api_mode,
+                                   instrumentation=instrumentation,
+                                   snapshot_store=snapshot_store,
+                                   registry=registry,
+                                   qos=args.qos,
+                                   balloon_idle=args.balloon_idle if args.balloon else None)
+        agents.start()
+    elif args.autoscale:
+        parser.error("--autoscale precisa de --agents N (maximo de VMs)")
+    elif args.balloon:
+        parser.error("--balloon precisa de --agents N (o balao infla agentes ociosos)")
+
+    autoscaler = None
+    if args.autoscale:
+        autoscaler = create_autoscaler(agents, min_warm=args.autoscale_min,
+                                       max_warm=args.autoscale_max,
+                                       mem_budget_mib=args.autoscale_mem,
+                                       instrumentation=instrumentation)
+        autoscaler.start()
+
+    def close_agents():
+        if autoscaler:
+            autoscaler.close()
+            print()
+            print_autoscaler_report(autoscaler.report())
+        if agents:
+            agents.close()
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(":")
+        engine = create_engine(clone_backend=args.clone_backend,
+                               input_mode=args.input_mode,
+                               api_mode=args.api_mode,
+                               invoke_mode=args.mode,
+                               mem_backend=args.mem_backend,
+                               result_channel=args.result_channel,
+                               engine=args.engine,
+                               max_vcpus=args.max_vcpus,
+                               max_mem_mib=args.max_mem,
+                               instrumentation=instrumentation,
+                               snapshot_store=snapshot_store,
+                               registry=registry,
+                               qos=args.qos,
+                               agents=agents)
+        gateway = Gateway(engine, args.functions_dir, queue_depth=args.queue_depth,
+                          instrumentation=instrumentation, registry=registry)
+        try:
+            asyncio.run(gateway.serve(host or "127.0.0.1", int(port)))
+        finally:
+            close_agents()
+            flush_instrumentation()
+        return
+
+    function_path = args.function_path
+    inputs = args.inputs
+    if args.batch_file:
+        with open(args.batch_file) as f:
+            inputs = inputs + [line.rstrip("\n") for line in f if line.strip()]
+    if not function_path or not inputs:
+        parser.error("informe a funcao e pelo menos um input")
+
+    # Valida se a funcao existe (arquivo ou nome registrado)
+    if not os.path.isfile(function_path) and registry.lookup(function_path) is None:
         print(f"Erro: funcao nao encontrada: {function_path}")
         sys.exit(1)
 
@@ -313,42 +1883,237 @@ def main():
     print("nano-Lambda: Executando funcao em microVM isolada")
     print("=" * 50)
     print(f"Funcao: {function_path}")
-    print(f"Input: {input_data}")
+    for input_data in inputs[:10]:
+        print(f"Input: {input_data}")
+    if len(inputs) > 10:
+        print(f"... {len(inputs)} inputs")
     print()
 
-    # Cria o runner
-    lambda_runner = NanoLambda()
+    # Cria o runner (ou o pool/motor, que cria um runner por VM)
+    pool = None
+    engine = None
+    if args.parallel or args.throughput:
+        engine = create_engine(clone_backend=args.clone_backend,
+                               input_mode=args.input_mode,
+                               api_mode=args.api_mode,
+                               invoke_mode=args.mode,
+                               mem_backend=args.mem_backend,
+                               result_channel=args.result_channel,
+                               engine=args.engine,
+                               max_vcpus=args.max_vcpus,
+                               max_mem_mib=args.max_mem,
+                               instrumentation=instrumentation,
+                               snapshot_store=snapshot_store,
+                               registry=registry,
+                               qos=args.qos,
+                               agents=agents)
+    elif args.pool > 0:
+        pool = create_warm_pool(size=args.pool, max_idle_age=args.pool_max_idle,
+                                clone_backend=args.clone_backend,
+                                input_mode=args.input_mode,
+                                api_mode=args.api_mode,
+                                invoke_mode=args.mode,
+                                mem_backend=args.mem_backend,
+                                result_channel=args.result_channel,
+                                engine=args.engine,
+                                instrumentation=instrumentation,
+                                snapshot_store=snapshot_store,
+                                registry=registry,
+                                qos=args.qos)
+        pool.start()
+        lambda_runner = pool
+    else:
+        lambda_runner = NanoLambda(clone_backend=args.clone_backend,
+                                   input_mode=args.input_mode,
+                                   api_mode=args.api_mode,
+                                   invoke_mode=args.mode,
+                                   mem_backend=args.mem_backend,
+                                   result_channel=args.result_channel,
+                                   engine=args.engine,
+                                   snapshot_store=snapshot_store,
+                                   instrumentation=instrumentation,
+                                   registry=registry,
+                                   qos=args.qos,
+                                   agents=agents)
 
     # Configura tratamento de sinais para limpeza em caso de Ctrl+C
     def signal_handler(signum, frame):
         print("\n[!] Interrompido pelo usuario. Limpando recursos...")
-        lambda_runner.cleanup()
+        if engine:
+            engine.close()
+        elif pool:
+            pool.close()
+        else:
+            lambda_runner.cleanup()
+        close_agents()
         sys.exit(130)  # 128 + SIGINT(2)
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    # Executa
-    result = lambda_runner.invoke(function_path, input_data)
-
-    print()
-    print("=" * 50)
-    print("Resultado:")
-    print("=" * 50)
-
-    if result["success"] and result["type"] == "image":
-        # Salva a imagem
-        output_file = "resultado-qrcode.png"
-        img_data = base64.b64decode(result["data"])
-        with open(output_file, "wb") as f:
-            f.write(img_data)
-        print(f"QR Code salvo em: {output_file}")
-        print(f"Tamanho: {len(img_data)} bytes")
+    if args.throughput:
+        concurrencies = [int(n) for n in args.throughput.split(",")]
+        report = asyncio.run(engine.throughput_report(
+            function_path, inputs[0], concurrencies, args.throughput_invocations
+        ))
+        engine.close()
+        close_agents()
+        flush_instrumentation()
         print()
-        print("Escaneie com seu celular para testar!")
-    else:
-        print("Output bruto da VM:")
-        print(result["data"])
+        print("=" * 50)
+        print("Throughput x concorrencia:")
+        print("=" * 50)
+        print_throughput_report(report)
+        return
+
+    try:
+        if args.compare_engines:
+            report = compare_engines(
+                lambda engine: NanoLambda(clone_backend=args.clone_backend,
+                                          input_mode=args.input_mode,
+                                          api_mode=args.api_mode,
+                                          result_channel=args.result_channel,
+                                          engine=engine),
+                function_path, inputs[0], args.compare_engines
+            )
+            print()
+            print("=" * 50)
+            print(f"Engines (media de {args.compare_engines} invocacoes):")
+            print("=" * 50)
+            print(f"{'engine':<10} {'preparo':>9} {'start':>9} {'boot+exec':>10}")
+            for row in report:
+                print(f"{row['engine']:<10} {row['prepare']:>8.3f}s {row['launch']:>8.3f}s "
+                      f"{row['run']:>9.3f}s")
+            return
+
+        if args.qos_benchmark:
+            noisy = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "exemplo-ruidoso", "handler.py")
+            profile = args.qos or "small"
+            rows = benchmark_noisy_neighbor(
+                lambda qos: NanoLambda(clone_backend=args.clone_backend,
+                                       input_mode=args.input_mode,
+                                       api_mode=args.api_mode,
+                                       result_channel=args.result_channel,
+                                       registry=registry, qos=qos),
+                function_path, inputs[0], noisy, "20 256", args.qos_benchmark, profile
+            )
+            print()
+            print("=" * 50)
+            print(f"Vizinho barulhento: vitima com o vizinho sem limite e em '{profile}'")
+            print("=" * 50)
+            print_noisy_report(rows)
+            return
+
+        if args.density_benchmark:
+            rows = benchmark_density(
+                lambda: NanoLambda(clone_backend=args.clone_backend,
+                                   input_mode=args.input_mode,
+                                   api_mode=args.api_mode,
+                                   snapshot_store=snapshot_store,
+                                   registry=registry, qos=args.qos, balloon=True),
+                function_path, inputs[0], args.density_benchmark
+            )
+            print()
+            print("=" * 50)
+            print(f"Densidade: {args.density_benchmark} agentes de {MEM_SIZE_MIB} MiB, "
+                  f"sem e com balao")
+            print("=" * 50)
+            print_density_report(rows)
+            return
+
+        if args.batch:
+            report = NanoLambda(clone_backend=args.clone_backend,
+                                input_mode=args.input_mode,
+                                api_mode=args.api_mode,
+                                result_channel=args.result_channel,
+                                snapshot_store=snapshot_store,
+                                instrumentation=instrumentation,
+                                registry=registry,
+                                qos=args.qos).invoke_many(function_path, inputs, args.batch_size)
+            print()
+            print("=" * 50)
+            print(f"Lote: {len(inputs)} inputs em {len(report['batches'])} boots")
+            print("=" * 50)
+            print_batch_report(report, args.batch_output)
+            return
+
+        if args.refresh_snapshot:
+            mib = 1024 * 1024
+            print()
+            print("=" * 50)
+            print("Snapshots Diff (dirty pages) x Full:")
+            print("=" * 50)
+            for input_data in inputs:
+                info = NanoLambda(clone_backend=args.clone_backend, api_mode=args.api_mode,
+                                  invoke_mode="snapshot", snapshot_store=snapshot_store,
+                                  instrumentation=instrumentation,
+                                  registry=registry).refresh_snapshot(
+                    function_path, input_data)
+                full_mib = (info['full_bytes'] or 0) / mib
+                print(f"Camada {info['layer']}: Diff {info['bytes_written'] / mib:.1f} MiB "
+                      f"em {info['create_s']:.3f}s (Full: {full_mib:.1f} MiB "
+                      f"em {info['full_create_s']:.3f}s), cadeia com {info['chain_length']} diffs")
+            return
+
+        # Executa
+        if engine:
+            results = asyncio.run(engine.invoke_many(function_path, inputs))
+        else:
+            results = (lambda_runner.invoke(function_path, input_data)
+                       for input_data in inputs)
+
+        for i, result in enumerate(results):
+            print()
+            print("=" * 50)
+            print("Resultado:" if len(inputs) == 1 else f"Resultado [{i + 1}/{len(inputs)}]:")
+            print("=" * 50)
+
+            if len(inputs) == 1:
+                print_result(result)
+            else:
+                print_result(result, f"resultado-qrcode-{i + 1}.png")
+            timings = result["timings"]
+            if "prepare" in timings:
+                print(f"Preparo: {timings['prepare']:.3f}s "
+                      f"(clone: {timings['clone']:.3f}s)")
+            if "launch" in timings:
+                print(f"Start + configuracao ({args.api_mode}): {timings['launch']:.3f}s")
+            if "run" in timings:
+                print(f"Boot + execucao ({args.engine}): {timings['run']:.3f}s")
+            if "snapshot_create" in timings:
+                print(f"Snapshot criado nesta invocacao: {timings['snapshot_create']:.3f}s")
+            if "restore" in timings:
+                print(f"Restore do snapshot: {timings['restore']:.3f}s "
+                      f"(boot frio ate o READY: {timings['cold_boot']:.3f}s)")
+            if "agent" in timings:
+                print(f"Agente keep-alive: {timings['agent']:.3f}s "
+                      f"(handler: {timings['handler']:.3f}s, "
+                      f"requisicao {timings['agent_requests']} da VM)")
+    finally:
+        if engine:
+            engine.close()
+        if pool:
+            stats = pool.stats()
+            pool.close()
+            print()
+            print(f"Pool: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"refill medio {stats['refill_avg_s']:.3f}s")
+        if agents:
+            stats = agents.stats()
+            memory = agents.memory() if args.balloon else None
+            close_agents()
+            print()
+            print(f"Agentes: {stats['hits']} hits, {stats['misses']} boots "
+                  f"(medio {stats['boot_avg_s']:.3f}s), {stats['provisioned']} antecipados, "
+                  f"{stats['fallbacks']} sem vaga, {stats['evicted']} despejados, "
+                  f"{stats['recycled']} reciclados")
+            if memory:
+                print(f"Balao: {stats['inflations']} inflados, "
+                      f"{stats['deflations']} desinflados; no fim {memory['balloon_mib']:.0f} "
+                      f"MiB devolvidos ao host (footprint {memory['footprint_mib']:.0f} "
+                      f"de {memory['mem_mib']} MiB)")
+        flush_instrumentation()
 
 
 if __name__ == "__main__":
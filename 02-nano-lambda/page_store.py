@@ -0,0 +1,231 @@
+"""
+page_store.py - Memoria dos snapshots em chunks enderecados por conteudo
+
+Cada snapshot de funcao guarda a memoria inteira do guest (vm_mem), mas
+a maior parte das paginas e igual entre funcoes: kernel, interpretador
+Python, bibliotecas. Aqui o vm_mem e quebrado em chunks (2 MiB por
+padrao, ou 4 KiB para deduplicar mais ao custo de muitos arquivos),
+cada chunk guardado uma vez so, pelo sha256:
+
+    <root>/chunks/ab/abcdef...    conteudo do chunk
+    <root>/.lock                  ingest (compartilhado) x gc (exclusivo)
+
+O manifesto de um arquivo de memoria lista o hash de cada chunk (None
+para chunks zerados, que viram buracos). O arquivo e reconstituido sob
+demanda: com reflink (FICLONERANGE) os extents sao compartilhados com
+os chunks e nada e copiado; sem reflink os chunks sao copiados.
+
+Uso:
+    store = PageStore("./snapshots/.pages")
+    manifest, stats = store.ingest("vm_mem", "vm_mem.manifest.json")
+    store.reconstitute(manifest, "vm_mem")
+    print_dedup_report(store.stats(["vm_mem.manifest.json"]))
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+
+from rootfs_clone import REFLINK_UNSUPPORTED, data_regions
+
+PAGE_STORE_CHUNK = 2 * 1024 * 1024
+
+# ioctl FICLONERANGE = _IOW(0x94, 13, struct file_clone_range)
+FICLONERANGE = 0x4020940D
+_CLONE_RANGE = struct.Struct("qQQQ")  # src_fd, src_offset, src_length, dest_offset
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _hole_map(fd, size, chunk_size):
+    """Indices dos chunks que tem algum dado (o resto e buraco)."""
+    with_data = set()
+    for offset, length in data_regions(fd, size):
+        first = offset // chunk_size
+        last = (offset + length - 1) // chunk_size
+        with_data.update(range(first, last + 1))
+    return with_data
+
+
+class PageStore:
+    """Chunks deduplicados de arquivos de memoria de snapshots."""
+
+    def __init__(self, root, chunk_size=PAGE_STORE_CHUNK):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.chunks_dir = os.path.join(root, "chunks")
+        self._zero = bytes(chunk_size)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        with open(os.path.join(self.root, ".lock"), "w") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _put(self, digest, data):
+        """Grava o chunk se ainda nao existir. Retorna True se gravou."""
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return True
+
+    def ingest(self, mem_path, manifest_path):
+        """
+        Quebra `mem_path` em chunks e grava o manifesto.
+
+        Retorna (manifesto, estatisticas do ingest).
+        """
+        start = time.time()
+        stats = {"chunks": 0, "zero": 0, "new": 0, "reused": 0, "new_bytes": 0}
+        hashes = []
+        with self._locked(fcntl.LOCK_SH), open(mem_path, "rb") as f:
+            fd = f.fileno()
+            size = os.fstat(fd).st_size
+            with_data = _hole_map(fd, size, self.chunk_size)
+            for index in range((size + self.chunk_size - 1) // self.chunk_size):
+                stats["chunks"] += 1
+                if index not in with_data:
+                    hashes.append(None)
+                    stats["zero"] += 1
+                    continue
+                data = os.pread(fd, self.chunk_size, index * self.chunk_size)
+                if data == self._zero[:len(data)]:
+                    hashes.append(None)
+                    stats["zero"] += 1
+                    continue
+                digest = hashlib.sha256(data).hexdigest()
+                hashes.append(digest)
+                if self._put(digest, data):
+                    stats["new"] += 1
+                    stats["new_bytes"] += len(data)
+                else:
+                    stats["reused"] += 1
+            manifest = {"size": size, "chunk_size": self.chunk_size, "chunks": hashes}
+            _write_json(manifest_path, manifest)
+        stats["ingest_s"] = time.time() - start
+        return manifest, stats
+
+    def reconstitute(self, manifest, out_path):
+        """
+        Monta o arquivo de memoria a partir dos chunks.
+
+        Chunks zerados ficam como buracos. Retorna True se tudo foi
+        feito por reflink (sem copiar dados).
+        """
+        chunk_size = manifest["chunk_size"]
+        reflinked = True
+        with open(out_path, "wb") as out:
+            os.ftruncate(out.fileno(), manifest["size"])
+            for index, digest in enumerate(manifest["chunks"]):
+                if digest is None:
+                    continue
+                offset = index * chunk_size
+                with open(self.chunk_path(digest), "rb") as src:
+                    length = os.fstat(src.fileno()).st_size
+                    if reflinked:
+                        try:
+                            arg = _CLONE_RANGE.pack(src.fileno(), 0, length, offset)
+                            fcntl.ioctl(out.fileno(), FICLONERANGE, arg)
+                            continue
+                        except OSError as e:
+                            if e.errno not in REFLINK_UNSUPPORTED:
+                                raise
+                            reflinked = False
+                    os.pwrite(out.fileno(), src.read(), offset)
+        return reflinked
+
+    def _referenced(self, manifest_paths):
+        referenced = set()
+        for path in manifest_paths:
+            try:
+                referenced.update(d for d in load_manifest(path)["chunks"] if d)
+            except (OSError, ValueError):
+                continue
+        return referenced
+
+    def gc(self, manifest_paths):
+        """Remove chunks que nenhum dos manifestos usa. Retorna bytes liberados."""
+        freed = 0
+        with self._locked(fcntl.LOCK_EX):
+            referenced = self._referenced(manifest_paths)
+            for dirpath, _, filenames in os.walk(self.chunks_dir):
+                for name in filenames:
+                    if name not in referenced:
+                        path = os.path.join(dirpath, name)
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+        return freed
+
+    def stats(self, manifest_paths):
+        """
+        Taxa de deduplicacao dos manifestos: bytes logicos (sem os
+        zeros) sobre bytes realmente guardados nos chunks.
+        """
+        logical = zero = 0
+        referenced = set()
+        for path in manifest_paths:
+            manifest = load_manifest(path)
+            chunk_size = manifest["chunk_size"]
+            for digest in manifest["chunks"]:
+                if digest is None:
+                    zero += chunk_size
+                else:
+                    logical += chunk_size
+                    referenced.add(digest)
+        stored = 0
+        for digest in referenced:
+            try:
+                stored += os.path.getsize(self.chunk_path(digest))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return {
+            "manifests": len(manifest_paths),
+            "logical_bytes": logical,
+            "zero_bytes": zero,
+            "unique_chunks": len(referenced),
+            "stored_bytes": stored,
+            "dedup_ratio": logical / stored if stored else 1.0,
+        }
+
+
+def print_dedup_report(stats):
+    mib = 1024 * 1024
+    print(f"Manifestos:        {stats['manifests']}")
+    print(f"Memoria (dados):   {stats['logical_bytes'] / mib:.1f} MiB "
+          f"(+ {stats['zero_bytes'] / mib:.1f} MiB zerados, viram buracos)")
+    print(f"Guardado:          {stats['stored_bytes'] / mib:.1f} MiB "
+          f"em {stats['unique_chunks']} chunks")
+    print(f"Deduplicacao:      {stats['dedup_ratio']:.2f}x")
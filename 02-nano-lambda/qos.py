@@ -0,0 +1,163 @@
+"""
+qos.py - Perfis de QoS (rate limiter) por funcao para disco e rede
+
+Sem rate_limiter nos drives e na interface de rede, uma funcao pesada
+satura o disco ou a NIC do host e a latencia de todas as outras VMs
+sobe junto (vizinho barulhento). O Firecracker limita cada dispositivo
+com dois token buckets, banda (bytes) e operacoes, cada um com um
+burst inicial (one_time_burst). Aqui os limites ficam em perfis com
+nome, atribuidos por funcao:
+
+    none       sem limite (padrao)
+    small      disco 16 MiB/s e 500 IOPS, rede 8 MiB/s
+    standard   disco 64 MiB/s e 2000 IOPS, rede 32 MiB/s
+    bulk       disco 256 MiB/s e 8000 IOPS, rede 128 MiB/s
+
+O perfil entra no PUT dos drives/interfaces, antes do boot, e pode ser
+trocado com a VM rodando (PATCH /drives/<id> e /network-interfaces/<id>,
+ver qos_calls). O refill e de QOS_REFILL_MS: o bucket comporta so um
+decimo de segundo de banda e a vazao fica mais lisa que com 1s.
+
+Uso:
+    drive["rate_limiter"] = drive_limiter("small")       # None = sem limite
+    iface.update(net_limiters("small"))
+    for method, path, body in qos_calls("standard", ["rootfs"], ["eth0"]):
+        ...  # VM rodando
+"""
+
+import threading
+import time
+
+from engine import percentile
+
+MIB = 1024 * 1024
+QOS_PROFILE = "none"
+QOS_REFILL_MS = 100
+
+# (taxa por segundo, one_time_burst) de cada bucket
+QOS_PROFILES = {
+    "none": {},
+    "small": {
+        "block": {"bandwidth": (16 * MIB, 32 * MIB), "ops": (500, 1000)},
+        "net": {"bandwidth": (8 * MIB, 16 * MIB)},
+    },
+    "standard": {
+        "block": {"bandwidth": (64 * MIB, 128 * MIB), "ops": (2000, 4000)},
+        "net": {"bandwidth": (32 * MIB, 64 * MIB)},
+    },
+    "bulk": {
+        "block": {"bandwidth": (256 * MIB, 512 * MIB), "ops": (8000, 16000)},
+        "net": {"bandwidth": (128 * MIB, 256 * MIB)},
+    },
+}
+
+# Bucket com size 0: o Firecracker desliga o limite (usado no PATCH para
+# tirar um limite que a VM ja tinha)
+_UNLIMITED = {"size": 0, "refill_time": 0}
+
+
+def get_profile(name):
+    if name not in QOS_PROFILES:
+        raise ValueError(f"perfil de QoS desconhecido: {name} "
+                         f"(perfis: {', '.join(QOS_PROFILES)})")
+    return QOS_PROFILES[name]
+
+
+def token_bucket(rate, burst=0, refill_ms=QOS_REFILL_MS):
+    """Bucket do Firecracker que repoe `rate` por segundo."""
+    return {"size": int(rate * refill_ms / 1000), "one_time_burst": int(burst),
+            "refill_time": refill_ms}
+
+
+def _rate_limiter(limits, live):
+    """
+    rate_limiter de um dispositivo. Sem limites: None no PUT e, no
+    PATCH (`live`), buckets desligados para limpar o que havia.
+    """
+    if not limits and not live:
+        return None
+    limiter = {kind: token_bucket(*limits[kind]) if kind in limits else dict(_UNLIMITED)
+               for kind in ("bandwidth", "ops")}
+    if not live:
+        limiter = {kind: bucket for kind, bucket in limiter.items() if bucket["size"]}
+    return limiter
+
+
+def drive_limiter(name, live=False):
+    """rate_limiter dos drives no perfil `name`."""
+    return _rate_limiter(get_profile(name).get("block", {}), live)
+
+
+def net_limiters(name, live=False):
+    """rx_rate_limiter/tx_rate_limiter da interface no perfil `name` (vazio se sem limite)."""
+    limiter = _rate_limiter(get_profile(name).get("net", {}), live)
+    if limiter is None:
+        return {}
+    return {"rx_rate_limiter": limiter, "tx_rate_limiter": dict(limiter)}
+
+
+def qos_calls(name, drive_ids=(), iface_ids=()):
+    """PATCHes que aplicam o perfil `name` numa VM ja em execucao."""
+    calls = [("PATCH", f"/drives/{drive_id}",
+              {"drive_id": drive_id, "rate_limiter": drive_limiter(name, live=True)})
+             for drive_id in drive_ids]
+    calls += [("PATCH", f"/network-interfaces/{iface_id}",
+               {"iface_id": iface_id, **net_limiters(name, live=True)})
+              for iface_id in iface_ids]
+    return calls
+
+
+def benchmark_noisy_neighbor(runner_factory, victim_path, victim_input, noisy_path,
+                             noisy_input, iterations=10, profile="small"):
+    """
+    Latencia da funcao vitima com um vizinho barulhento rodando ao lado.
+
+    `runner_factory(qos)` cria o runner com o perfil `qos`. Tres cenarios:
+    a vitima sozinha, com o vizinho sem limite e com o vizinho no perfil
+    `profile`. O vizinho e reinvocado em loop numa thread enquanto a
+    vitima roda `iterations` vezes em sequencia.
+    """
+    rows = []
+    for scenario, noisy_qos in (("sozinha", None), ("vizinho sem limite", "none"),
+                                (f"vizinho {profile}", profile)):
+        stop = threading.Event()
+        neighbor = None
+        if noisy_qos:
+            def noisy_loop(qos=noisy_qos):
+                while not stop.is_set():
+                    try:
+                        runner_factory(qos).invoke(noisy_path, noisy_input)
+                    except Exception as e:
+                        print(f"[!] Vizinho falhou: {e}")
+            neighbor = threading.Thread(target=noisy_loop, daemon=True)
+            neighbor.start()
+            time.sleep(2)  # deixa o vizinho bootar e comecar a escrever
+        latencies, failures = [], 0
+        try:
+            for _ in range(iterations):
+                start = time.time()
+                result = runner_factory(QOS_PROFILE).invoke(victim_path, victim_input)
+                latencies.append(time.time() - start)
+                failures += not result["success"]
+        finally:
+            stop.set()
+            if neighbor:
+                neighbor.join()
+        latencies.sort()
+        rows.append({
+            "scenario": scenario,
+            "p50_s": percentile(latencies, 50),
+            "p95_s": percentile(latencies, 95),
+            "p99_s": percentile(latencies, 99),
+            "max_s": max(latencies),
+            "failures": failures,
+        })
+    return rows
+
+
+def print_noisy_report(rows):
+    print(f"{'cenario':<24} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'falhas':>7}")
+    for row in rows:
+        print(f"{row['scenario']:<24} " + " ".join(
+            f"{row[key] * 1000:>6.0f}ms" for key in ("p50_s", "p95_s", "p99_s", "max_s"))
+            + f" {row['failures']:>7}")
@@ -0,0 +1,221 @@
+"""
+result_channel.py - Canal de resultado por virtio-vsock
+
+O resultado do handler voltava como base64 no console serial, misturado
+com o log do kernel e do openrc: uma UART e lenta e o base64 ainda
+aumenta o payload em 33%.
+
+Com o vsock configurado (PUT /vsock), uma conexao do guest para a porta
+P do host (CID 2) vira uma conexao no socket Unix `<uds_path>_P`. O host
+escuta nesse socket e recebe um frame binario enviado pela biblioteca do
+guest (guest/nanolambda.py):
+
+    1 byte de tipo | 8 bytes de tamanho (big-endian) | payload
+
+Depois de ler o frame o host responde 1 byte: quando o handler termina,
+o resultado ja esta no host. O console fica so para logs.
+
+Numa invocacao em lote cada item chega num frame KIND_ITEM proprio
+(cabecalho JSON + dados crus, ver send_item no guest); items() junta
+os que chegaram, mesmo que a VM morra no meio do lote.
+
+Uso:
+    channel = ResultChannel(vsock_uds_path)
+    channel.start()          # antes do boot
+    ...                      # VM roda
+    resultado = channel.result(log)   # None se o guest nao usou o vsock
+    channel.close()
+"""
+
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+# Mesmos valores de guest/nanolambda.py
+RESULT_PORT = 10000
+KIND_BYTES = 1
+KIND_IMAGE = 2
+KIND_JSON = 3
+KIND_ITEM = 4
+HEADER = struct.Struct(">BQ")
+ITEM_HEADER = struct.Struct(">I")
+
+MAX_RESULT_BYTES = 256 * 1024 * 1024
+RECV_TIMEOUT = 30
+
+_KIND_TYPES = {KIND_BYTES: "binary", KIND_IMAGE: "image", KIND_JSON: "json"}
+
+
+def _recv_exact(conn, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = conn.recv_into(view[received:])
+        if not n:
+            raise ConnectionError("guest fechou o canal no meio do frame")
+        received += n
+    return buf
+
+
+def decode_item(header, data):
+    """Item do lote no formato do result() (dados crus ja separados)."""
+    item = {"index": header["index"], "success": bool(header.get("success")),
+            "type": header.get("type", "text"), "data": bytes(data), "size": len(data),
+            "error": header.get("error"), "elapsed_s": header.get("elapsed_s"),
+            "log": header.get("log", "")}
+    if item["type"] == "json":
+        try:
+            item["data"] = json.loads(data)
+        except ValueError:
+            item["success"] = False
+    elif item["type"] == "text":
+        item["data"] = item["log"]
+    return item
+
+
+class ResultChannel:
+    """Recebe o frame de resultado do guest numa thread de fundo."""
+
+    def __init__(self, uds_path, port=RESULT_PORT, max_bytes=MAX_RESULT_BYTES):
+        self.path = f"{uds_path}_{port}"
+        self.max_bytes = max_bytes
+        self._server = None
+        self._thread = None
+        self._cond = threading.Condition()
+        self._receiving = False
+        self.frame = None
+        self._items = {}
+        self.errors = []
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        # Le enquanto o guest envia: sem isso um payload grande travaria
+        # o guest esperando espaco no buffer do vsock
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return  # close()
+            with self._cond:
+                self._receiving = True
+            try:
+                conn.settimeout(RECV_TIMEOUT)
+                kind, size = HEADER.unpack(_recv_exact(conn, HEADER.size))
+                if size > self.max_bytes:
+                    raise ValueError(f"resultado de {size} bytes excede o limite")
+                payload = _recv_exact(conn, size)
+                conn.sendall(b"\x01")
+                with self._cond:
+                    if kind == KIND_ITEM:
+                        (length,) = ITEM_HEADER.unpack_from(payload)
+                        end = ITEM_HEADER.size + length
+                        item = decode_item(json.loads(payload[ITEM_HEADER.size:end]),
+                                           payload[end:])
+                        self._items[item["index"]] = item
+                    else:
+                        self.frame = (kind, bytes(payload))
+            except (OSError, ValueError, KeyError, struct.error) as e:
+                with self._cond:
+                    self.errors.append(str(e))
+            finally:
+                conn.close()
+                with self._cond:
+                    self._receiving = False
+                    self._cond.notify_all()
+
+    def result(self, log="", timeout=2.0):
+        """
+        Resultado no formato do ConsoleParser.result(), ou None se
+        nenhum frame chegou pelo vsock.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not self._receiving, timeout)
+            frame = self.frame
+        if frame is None:
+            return None
+
+        kind, payload = frame
+        result = {"success": True, "type": _KIND_TYPES.get(kind, "binary"),
+                  "data": payload, "size": len(payload), "log": log}
+        if kind == KIND_JSON:
+            try:
+                result["data"] = json.loads(payload)
+            except ValueError:
+                result["success"] = False
+        return result
+
+    def items(self, timeout=2.0):
+        """Itens do lote recebidos ate agora, por indice."""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._receiving, timeout)
+            return dict(self._items)
+
+    def close(self):
+        if self._server:
+            # shutdown acorda o accept() bloqueado na thread
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+            self._server = None
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def benchmark_payloads(runner_factory, function_path, sizes_mib=(1, 4),
+                       channels=("console", "vsock")):
+    """
+    Mede o tempo de devolver payloads de varios MB por canal.
+
+    `runner_factory(channel)` cria o runner (ex: NanoLambda) e
+    `function_path` e o handler de exemplo-payload, que devolve
+    "<bytes>" aleatorios pelo canal pedido. Uma invocacao com 0 bytes
+    serve de base: o throughput e calculado so sobre o tempo extra.
+    """
+    rows = []
+    for channel in channels:
+        base = None
+        for size_mib in (0,) + tuple(sizes_mib):
+            size = int(size_mib * 1024 * 1024)
+            start = time.time()
+            result = runner_factory(channel).invoke(function_path, f"{size} {channel}")
+            elapsed = time.time() - start
+            if base is None:
+                base = elapsed
+                continue
+
+            ok = result.get("success") and result.get("size") == size
+            extra = max(elapsed - base, 1e-9)
+            rows.append({
+                "channel": channel,
+                "size_mib": size_mib,
+                "ok": bool(ok),
+                "elapsed_s": elapsed,
+                "transfer_s": elapsed - base,
+                "mib_per_s": size_mib / extra if ok else 0.0,
+            })
+    return rows
+
+
+def print_payload_report(rows):
+    print(f"{'canal':<8} {'MiB':>6} {'total':>8} {'transfer':>9} {'MiB/s':>8} {'ok':>4}")
+    for row in rows:
+        print(f"{row['channel']:<8} {row['size_mib']:>6g} {row['elapsed_s']:>7.3f}s "
+              f"{row['transfer_s']:>8.3f}s {row['mib_per_s']:>8.2f} "
+              f"{'sim' if row['ok'] else 'nao':>4}")
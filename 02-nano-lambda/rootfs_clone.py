@@ -0,0 +1,237 @@
+"""
+rootfs_clone.py - Clonagem rapida do rootfs template por invocacao
+
+Copiar um ext4 de 500MB a cada invocacao (shutil.copy) e a maior fonte
+de I/O de disco do nano-Lambda. Este modulo oferece backends plugaveis
+que evitam a copia completa:
+
+- reflink:     ioctl FICLONE (btrfs, XFS com reflink=1). Copy-on-write,
+               custo praticamente zero, independente do tamanho.
+- sparse:      copia so as regioes com dados (SEEK_DATA/SEEK_HOLE) via
+               copy_file_range. Funciona em qualquer filesystem.
+- dm-snapshot: snapshot device-mapper sobre o template (somente leitura)
+               com um arquivo COW esparso. O Firecracker recebe o
+               /dev/mapper/... como drive. Requer root, losetup e dmsetup.
+- auto:        tenta reflink e cai para sparse.
+
+Uso:
+    clone = clone_rootfs("./rootfs-python.ext4", backend="auto")
+    print(clone.path, clone.backend, clone.elapsed)
+    ...
+    clone.release()
+"""
+
+import errno
+import fcntl
+import os
+import subprocess
+import tempfile
+import time
+import uuid
+
+# ioctl FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Erros que indicam "reflink nao suportado aqui" (filesystem ou devices diferentes)
+REFLINK_UNSUPPORTED = (
+    errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS
+)
+
+# Tamanho maximo de cada copy_file_range
+COPY_CHUNK = 64 * 1024 * 1024
+
+# Tamanho do arquivo COW do dm-snapshot (esparso, so ocupa o que for escrito)
+DM_COW_SIZE_MIB = 256
+
+
+class RootfsClone:
+    """Um clone do rootfs pronto para ser anexado como drive."""
+
+    def __init__(self, path, backend, elapsed, release_fn=None):
+        self.path = path
+        self.backend = backend
+        self.elapsed = elapsed
+        self._release_fn = release_fn
+        self.released = False
+
+    def release(self):
+        """Remove o clone (arquivo ou device)."""
+        if self.released:
+            return
+        self.released = True
+        if self._release_fn:
+            self._release_fn()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _temp_path(clone_dir, suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="nano-lambda-", dir=clone_dir)
+    os.close(fd)
+    return path
+
+
+def reflink_file(src, dst):
+    """Cria dst como reflink de src. Levanta OSError se nao suportado."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def data_regions(fd, size):
+    """Regioes com dados (offset, tamanho) de um arquivo esparso."""
+    offset = 0
+    while offset < size:
+        try:
+            data_start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return  # so buraco daqui ate o fim
+            raise
+        data_end = os.lseek(fd, data_start, os.SEEK_HOLE)
+        yield data_start, data_end - data_start
+        offset = data_end
+
+
+def sparse_copy_file(src, dst):
+    """
+    Copia src para dst preservando buracos.
+
+    Percorre as regioes de dados com SEEK_DATA/SEEK_HOLE e copia so
+    elas; o resto do arquivo destino fica esparso (ftruncate).
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd = fsrc.fileno()
+        dst_fd = fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        os.ftruncate(dst_fd, size)
+        for offset, length in data_regions(src_fd, size):
+            _copy_range(src_fd, dst_fd, offset, length)
+
+
+def overlay_file(src, dst):
+    """
+    Escreve as regioes com dados de src por cima de dst, nos mesmos
+    offsets (o resto de dst fica intacto). Retorna os bytes copiados.
+
+    E o que o rebase-snap do Firecracker faz com um snapshot Diff.
+    """
+    copied = 0
+    with open(src, "rb") as fsrc, open(dst, "r+b") as fdst:
+        src_fd = fsrc.fileno()
+        for offset, length in data_regions(src_fd, os.fstat(src_fd).st_size):
+            _copy_range(src_fd, fdst.fileno(), offset, length)
+            copied += length
+    return copied
+
+
+def _copy_range(src_fd, dst_fd, offset, length):
+    """Copia um intervalo entre arquivos, no kernel quando possivel."""
+    while length > 0:
+        chunk = min(length, COPY_CHUNK)
+        try:
+            copied = os.copy_file_range(src_fd, dst_fd, chunk, offset, offset)
+        except (AttributeError, OSError):
+            copied = 0
+        if copied <= 0:
+            # Fallback em espaco de usuario
+            data = os.pread(src_fd, chunk, offset)
+            if not data:
+                return
+            copied = os.pwrite(dst_fd, data, offset)
+        offset += copied
+        length -= copied
+
+
+def _clone_reflink(template, clone_dir, suffix):
+    path = _temp_path(clone_dir, suffix)
+    try:
+        reflink_file(template, path)
+    except OSError:
+        os.remove(path)
+        raise
+    return path, None
+
+
+def _clone_sparse(template, clone_dir, suffix):
+    path = _temp_path(clone_dir, suffix)
+    try:
+        sparse_copy_file(template, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, None
+
+
+def _losetup(path, read_only=False):
+    cmd = ["losetup", "--find", "--show"]
+    if read_only:
+        cmd.append("--read-only")
+    result = subprocess.run(cmd + [path], check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def _clone_dm_snapshot(template, clone_dir, suffix):
+    """Snapshot device-mapper: origin (template) + COW esparso por clone."""
+    name = f"nano-lambda-{uuid.uuid4().hex[:12]}"
+    sectors = os.path.getsize(template) // 512
+    cow_file = _temp_path(clone_dir, ".cow")
+    origin_dev = cow_dev = None
+
+    def release():
+        subprocess.run(["dmsetup", "remove", name], capture_output=True)
+        for dev in (cow_dev, origin_dev):
+            if dev:
+                subprocess.run(["losetup", "-d", dev], capture_output=True)
+        if os.path.exists(cow_file):
+            os.remove(cow_file)
+
+    try:
+        with open(cow_file, "wb") as f:
+            f.truncate(DM_COW_SIZE_MIB * 1024 * 1024)
+        origin_dev = _losetup(template, read_only=True)
+        cow_dev = _losetup(cow_file)
+        # Formato: <inicio> <tamanho> snapshot <origin> <cow> <persistente> <chunk>
+        table = f"0 {sectors} snapshot {origin_dev} {cow_dev} N 8"
+        subprocess.run(["dmsetup", "create", name, "--table", table],
+                       check=True, capture_output=True)
+    except Exception:
+        release()
+        raise
+
+    return f"/dev/mapper/{name}", release
+
+
+CLONE_BACKENDS = {
+    "reflink": _clone_reflink,
+    "sparse": _clone_sparse,
+    "dm-snapshot": _clone_dm_snapshot,
+}
+
+
+def clone_rootfs(template, backend="auto", clone_dir=None, suffix=".ext4"):
+    """
+    Clona o rootfs template usando o backend escolhido.
+
+    Por padrao o clone fica no mesmo diretorio do template: reflink so
+    funciona dentro do mesmo filesystem (e /tmp costuma ser tmpfs).
+    Retorna um RootfsClone com o caminho, backend usado e tempo gasto.
+    """
+    if clone_dir is None:
+        clone_dir = os.path.dirname(os.path.abspath(template))
+
+    start = time.time()
+    if backend == "auto":
+        try:
+            path, release_fn = _clone_reflink(template, clone_dir, suffix)
+            backend = "reflink"
+        except OSError as e:
+            if e.errno not in REFLINK_UNSUPPORTED:
+                raise
+            path, release_fn = _clone_sparse(template, clone_dir, suffix)
+            backend = "sparse"
+    elif backend in CLONE_BACKENDS:
+        path, release_fn = CLONE_BACKENDS[backend](template, clone_dir, suffix)
+    else:
+        raise ValueError(f"Backend de clonagem desconhecido: {backend}")
+
+    return RootfsClone(path, backend, time.time() - start, release_fn)
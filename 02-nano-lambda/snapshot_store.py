@@ -0,0 +1,476 @@
+"""
+snapshot_store.py - Snapshots por funcao para o modo de invocacao "snapshot"
+
+O artigo 04 mostrou que /snapshot/load e muito mais rapido que um cold
+start. Aqui cada funcao ganha um snapshot tirado logo depois do guest
+importar o handler; as invocacoes seguintes restauram esse snapshot.
+
+Layout (um diretorio por funcao, uma entrada por chave):
+
+    SNAPSHOT_DIR/<funcao>/<chave>/
+        vm_state     estado da VM (/snapshot/create)
+        vm_mem       memoria do guest
+        rootfs.ext4  rootfs no momento do snapshot (clonado a cada restore)
+        input.img    drive de input usado na criacao (trocado a cada restore)
+        meta.json    gravado por ultimo: marca a entrada como completa
+
+A chave e o hash do conteudo do handler mais uma "impressao digital"
+do resto (rootfs template, kernel, boot args, recursos). Se qualquer
+coisa mudar, a chave muda e as entradas antigas da funcao sao removidas.
+
+Os caminhos precisam ser estaveis: o vm_state guarda o path dos drives
+e o Firecracker abre esses arquivos no /snapshot/load.
+
+Cadeias de snapshots Diff: depois de restaurar (com dirty page tracking)
+e aquecer caches no guest, um snapshot "Diff" grava so as paginas sujas.
+Cada camada N acrescenta:
+
+        vm_state-N     estado da VM (completo, e pequeno)
+        vm_mem-N.diff  paginas sujas desde o restore (arquivo esparso)
+        rootfs-N.ext4  rootfs da VM que gerou a camada
+        input-N.img    drive de input da VM que gerou a camada
+
+O restore usa a memoria "materializada" da cabeca (head-N.mem: base +
+diffs, montada uma vez com reflink/copia esparsa + overlay das paginas).
+Quando a cadeia passa de SNAPSHOT_CHAIN_MAX camadas, um merge em
+background transforma a cabeca na nova base e apaga os diffs.
+
+Com um PageStore (page_store.py) a memoria da base tambem vai para o
+store deduplicado e ganha um manifesto:
+
+        vm_mem.manifest.json  hash de cada chunk do vm_mem
+
+Com reflink o vm_mem passa a compartilhar os extents com os chunks (o
+disco so guarda cada chunk uma vez); release_memory() apaga o vm_mem de
+funcoes frias e o proximo restore o reconstitui a partir dos chunks.
+"""
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from page_store import load_manifest
+from rootfs_clone import clone_rootfs, overlay_file
+
+# Camadas Diff acumuladas antes do merge numa nova base
+SNAPSHOT_CHAIN_MAX = 4
+
+
+def allocated_bytes(path):
+    """Bytes realmente ocupados em disco (arquivos esparsos)."""
+    return os.stat(path).st_blocks * 512
+
+
+def file_fingerprint(path):
+    """Identidade barata de um arquivo grande (sem ler o conteudo)."""
+    st = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "ino": st.st_ino,
+    }
+
+
+class SnapshotEntry:
+    """Um snapshot completo de uma funcao."""
+
+    def __init__(self, directory, key):
+        self.dir = directory
+        self.key = key
+        self.state_file = os.path.join(directory, "vm_state")
+        self.mem_file = os.path.join(directory, "vm_mem")
+        self.rootfs = os.path.join(directory, "rootfs.ext4")
+        self.input_drive = os.path.join(directory, "input.img")
+        self.meta_file = os.path.join(directory, "meta.json")
+        self.manifest_file = os.path.join(directory, "vm_mem.manifest.json")
+        self.meta = {}
+
+    def is_complete(self):
+        return os.path.exists(self.meta_file)
+
+    # --- cadeia de snapshots Diff ---
+
+    @property
+    def chain(self):
+        return self.meta.get("chain", [])
+
+    def layer_state_file(self, layer):
+        return self.state_file if layer == 0 else f"{self.state_file}-{layer}"
+
+    def layer_rootfs(self, layer):
+        return self.rootfs if layer == 0 else os.path.join(self.dir, f"rootfs-{layer}.ext4")
+
+    def layer_input_drive(self, layer):
+        return self.input_drive if layer == 0 else os.path.join(self.dir, f"input-{layer}.img")
+
+    def layer_diff_file(self, layer):
+        return f"{self.mem_file}-{layer}.diff"
+
+    def head_layer(self):
+        """Camada mais recente (0 = o snapshot Full original)."""
+        chain = self.chain
+        return chain[-1]["layer"] if chain else self.meta.get("base_layer", 0)
+
+    def head_state_file(self):
+        return self.layer_state_file(self.head_layer())
+
+    def head_rootfs(self):
+        return self.layer_rootfs(self.head_layer())
+
+    def working_set_file(self):
+        """Paginas que o guest toca depois do restore (ver uffd_server.py)."""
+        return os.path.join(self.dir, f"working_set-{self.head_layer()}.bin")
+
+    def head_mem_file(self):
+        if not self.chain:
+            return self.mem_file
+        return os.path.join(self.dir, f"head-{self.head_layer()}.mem")
+
+    def load_meta(self):
+        with open(self.meta_file) as f:
+            self.meta = json.load(f)
+        return self.meta
+
+    def write_meta(self, meta):
+        tmp = self.meta_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, self.meta_file)
+        self.meta = meta
+
+
+class SnapshotStore:
+    """Gerencia os snapshots de cada funcao."""
+
+    def __init__(self, root, page_store=None):
+        self.root = root
+        self.page_store = page_store
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def function_id(self, function_path):
+        """Nome do diretorio da funcao (pasta do handler + hash do caminho)."""
+        path = os.path.abspath(function_path)
+        name = os.path.basename(os.path.dirname(path)) or "funcao"
+        digest = hashlib.sha256(path.encode()).hexdigest()[:8]
+        return f"{name}-{digest}"
+
+    def key(self, function_path, fingerprint):
+        h = hashlib.sha256()
+        with open(function_path, "rb") as f:
+            h.update(f.read())
+        h.update(json.dumps(fingerprint, sort_keys=True).encode())
+        return h.hexdigest()[:16]
+
+    @contextlib.contextmanager
+    def _locked(self, function_id, name=".lock"):
+        """Lock por funcao: entre threads e entre processos (flock)."""
+        with self._locks_guard:
+            lock = self._locks.setdefault((function_id, name), threading.Lock())
+        func_dir = os.path.join(self.root, function_id)
+        os.makedirs(func_dir, exist_ok=True)
+        with lock, open(os.path.join(func_dir, name), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield func_dir
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def lookup(self, function_path, fingerprint):
+        """Retorna a entrada completa para a chave atual, ou None."""
+        function_id = self.function_id(function_path)
+        key = self.key(function_path, fingerprint)
+        entry = SnapshotEntry(os.path.join(self.root, function_id, key), key)
+        if entry.is_complete():
+            entry.load_meta()
+            return entry
+        return None
+
+    def get_or_create(self, function_path, fingerprint, create_fn):
+        """
+        Retorna (entrada, criada_agora).
+
+        Se nao houver snapshot valido, chama create_fn(entry) para
+        criar os arquivos da entrada; o retorno (dict) vira o meta.json.
+        Entradas antigas da funcao (chave diferente) sao invalidadas.
+        """
+        entry = self.lookup(function_path, fingerprint)
+        if entry:
+            return entry, False
+
+        function_id = self.function_id(function_path)
+        key = self.key(function_path, fingerprint)
+        with self._locked(function_id) as func_dir:
+            entry = SnapshotEntry(os.path.join(func_dir, key), key)
+            if entry.is_complete():
+                # Outro processo/thread criou enquanto esperavamos o lock
+                entry.load_meta()
+                return entry, False
+
+            invalidated = self._invalidate_others(func_dir, key)
+            if os.path.exists(entry.dir):
+                shutil.rmtree(entry.dir)  # sobra de uma criacao que falhou
+            os.makedirs(entry.dir)
+            try:
+                meta = create_fn(entry)
+            except Exception:
+                shutil.rmtree(entry.dir, ignore_errors=True)
+                raise
+            meta = dict(meta or {})
+            if self.page_store:
+                meta["page_store"] = self._dedup(entry)
+                if invalidated:
+                    self.gc_pages()
+            meta.update({
+                "key": key,
+                "function": os.path.abspath(function_path),
+                "fingerprint": fingerprint,
+                "created_at": time.time(),
+            })
+            entry.write_meta(meta)
+            return entry, True
+
+    def _invalidate_others(self, func_dir, key):
+        removed = 0
+        for name in os.listdir(func_dir):
+            path = os.path.join(func_dir, name)
+            if name != key and os.path.isdir(path):
+                print(f"[*] Invalidando snapshot antigo: {path}")
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def invalidate(self, function_path):
+        """Remove todos os snapshots de uma funcao."""
+        function_id = self.function_id(function_path)
+        with self._locked(function_id) as func_dir:
+            removed = self._invalidate_others(func_dir, None)
+        if removed and self.page_store:
+            self.gc_pages()
+
+    # --- memoria deduplicada (page_store.py) ---
+
+    def _dedup(self, entry):
+        """
+        Manda o vm_mem da entrada para o page store.
+
+        Se a reconstituicao sair toda por reflink, o vm_mem e trocado
+        por ela (extents compartilhados com os chunks). Sem reflink o
+        vm_mem fica como esta; o manifesto permite apaga-lo depois
+        (release_memory) e remonta-lo sob demanda.
+        """
+        manifest, stats = self.page_store.ingest(entry.mem_file, entry.manifest_file)
+        tmp = entry.mem_file + ".pages"
+        try:
+            stats["reflinked"] = self.page_store.reconstitute(manifest, tmp)
+            if stats["reflinked"]:
+                os.replace(tmp, entry.mem_file)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        print(f"[*] Memoria no page store: {stats['new']} chunks novos, "
+              f"{stats['reused']} reaproveitados, {stats['zero']} zerados "
+              f"({stats['ingest_s']:.3f}s)")
+        return stats
+
+    def _reconstitute(self, entry):
+        start = time.time()
+        tmp = entry.mem_file + ".pages"
+        try:
+            self.page_store.reconstitute(load_manifest(entry.manifest_file), tmp)
+            os.rename(tmp, entry.mem_file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        print(f"[*] Memoria reconstituida do page store ({time.time() - start:.3f}s)")
+
+    def release_memory(self, entry):
+        """
+        Apaga a memoria materializada (vm_mem e cabeca da cadeia) de uma
+        entrada que tem manifesto; o proximo restore a reconstitui.
+        Retorna os bytes que ocupavam em disco (com reflink, parte deles
+        continua ocupada pelos chunks).
+        """
+        freed = 0
+        with self._locked(self._entry_function_id(entry)):
+            if not os.path.exists(entry.manifest_file):
+                return 0
+            for name in os.listdir(entry.dir):
+                path = os.path.join(entry.dir, name)
+                if path == entry.mem_file or name.startswith("head-"):
+                    freed += allocated_bytes(path)
+                    os.remove(path)
+        return freed
+
+    def _manifests(self):
+        return glob.glob(os.path.join(self.root, "*", "*", "vm_mem.manifest.json"))
+
+    def gc_pages(self):
+        """Remove do page store os chunks que nenhum snapshot usa mais."""
+        freed = self.page_store.gc(self._manifests())
+        if freed:
+            print(f"[*] Page store: {freed / (1024 * 1024):.1f} MiB de chunks orfaos removidos")
+        return freed
+
+    def page_stats(self):
+        """Taxa de deduplicacao da memoria de todos os snapshots."""
+        return self.page_store.stats(self._manifests())
+
+    # --- cadeias de snapshots Diff ---
+
+    def _entry_function_id(self, entry):
+        return os.path.basename(os.path.dirname(entry.dir))
+
+    def materialize(self, entry):
+        """
+        Garante a memoria da cabeca da cadeia (base + diffs) em disco.
+
+        Feito uma vez por camada: clone da base (reflink quando possivel)
+        e overlay das paginas de cada diff. Cabecas antigas sao apagadas
+        (VMs que ja carregaram seguem com o arquivo aberto).
+        """
+        entry.load_meta()
+        if os.path.exists(entry.head_mem_file()):
+            return entry
+        with self._locked(self._entry_function_id(entry)):
+            entry.load_meta()
+            self._materialize_locked(entry)
+        return entry
+
+    def _materialize_locked(self, entry):
+        head = entry.head_mem_file()
+        if (not os.path.exists(entry.mem_file) and self.page_store
+                and os.path.exists(entry.manifest_file)):
+            self._reconstitute(entry)
+        if not os.path.exists(head):
+            start = time.time()
+            clone = clone_rootfs(entry.mem_file, clone_dir=entry.dir, suffix=".mem")
+            try:
+                for layer in entry.chain:
+                    overlay_file(entry.layer_diff_file(layer["layer"]), clone.path)
+                os.rename(clone.path, head)
+            except BaseException:
+                clone.release()
+                raise
+            print(f"[*] Cabeca da cadeia materializada ({len(entry.chain)} diffs, "
+                  f"{time.time() - start:.3f}s)")
+        for name in os.listdir(entry.dir):
+            path = os.path.join(entry.dir, name)
+            if name.startswith("head-") and path != head:
+                os.remove(path)
+
+    @contextlib.contextmanager
+    def restoring(self, entry):
+        """
+        Segura a cabeca da cadeia enquanto o Firecracker abre os arquivos.
+
+        Lock compartilhado: varios restores ao mesmo tempo, mas o merge
+        (exclusivo) nao apaga arquivos no meio de um /snapshot/load.
+        Produz a entrada com o meta atual (head_*() apontam a cabeca).
+        """
+        func_dir = os.path.dirname(entry.dir)
+        while True:
+            self.materialize(entry)
+            with open(os.path.join(func_dir, ".lock"), "w") as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                try:
+                    entry.load_meta()
+                    if os.path.exists(entry.head_mem_file()):
+                        yield entry
+                        return
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            # Um merge trocou a cabeca entre o materialize e o lock
+
+    def add_diff(self, entry, create_fn):
+        """
+        Acrescenta uma camada Diff a cadeia da entrada.
+
+        create_fn(entry, layer) restaura a cabeca atual, aquece a VM e
+        grava os arquivos layer_*(N) da camada; o retorno
+        (dict) vai para o meta da camada. Uma camada por vez por funcao.
+        Retorna o meta da camada.
+        """
+        function_id = self._entry_function_id(entry)
+        with self._locked(function_id, ".refresh.lock"):
+            entry.load_meta()
+            layer = max([entry.head_layer()] + [l["layer"] for l in entry.chain]) + 1
+            try:
+                info = dict(create_fn(entry, layer) or {})
+            except Exception:
+                self._remove_layer_files(entry, layer)
+                raise
+            info.update({
+                "layer": layer,
+                "bytes_written": allocated_bytes(entry.layer_diff_file(layer)),
+                "created_at": time.time(),
+            })
+            with self._locked(function_id):
+                entry.load_meta()
+                meta = dict(entry.meta)
+                meta["chain"] = entry.chain + [info]
+                entry.write_meta(meta)
+        return info
+
+    def needs_merge(self, entry, max_chain=SNAPSHOT_CHAIN_MAX):
+        return len(entry.chain) > max_chain
+
+    def merge(self, entry):
+        """
+        Transforma a cabeca da cadeia na nova base e apaga os diffs.
+
+        O vm_state e o rootfs da cabeca continuam onde estao (o vm_state
+        guarda o caminho do drive); so a memoria vira o novo vm_mem.
+        """
+        self.materialize(entry)
+        with self._locked(self._entry_function_id(entry)):
+            entry.load_meta()
+            if not entry.chain:
+                return entry
+            start = time.time()
+            # Pode ter entrado uma camada nova depois do materialize
+            self._materialize_locked(entry)
+            head = entry.head_layer()
+            old_layers = {entry.meta.get("base_layer", 0)} | {l["layer"] for l in entry.chain}
+            os.replace(entry.head_mem_file(), entry.mem_file)
+            meta = dict(entry.meta)
+            if self.page_store:
+                # Os chunks da base antiga que so ela usava viram lixo
+                meta["page_store"] = self._dedup(entry)
+                self.gc_pages()
+            meta.update({"base_layer": head, "chain": [],
+                         "merged_at": time.time(), "merge_s": time.time() - start})
+            entry.write_meta(meta)
+            for layer in old_layers:
+                self._remove_layer_files(entry, layer, keep_state=(layer == head))
+            print(f"[*] Cadeia de snapshots mesclada na camada {head}")
+        return entry
+
+    def merge_async(self, entry):
+        """Merge numa thread de fundo (o restore segue usando a cabeca)."""
+        def run():
+            try:
+                self.merge(SnapshotEntry(entry.dir, entry.key))
+            except Exception as e:
+                print(f"[!] Falha no merge da cadeia de snapshots: {e}")
+        thread = threading.Thread(target=run, name="snapshot-merge", daemon=True)
+        thread.start()
+        return thread
+
+    def _remove_layer_files(self, entry, layer, keep_state=False):
+        paths = [entry.layer_diff_file(layer)]
+        if not keep_state:
+            paths += [entry.layer_state_file(layer), entry.layer_rootfs(layer),
+                      entry.layer_input_drive(layer),
+                      os.path.join(entry.dir, f"working_set-{layer}.bin")]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,325 @@
+"""
+uffd_server.py - Servidor de paginas (userfaultfd) para o restore de snapshots
+
+Com o backend "File" o /snapshot/load mapeia o vm_mem e o guest paga um
+page fault do kernel (leitura do arquivo) para cada pagina que toca
+depois do resume. Com o backend "Uffd" o Firecracker registra a memoria
+do guest num userfaultfd e manda o descritor para um servidor no host
+(socket Unix do backend_path). Cada fault vira um evento lido aqui e
+respondido com UFFDIO_COPY a partir do vm_mem mapeado com mmap.
+
+Working set: o servidor anota as paginas que o guest pediu depois do
+restore e grava num arquivo ao lado do snapshot. Nos restores seguintes
+essas paginas sao copiadas assim que o Firecracker se conecta, e o host
+espera o prefetch (wait_prefetch) antes do resume: o guest nao chega a
+pedir por elas (a ideia do REAP). Copiar com a VM pausada sai mais barato
+que disputar com os faults do guest. Paginas fora do working set
+continuam sendo servidas sob demanda e entram no arquivo para a proxima
+vez. O custo do restore passa a crescer com o working set, nao com o
+tamanho da memoria do guest.
+
+Protocolo do Firecracker: ao conectar ele envia um JSON com as regioes
+da memoria do guest (base_host_virt_addr, size, offset no arquivo,
+page_size) e o userfaultfd como SCM_RIGHTS.
+
+Uso:
+    server = PageServer("vm_mem", "/tmp/fc.uffd", "working_set-0.bin")
+    server.start()
+    # PUT /snapshot/load com {"backend_type": "Uffd", "backend_path": "/tmp/fc.uffd"}
+    server.wait_prefetch()
+    # PATCH /vm Resumed ...
+    print(server.stop())
+"""
+
+import array
+import ctypes
+import errno
+import fcntl
+import json
+import mmap
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+PAGE_SIZE = 4096
+
+# linux/userfaultfd.h (x86_64)
+UFFD_EVENT_PAGEFAULT = 0x12
+UFFD_EVENT_REMOVE = 0x15
+UFFDIO_COPY = 0xC028AA03      # _IOWR(0xAA, 0x03, struct uffdio_copy)
+UFFDIO_ZEROPAGE = 0xC020AA04  # _IOWR(0xAA, 0x04, struct uffdio_zeropage)
+_MSG = struct.Struct("BxxxxxxxQQQ")     # uffd_msg: event + 3 campos de 64 bits
+_COPY = struct.Struct("QQQQq")          # dst, src, len, mode, copy
+_ZEROPAGE = struct.Struct("QQQq")       # start, len, mode, zeropage
+
+# Tempo maximo esperando o Firecracker conectar no socket
+CONNECT_TIMEOUT = 10
+# Tempo maximo que o resume espera pelo prefetch do working set
+PREFETCH_TIMEOUT = 5
+
+
+def load_working_set(path):
+    """Paginas (indices de PAGE_SIZE no vm_mem) gravadas por um restore anterior."""
+    pages = array.array("I")
+    try:
+        with open(path, "rb") as f:
+            pages.frombytes(f.read())
+    except FileNotFoundError:
+        pass
+    return pages
+
+
+def save_working_set(path, pages):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        array.array("I", sorted(pages)).tofile(f)
+    os.replace(tmp, path)
+
+
+def _ranges(pages):
+    """Agrupa indices ordenados em (primeira pagina, quantidade)."""
+    ranges = []
+    for page in sorted(pages):
+        if ranges and ranges[-1][0] + ranges[-1][1] == page:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([page, 1])
+    return ranges
+
+
+class Region:
+    """Uma regiao da memoria do guest no processo do Firecracker."""
+
+    def __init__(self, mapping):
+        self.base = mapping["base_host_virt_addr"]
+        self.size = mapping["size"]
+        self.offset = mapping["offset"]
+        # Firecracker < 1.7 manda page_size_kib
+        self.page_size = mapping.get("page_size") or mapping.get("page_size_kib", 4) * 1024
+
+    def contains(self, address):
+        return self.base <= address < self.base + self.size
+
+
+class PageServer:
+    """
+    Serve as paginas de um vm_mem para um Firecracker (backend Uffd).
+
+    Uma instancia por restore: start() antes do /snapshot/load, stop()
+    depois que a VM terminou (grava o working set atualizado).
+    """
+
+    def __init__(self, mem_file, socket_path, working_set_file=None, prefetch=True):
+        self.mem_file = mem_file
+        self.socket_path = socket_path
+        self.working_set_file = working_set_file
+        self.prefetch = prefetch
+        self.regions = []
+        self.faulted = []       # paginas pedidas pelo guest, na ordem
+        self.prefetched = 0
+        self.stats = {}
+        self._sock = None
+        self._uffd = None
+        self._mm = None
+        self._src = 0
+        self._removed = []      # faixas devolvidas (balloon): servidas com zeros
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = None
+        self._prefetch_thread = None
+        self._prefetch_done = threading.Event()
+        self._error = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.socket_path)
+        self._sock.listen(1)
+        self._thread = threading.Thread(target=self._run, name="uffd-page-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            poller = select.poll()
+            poller.register(self._sock, select.POLLIN)
+            poller.register(self._stop_r, select.POLLIN)
+            if self._sock.fileno() not in dict(poller.poll(CONNECT_TIMEOUT * 1000)):
+                return  # stop() antes do Firecracker conectar (ou timeout)
+            conn, _ = self._sock.accept()
+            with conn:
+                data, fds, _, _ = socket.recv_fds(conn, 65536, 1)
+            if not fds:
+                raise Exception("Firecracker nao enviou o userfaultfd")
+            self._uffd = fds[0]
+            self.regions = [Region(m) for m in json.loads(data)]
+            self.stats["connected_at"] = time.time()
+
+            with open(self.mem_file, "rb") as f:
+                # ACCESS_COPY: mapeamento privado (gravavel), o ctypes
+                # precisa disso para dar o endereco; nada e escrito
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            buf = ctypes.c_char.from_buffer(self._mm)
+            self._src = ctypes.addressof(buf)
+            del buf
+
+            if self.prefetch and self.working_set_file and os.path.exists(self.working_set_file):
+                self._prefetch_thread = threading.Thread(
+                    target=self._prefetch, name="uffd-prefetch", daemon=True)
+                self._prefetch_thread.start()
+            else:
+                self._prefetch_done.set()
+            self._serve()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._prefetch_done.set()
+
+    def wait_prefetch(self, timeout=PREFETCH_TIMEOUT):
+        """Espera o working set ser copiado (chamar depois do /snapshot/load)."""
+        return self._prefetch_done.wait(timeout)
+
+    # --- copia de paginas ---
+
+    def _copy(self, dst, offset, length):
+        """
+        UFFDIO_COPY de `length` bytes do vm_mem para `dst`.
+
+        Retorna (bytes copiados, parou numa pagina que ja existia).
+        """
+        while True:
+            arg = bytearray(_COPY.pack(dst, self._src + offset, length, 0, 0))
+            try:
+                fcntl.ioctl(self._uffd, UFFDIO_COPY, arg)
+                return length, False
+            except OSError as e:
+                copied = max(_COPY.unpack(arg)[4], 0)
+                if e.errno == errno.EEXIST:
+                    return copied, True  # fault x prefetch: o outro chegou antes
+                if e.errno == errno.EAGAIN:
+                    # O mapeamento mudou no meio: continua de onde parou
+                    dst, offset, length = dst + copied, offset + copied, length - copied
+                    continue
+                if e.errno in (errno.ENOENT, errno.ESRCH):
+                    return length, False  # o processo do Firecracker acabou
+                raise
+
+    def _zero(self, dst, length):
+        arg = bytearray(_ZEROPAGE.pack(dst, length, 0, 0))
+        try:
+            fcntl.ioctl(self._uffd, UFFDIO_ZEROPAGE, arg)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.EAGAIN, errno.ENOENT, errno.ESRCH):
+                raise
+
+    def _region_for_offset(self, offset):
+        for region in self.regions:
+            if region.offset <= offset < region.offset + region.size:
+                return region
+        return None
+
+    def _prefetch(self):
+        try:
+            self._prefetch_pages()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._prefetch_done.set()
+
+    def _prefetch_pages(self):
+        """Copia o working set anotado antes do guest pedir."""
+        start = time.time()
+        pages = load_working_set(self.working_set_file)
+        for first, count in _ranges(pages):
+            offset = first * PAGE_SIZE
+            length = count * PAGE_SIZE
+            while length > 0:
+                region = self._region_for_offset(offset)
+                if region is None:
+                    break
+                chunk = min(length, region.offset + region.size - offset)
+                dst = region.base + offset - region.offset
+                copied, exists = self._copy(dst, offset, chunk)
+                self.prefetched += copied // PAGE_SIZE
+                if exists:
+                    copied += region.page_size  # o guest ja pediu essa pagina
+                offset += copied
+                length -= copied
+        self.stats["prefetch_s"] = time.time() - start
+
+    # --- loop de eventos ---
+
+    def _serve(self):
+        poller = select.poll()
+        poller.register(self._uffd, select.POLLIN)
+        poller.register(self._stop_r, select.POLLIN)
+        while True:
+            events = dict(poller.poll())
+            if self._stop_r in events:
+                return
+            if events.get(self._uffd, 0) & (select.POLLHUP | select.POLLERR):
+                return
+            try:
+                data = os.read(self._uffd, _MSG.size)
+            except BlockingIOError:
+                continue
+            if not data:
+                return
+            event, arg1, arg2, _ = _MSG.unpack(data)
+            if event == UFFD_EVENT_PAGEFAULT:
+                self._fault(arg2)
+            elif event == UFFD_EVENT_REMOVE:
+                self._removed.append((arg1, arg2))
+
+    def _fault(self, address):
+        for region in self.regions:
+            if region.contains(address):
+                break
+        else:
+            return
+        page = address - (address - region.base) % region.page_size
+        if any(start <= page < end for start, end in self._removed):
+            self._zero(page, region.page_size)
+            return
+        offset = region.offset + page - region.base
+        if not self.stats.get("first_fault_at"):
+            self.stats["first_fault_at"] = time.time()
+        _, exists = self._copy(page, offset, region.page_size)
+        if exists:
+            return  # o prefetch copiou enquanto o evento estava na fila
+        for index in range(region.page_size // PAGE_SIZE):
+            self.faulted.append(offset // PAGE_SIZE + index)
+
+    def stop(self):
+        """
+        Para o servidor e grava o working set (anterior + paginas que
+        faltaram). Retorna as estatisticas do restore.
+        """
+        os.write(self._stop_w, b"x")
+        for thread in (self._thread, self._prefetch_thread):
+            if thread:
+                thread.join()
+        for fd in (self._stop_r, self._stop_w, self._uffd):
+            if fd is not None:
+                os.close(fd)
+        self._uffd = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+        if self.working_set_file and self.faulted:
+            pages = set(load_working_set(self.working_set_file))
+            pages.update(self.faulted)
+            save_working_set(self.working_set_file, pages)
+        self.stats.update({"faults": len(self.faulted), "prefetched_pages": self.prefetched})
+        if self._error:
+            self.stats["error"] = str(self._error)
+        return self.stats
@@ -0,0 +1,143 @@
+"""
+vm_wait.py - Esperas orientadas a eventos para o ciclo de vida da VM
+
+Antes, o nano-Lambda checava a existencia do socket a cada 100ms (mais
+200ms fixos de "garantia") e o fim do processo a cada 500ms: ate ~0.8s
+por invocacao sem fazer nada. Aqui:
+
+- wait_for_socket(): tenta conectar no socket da API com backoff curto;
+  retorna assim que o Firecracker aceita conexoes
+- VmWatcher: um selector sobre o pidfd do processo (ou um pipe
+  sinalizado por uma thread, em kernels/Pythons sem pidfd) e sobre o
+  pipe do console serial. Termina quando o processo sai ou assim que o
+  marcador de fim aparece no console.
+"""
+
+import os
+import selectors
+import socket
+import threading
+import time
+
+# Impresso pelo /run-function.sh do guest depois que o handler termina
+DONE_MARKER = b"=== Execucao finalizada"
+
+
+def wait_for_socket(path, timeout=5.0):
+    """
+    Espera o socket da API aceitar conexoes.
+
+    Retorna o socket ja conectado (pode ser reaproveitado pelo
+    cliente da API) ou levanta Exception no timeout.
+    """
+    deadline = time.time() + timeout
+    delay = 0.0005
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+        if time.time() >= deadline:
+            raise Exception("Timeout esperando socket do Firecracker")
+        time.sleep(delay)
+        delay = min(delay * 2, 0.01)
+
+
+class _ExitNotifier:
+    """fd que fica legivel quando o processo termina."""
+
+    def __init__(self, process):
+        self.process = process
+        self._pidfd = None
+        self._pipe = None
+        try:
+            self._pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            # Sem pidfd (Python < 3.9 ou kernel < 5.3): uma thread
+            # bloqueia no wait() e acorda o selector por um pipe
+            self._pipe = os.pipe()
+            threading.Thread(target=self._wait_thread, daemon=True).start()
+
+    def _wait_thread(self):
+        self.process.wait()
+        os.write(self._pipe[1], b"x")
+
+    def fileno(self):
+        return self._pidfd if self._pidfd is not None else self._pipe[0]
+
+    def close(self):
+        if self._pidfd is not None:
+            os.close(self._pidfd)
+        if self._pipe:
+            for fd in self._pipe:
+                os.close(fd)
+
+
+class VmWatcher:
+    """
+    Acompanha uma VM ate ela terminar.
+
+    `console` e o pipe do stdout do Firecracker; cada pedaco lido e
+    entregue para `on_output(bytes)`.
+    """
+
+    def __init__(self, process, console, on_output, done_marker=DONE_MARKER):
+        self.process = process
+        self.console = console
+        self.on_output = on_output
+        self.done_marker = done_marker
+
+    def _read_console(self):
+        try:
+            chunk = os.read(self.console.fileno(), 65536)
+        except BlockingIOError:
+            return None
+        if chunk:
+            self.on_output(chunk)
+        return chunk
+
+    def _drain_console(self):
+        os.set_blocking(self.console.fileno(), False)
+        while self._read_console():
+            pass
+
+    def wait(self, timeout):
+        """
+        Espera a VM terminar.
+
+        Retorna "exit" (processo saiu), "marker" (marcador de fim no
+        console) ou "timeout".
+        """
+        notifier = _ExitNotifier(self.process)
+        sel = selectors.DefaultSelector()
+        sel.register(notifier, selectors.EVENT_READ, "exit")
+        sel.register(self.console, selectors.EVENT_READ, "console")
+
+        deadline = time.time() + timeout
+        tail = b""
+        keep = len(self.done_marker) - 1
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return "timeout"
+                for key, _ in sel.select(remaining):
+                    if key.data == "exit":
+                        self._drain_console()
+                        return "exit"
+                    chunk = self._read_console()
+                    if not chunk:
+                        # EOF: o Firecracker fechou o stdout
+                        sel.unregister(self.console)
+                        continue
+                    # Procura o marcador inclusive quando ele chega
+                    # quebrado entre dois pedacos
+                    window = tail + chunk
+                    if self.done_marker in window:
+                        return "marker"
+                    tail = window[-keep:] if keep else b""
+        finally:
+            sel.close()
+            notifier.close()
@@ -0,0 +1,224 @@
+"""
+warm_pool.py - Pool de microVMs pre-aquecidas para o nano-Lambda
+
+Cada invocacao "fria" paga o start do Firecracker e a configuracao
+via API antes mesmo do kernel bootar. O pool deixa N processos
+Firecracker ja iniciados e configurados (kernel + recursos), esperando
+so o rootfs da invocacao e o InstanceStart.
+
+Uma VM do Firecracker nao pode ser reiniciada depois do InstanceStart,
+entao VMs usadas sao sempre descartadas e o pool e reabastecido em
+background. VMs devolvidas sem uso voltam para o pool.
+
+Uso:
+    pool = WarmPool(lambda vm_id: NanoLambda(vm_id=vm_id), size=2)
+    pool.start()
+    resultado = pool.invoke("handler.py", "input")
+    print(pool.stats())
+    pool.close()
+"""
+
+import collections
+import itertools
+import threading
+import time
+
+
+class WarmPool:
+    """
+    Mantem `size` microVMs pre-aquecidas.
+
+    `factory(vm_id)` deve devolver um runner com os metodos
+    warm_up(), is_warm(), invoke() e cleanup() (ex: NanoLambda).
+    """
+
+    def __init__(self, factory, size=2, max_idle_age=300, name="default",
+                 check_interval=1.0):
+        self.factory = factory
+        self.size = size
+        self.max_idle_age = max_idle_age
+        self.name = name
+        self.check_interval = check_interval
+
+        self._idle = collections.deque()  # (vm, momento em que ficou pronta)
+        self._pending = 0                 # VMs sendo aquecidas agora
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+        self._hits = 0
+        self._misses = 0
+        self._retired = 0
+        self._expired = 0
+        self._refill_failures = 0
+        self._refill_times = collections.deque(maxlen=100)
+
+    def start(self):
+        """Inicia o reabastecimento em background."""
+        self._thread = threading.Thread(
+            target=self._refill_loop,
+            name=f"warm-pool-{self.name}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def _new_vm(self):
+        """Cria e aquece uma VM nova. Retorna (vm, segundos gastos)."""
+        vm = self.factory(f"{self.name}-{next(self._ids)}")
+        start = time.time()
+        try:
+            vm.warm_up()
+        except Exception:
+            vm.cleanup()
+            raise
+        return vm, time.time() - start
+
+    def _expire_idle(self):
+        """Descarta VMs ociosas velhas demais ou que morreram (com lock)."""
+        now = time.time()
+        alive = collections.deque()
+        dead = []
+        for vm, ready_at in self._idle:
+            if now - ready_at > self.max_idle_age:
+                self._expired += 1
+                dead.append(vm)
+            elif not vm.is_warm():
+                dead.append(vm)
+            else:
+                alive.append((vm, ready_at))
+        self._idle = alive
+        return dead
+
+    def _refill_loop(self):
+        while True:
+            with self._cond:
+                dead = self._expire_idle()
+                while (not self._closed and not dead
+                       and len(self._idle) + self._pending >= self.size):
+                    self._cond.wait(timeout=self.check_interval)
+                    dead = self._expire_idle()
+                if self._closed:
+                    break
+                refill = len(self._idle) + self._pending < self.size
+                if refill:
+                    self._pending += 1
+
+            for vm in dead:
+                self._retire(vm)
+
+            if not refill:
+                continue
+
+            try:
+                vm, elapsed = self._new_vm()
+            except Exception as e:
+                print(f"[!] Pool {self.name}: falha ao aquecer VM: {e}")
+                with self._cond:
+                    self._pending -= 1
+                    self._refill_failures += 1
+                time.sleep(self.check_interval)
+                continue
+
+            with self._cond:
+                self._pending -= 1
+                self._refill_times.append(elapsed)
+                if self._closed:
+                    dead = [vm]
+                else:
+                    self._idle.append((vm, time.time()))
+                    dead = []
+                    self._cond.notify_all()
+            for vm in dead:
+                self._retire(vm)
+
+    def _retire(self, vm):
+        with self._cond:
+            self._retired += 1
+        vm.cleanup()
+
+    def lease(self):
+        """
+        Retira uma VM pre-aquecida do pool.
+
+        Se o pool estiver vazio (miss), aquece uma VM na hora,
+        pagando o custo de um cold start.
+        """
+        with self._cond:
+            dead = self._expire_idle()
+            vm = None
+            if self._idle:
+                vm, _ = self._idle.popleft()
+                self._hits += 1
+            else:
+                self._misses += 1
+            # Acorda o reabastecimento para repor a VM retirada
+            self._cond.notify_all()
+
+        for old in dead:
+            self._retire(old)
+
+        if vm is None:
+            vm, _ = self._new_vm()
+        return vm
+
+    def release(self, vm):
+        """
+        Devolve uma VM ao pool.
+
+        VMs que ainda estao pre-aquecidas (nao receberam InstanceStart)
+        voltam para o pool; as demais sao descartadas.
+        """
+        with self._cond:
+            if (not self._closed and vm.is_warm()
+                    and len(self._idle) < self.size):
+                self._idle.append((vm, time.time()))
+                self._cond.notify_all()
+                return
+        self._retire(vm)
+
+    def invoke(self, function_path, input_data):
+        """Invoca a funcao numa VM do pool (mesma interface do NanoLambda)."""
+        vm = self.lease()
+        try:
+            return vm.invoke(function_path, input_data)
+        finally:
+            self.release(vm)
+
+    def stats(self):
+        """Estatisticas do pool (hits, misses e latencia de refill)."""
+        with self._cond:
+            refill = sorted(self._refill_times)
+            return {
+                "name": self.name,
+                "size": self.size,
+                "idle": len(self._idle),
+                "pending": self._pending,
+                "hits": self._hits,
+                "misses": self._misses,
+                "retired": self._retired,
+                "expired": self._expired,
+                "refill_failures": self._refill_failures,
+                "refill_avg_s": sum(refill) / len(refill) if refill else 0.0,
+                "refill_p50_s": refill[len(refill) // 2] if refill else 0.0,
+                "refill_max_s": refill[-1] if refill else 0.0,
+            }
+
+    def close(self):
+        """Para o reabastecimento e descarta as VMs ociosas."""
+        with self._cond:
+            self._closed = True
+            idle = [vm for vm, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10)
+        for vm in idle:
+            self._retire(vm)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -131,10 +131,24 @@ echo "======================================"
 echo "=== Configurando rede... ==="
 echo "======================================"
 
-# Configura interface de rede
+# Configura interface de rede. Com o pool de rede (net_pool.py) o host
+# passa ip=<guest>::<gateway>:<mascara>::eth0:off nos boot args (o kernel
+# com IP_PNP ja configura sozinho); sem ele, a tap0 do setup-network.sh
+GUEST_IP=172.16.0.2
+GATEWAY=172.16.0.1
+NETMASK=255.255.255.0
+for arg in $(cat /proc/cmdline); do
+    case "$arg" in
+        ip=*)
+            GUEST_IP=$(echo "${arg#ip=}" | cut -d: -f1)
+            GATEWAY=$(echo "${arg#ip=}" | cut -d: -f3)
+            NETMASK=$(echo "${arg#ip=}" | cut -d: -f4)
+            ;;
+    esac
+done
 ip link set eth0 up
-ip addr add 172.16.0.2/24 dev eth0
-ip route add default via 172.16.0.1
+ifconfig eth0 "$GUEST_IP" netmask "$NETMASK"
+ip route replace default via "$GATEWAY"
 
 # Testa conectividade
 echo ""
@@ -171,8 +185,11 @@ SCRIPT
     chmod +x /run-function.sh
 '
 
-echo "[5/6] Limpando caches..."
+echo "[5/6] Pre-compilando bytecode e limpando caches..."
+# .pyc com hash nao verificado (ver 02-nano-lambda/bytecode.py)
 chroot "${MOUNT_POINT}" /bin/sh -c '
+    python3 -m compileall -q -f --invalidation-mode unchecked-hash /usr/lib/python3* \
+        || [ $? -eq 1 ]
     rm -rf /var/cache/apk/*
     rm -rf /tmp/*
 '
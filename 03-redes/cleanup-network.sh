@@ -8,6 +8,9 @@ set -e
 
 TAP_DEV="${TAP_DEV:-tap0}"
 GUEST_NETWORK="172.16.0.0/24"
+# Pool de rede do nano-lambda-network.py --net-pool (net_pool.py)
+POOL_PREFIX="${POOL_PREFIX:-fctap}"
+POOL_SUBNET="${POOL_SUBNET:-172.16.128.0/17}"
 
 echo "Limpando configuracao de rede Firecracker"
 echo
@@ -61,6 +64,20 @@ else
     iptables -D FORWARD -i "${TAP_DEV}" -d 10.0.0.0/8 -j DROP 2>/dev/null || true
     iptables -D FORWARD -i "${TAP_DEV}" -d 172.16.0.0/12 -j DROP 2>/dev/null || true
     iptables -D FORWARD -i "${TAP_DEV}" -d 192.168.0.0/16 -j DROP 2>/dev/null || true
+
+    # Remove regras do pool de rede
+    iptables -t nat -D POSTROUTING -s "${POOL_SUBNET}" -o "${DEFAULT_IFACE}" -j MASQUERADE 2>/dev/null || true
+    iptables -D FORWARD -i "${POOL_PREFIX}+" -o "${POOL_PREFIX}+" -j DROP 2>/dev/null || true
+    iptables -D FORWARD -i "${POOL_PREFIX}+" -o "${DEFAULT_IFACE}" -j ACCEPT 2>/dev/null || true
+    iptables -D FORWARD -i "${DEFAULT_IFACE}" -o "${POOL_PREFIX}+" -m state --state RELATED,ESTABLISHED -j ACCEPT 2>/dev/null || true
+
+    # Remove as chains proprias do host_net.py (tap0 e pool)
+    for chain in NANOLAMBDA-TAP0 NANOLAMBDA-POOL; do
+        iptables -D FORWARD -j "${chain}" 2>/dev/null || true
+        iptables -F "${chain}" 2>/dev/null && iptables -X "${chain}" || true
+        iptables -t nat -D POSTROUTING -j "${chain}" 2>/dev/null || true
+        iptables -t nat -F "${chain}" 2>/dev/null && iptables -t nat -X "${chain}" || true
+    done
 fi
 
 echo "[2/3] Removendo interface TAP..."
@@ -71,6 +88,11 @@ if ip link show "${TAP_DEV}" &>/dev/null; then
 else
     echo "      ${TAP_DEV} nao existe"
 fi
+for tap in /sys/class/net/${POOL_PREFIX}*; do
+    [ -e "${tap}" ] || continue
+    ip link del "$(basename "${tap}")"
+    echo "      $(basename "${tap}") removida (pool de rede)"
+done
 
 echo "[3/3] Verificando IP forwarding..."
 echo "      IP forwarding mantido (pode afetar outras VMs)"
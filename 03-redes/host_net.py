@@ -0,0 +1,247 @@
+"""
+host_net.py - Rede do host sem um subprocesso por passo
+
+O caminho original configura a rede com `ip tuntap`, `ip addr`, `ip link`,
+`sysctl`, `ip route` e dois `iptables` (-C e -A) por regra: uma duzia de
+processos, e criar processo e uma parte mensuravel da latencia. Aqui:
+
+- TAP: ioctl TUNSETIFF + TUNSETPERSIST no /dev/net/tun (o que o
+  `ip tuntap add` faz por baixo)
+- link, endereco e rota default: mensagens rtnetlink num socket
+  AF_NETLINK (RTM_NEWLINK, RTM_NEWADDR com NLM_F_REPLACE, RTM_GETROUTE)
+- ip_forward: escrita em /proc/sys
+- NAT e forward: uma chain propria por tabela, reescrita inteira num
+  unico `iptables-restore --noflush` (atomico). Um `iptables-save` antes
+  diz se o salto para a chain ja existe; rodar de novo so reescreve a
+  chain (idempotente, sem duplicar regras)
+
+Uso:
+    with Rtnetlink() as nl:
+        create_tap("fctap0")
+        nl.replace_addr("fctap0", "172.16.128.1", 30)
+        nl.set_up("fctap0")
+        output_iface = nl.default_interface()
+    enable_ip_forward()
+    apply_rules("NANOLAMBDA-POOL", filter_rules, nat_rules)
+"""
+
+import fcntl
+import os
+import socket
+import struct
+import subprocess
+
+# linux/rtnetlink.h, linux/netlink.h
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_GETROUTE = 26
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_CREATE = 0x400
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTA_OIF = 4
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+IFF_UP = 0x1
+
+# linux/if_tun.h
+TUNSETIFF = 0x400454CA
+TUNSETPERSIST = 0x400454CB
+IFF_TAP = 0x0002
+IFF_NO_PI = 0x1000
+
+_NLMSGHDR = struct.Struct("=IHHII")     # len, type, flags, seq, pid
+_IFINFOMSG = struct.Struct("=BxHiII")   # family, type, index, flags, change
+_IFADDRMSG = struct.Struct("=BBBBI")    # family, prefixlen, flags, scope, index
+_RTMSG = struct.Struct("=BBBBBBBBI")    # family, dst_len, src_len, tos, table, ...
+_RTATTR = struct.Struct("=HH")          # len, type
+
+
+def _attr(kind, payload):
+    data = _RTATTR.pack(_RTATTR.size + len(payload), kind) + payload
+    return data + b"\0" * (-len(data) % 4)
+
+
+def _attrs(data):
+    """Itera (tipo, payload) dos rtattr de uma mensagem."""
+    offset = 0
+    while offset + _RTATTR.size <= len(data):
+        length, kind = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            return
+        yield kind, data[offset + _RTATTR.size:offset + length]
+        offset += (length + 3) & ~3
+
+
+class Rtnetlink:
+    """Socket rtnetlink com requisicoes sincronas (uma por vez, com ACK)."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self._seq = 0
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, msg_type, flags, body):
+        """Manda uma mensagem e devolve as respostas (ate o ACK ou NLMSG_DONE)."""
+        self._seq += 1
+        seq = self._seq
+        header = _NLMSGHDR.pack(_NLMSGHDR.size + len(body), msg_type,
+                                NLM_F_REQUEST | flags, seq, 0)
+        self.sock.send(header + body)
+        replies = []
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, kind, _, reply_seq, _ = _NLMSGHDR.unpack_from(data, offset)
+                payload = data[offset + _NLMSGHDR.size:offset + length]
+                offset += (length + 3) & ~3
+                if reply_seq != seq:
+                    continue
+                if kind == NLMSG_DONE:
+                    return replies
+                if kind == NLMSG_ERROR:
+                    code = -struct.unpack_from("=i", payload)[0]
+                    if code:
+                        raise OSError(code, os.strerror(code))
+                    return replies
+                replies.append((kind, payload))
+
+    def set_up(self, ifname):
+        """ip link set <ifname> up"""
+        index = socket.if_nametoindex(ifname)
+        self._request(RTM_NEWLINK, NLM_F_ACK,
+                      _IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, IFF_UP, IFF_UP))
+
+    def delete_link(self, ifname):
+        """ip link del <ifname> (sem erro se nao existir)"""
+        try:
+            index = socket.if_nametoindex(ifname)
+        except OSError:
+            return False
+        self._request(RTM_DELLINK, NLM_F_ACK, _IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, 0, 0))
+        return True
+
+    def replace_addr(self, ifname, address, prefixlen):
+        """ip addr replace <address>/<prefixlen> dev <ifname>"""
+        index = socket.if_nametoindex(ifname)
+        packed = socket.inet_aton(address)
+        body = (_IFADDRMSG.pack(socket.AF_INET, prefixlen, 0, 0, index)
+                + _attr(IFA_LOCAL, packed) + _attr(IFA_ADDRESS, packed))
+        self._request(RTM_NEWADDR, NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE, body)
+
+    def default_interface(self):
+        """Interface da rota default (tabela main) do host."""
+        replies = self._request(RTM_GETROUTE, NLM_F_DUMP,
+                                _RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0))
+        for _, payload in replies:
+            _, dst_len, _, _, table, _, _, _, _ = _RTMSG.unpack_from(payload)
+            attrs = dict(_attrs(payload[_RTMSG.size:]))
+            if RTA_TABLE in attrs:
+                table = struct.unpack("=I", attrs[RTA_TABLE])[0]
+            if dst_len == 0 and table == RT_TABLE_MAIN and RTA_OIF in attrs:
+                return socket.if_indextoname(struct.unpack("=i", attrs[RTA_OIF])[0])
+        raise Exception("Nao foi possivel detectar interface de saida")
+
+
+def create_tap(ifname):
+    """ip tuntap add dev <ifname> mode tap (sem erro se ja existir)."""
+    if os.path.exists(f"/sys/class/net/{ifname}"):
+        return False
+    fd = os.open("/dev/net/tun", os.O_RDWR)
+    try:
+        fcntl.ioctl(fd, TUNSETIFF, struct.pack("16sH22x", ifname.encode(), IFF_TAP | IFF_NO_PI))
+        fcntl.ioctl(fd, TUNSETPERSIST, 1)
+    finally:
+        os.close(fd)
+    return True
+
+
+def enable_ip_forward():
+    """sysctl -w net.ipv4.ip_forward=1"""
+    with open("/proc/sys/net/ipv4/ip_forward", "r+") as f:
+        if f.read().strip() != "1":
+            f.seek(0)
+            f.write("1")
+
+
+def _iptables_save():
+    return subprocess.run(["iptables-save"], check=True, capture_output=True, text=True).stdout
+
+
+def _tables(saved):
+    """Saida do iptables-save -> {tabela: linhas}."""
+    tables, current = {}, None
+    for line in saved.splitlines():
+        if line.startswith("*"):
+            current = tables.setdefault(line[1:], [])
+        elif current is not None:
+            current.append(line)
+    return tables
+
+
+def _has_chain(lines, chain):
+    return any(line.startswith(f":{chain} ") for line in lines)
+
+
+def _has_jump(lines, parent, chain):
+    return any(line.split() == ["-A", parent, "-j", chain] for line in lines)
+
+
+# Chain de cada tabela que recebe o salto para a chain propria
+_PARENTS = {"filter": "FORWARD", "nat": "POSTROUTING"}
+
+
+def apply_rules(chain, filter_rules, nat_rules):
+    """
+    Instala as regras numa chain `chain` propria em cada tabela, num
+    iptables-restore so. Declarar a chain no restore a esvazia: rodar
+    de novo substitui as regras em vez de duplicar. O salto a partir de
+    FORWARD/POSTROUTING e inserido no topo so quando ainda nao existe.
+    """
+    saved = _tables(_iptables_save())
+    lines = []
+    for table, rules in (("filter", filter_rules), ("nat", nat_rules)):
+        if not rules:
+            continue
+        parent = _PARENTS[table]
+        lines += [f"*{table}", f":{chain} - [0:0]"]
+        lines += [f"-A {chain} {rule}" for rule in rules]
+        if not _has_jump(saved.get(table, []), parent, chain):
+            lines.append(f"-I {parent} -j {chain}")
+        lines.append("COMMIT")
+    subprocess.run(["iptables-restore", "--noflush"], input="\n".join(lines) + "\n",
+                   check=True, capture_output=True, text=True)
+
+
+def remove_rules(chain):
+    """Tira o salto e apaga a chain nas duas tabelas (num restore so)."""
+    saved = _tables(_iptables_save())
+    lines = []
+    for table, parent in _PARENTS.items():
+        current = saved.get(table, [])
+        if not _has_chain(current, chain):
+            continue
+        lines.append(f"*{table}")
+        if _has_jump(current, parent, chain):
+            lines.append(f"-D {parent} -j {chain}")
+        lines += [f"-F {chain}", f"-X {chain}", "COMMIT"]
+    if lines:
+        subprocess.run(["iptables-restore", "--noflush"], input="\n".join(lines) + "\n",
+                       check=True, capture_output=True, text=True)
+
@@ -5,37 +5,56 @@ nano-Lambda com suporte a rede
 Executa funcoes Python em microVMs isoladas com acesso a internet.
 
 Uso:
-    sudo python3 nano-lambda-network.py <funcao.py> <input>
+    sudo python3 nano-lambda-network.py <funcao.py> <input> [input...]
 
 Exemplo:
     sudo python3 nano-lambda-network.py exemplo-validador/handler.py "https://google.com,https://github.com"
 
+    # Varias VMs com rede ao mesmo tempo: uma TAP e uma /30 por VM (net_pool.py)
+    sudo python3 nano-lambda-network.py --net-pool 4 exemplo-validador/handler.py "https://a.com" "https://b.com"
+
 Requer execucao como root (para montar rootfs, configurar rede e executar Firecracker).
 """
 
+import argparse
 import subprocess
-import requests_unixsocket
-import time
 import shutil
 import tempfile
 import json
 import signal
 import sys
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Reaproveita a camada de clonagem de rootfs do nano-Lambda (artigo 02)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "02-nano-lambda"))
+from console_parser import ConsoleParser
+from fc_client import FirecrackerClient
+from qos import QOS_PROFILE, QOS_PROFILES, drive_limiter, get_profile, net_limiters, qos_calls
+from rootfs_clone import clone_rootfs
+from vm_wait import VmWatcher, wait_for_socket
+
+import host_net
+from net_pool import NET_POOL_SIZE, NetworkPool, benchmark, print_benchmark
 
 # Configuracoes
 FIRECRACKER_BIN = "./firecracker"
 KERNEL_PATH = "./vmlinux.bin"
 ROOTFS_TEMPLATE = "./rootfs-network.ext4"
-SOCKET_PATH = "/tmp/firecracker-nanolambda.socket"
+ROOTFS_CLONE_BACKEND = "auto"  # auto, reflink, sparse ou dm-snapshot
+SOCKET_DIR = "/tmp"
+BOOT_ARGS = "console=ttyS0 reboot=k panic=1 pci=off quiet"
 VCPU_COUNT = 1
 MEM_SIZE_MIB = 256
 
-# Configuracoes de rede
+# Configuracoes de rede (sem --net-pool: uma TAP so, do setup-network.sh)
 TAP_DEV = "tap0"
 TAP_IP = "172.16.0.1"
 GUEST_IP = "172.16.0.2"
 GUEST_MAC = "AA:FC:00:00:00:01"
+TAP_CHAIN = "NANOLAMBDA-TAP0"
 
 
 class NanoLambdaNetwork:
@@ -43,123 +62,84 @@ class NanoLambdaNetwork:
     Gerencia o ciclo de vida de uma execucao Lambda-style com rede.
     """
 
-    def __init__(self):
-        self.socket_path = SOCKET_PATH
+    def __init__(self, net_pool=None, vm_id=None, qos=QOS_PROFILE):
+        # Socket por VM: varias VMs do pool de rede rodam ao mesmo tempo
+        self.vm_id = vm_id or uuid.uuid4().hex[:12]
+        self.socket_path = os.path.join(SOCKET_DIR, f"firecracker-nanolambda-net-{self.vm_id}.socket")
+        # Com pool cada VM pega uma TAP/30 propria; sem pool usa a tap0
+        self.net_pool = net_pool
+        self.net = None
         self.fc_process = None
         self.temp_rootfs = None
-        self.output_file = "/tmp/firecracker-output.log"
+        self.rootfs_clone = None
+        self.timings = {}
+        self.console = ConsoleParser()
         self.network_configured = False
-
-    def _api_url(self, path):
-        """Converte path para URL do socket Unix."""
-        encoded_socket = self.socket_path.replace("/", "%2F")
-        return f"http+unix://{encoded_socket}{path}"
+        self.api_client = None
+        # Limites de disco e rede da VM (qos.py do artigo 02)
+        get_profile(qos)
+        self.qos_profile = qos
+        self.running = False
 
     def _call_api(self, method, path, data=None):
-        """Faz chamada para a API REST do Firecracker via socket Unix."""
-        session = requests_unixsocket.Session()
-        url = self._api_url(path)
-
-        if method == "PUT":
-            resp = session.put(url, json=data)
-        elif method == "GET":
-            resp = session.get(url)
-        else:
-            raise ValueError(f"Metodo nao suportado: {method}")
-
-        if resp.status_code >= 400:
-            raise Exception(f"API error {resp.status_code}: {resp.text}")
-
-        return resp
-
-    def _check_iptables_rule(self, args):
-        """Verifica se uma regra iptables ja existe (-C = check)."""
-        result = subprocess.run(
-            ["iptables"] + args,
-            capture_output=True
-        )
-        return result.returncode == 0
+        """
+        Faz chamada para a API REST do Firecracker via socket Unix.
 
-    def _add_iptables_rule_if_missing(self, check_args, add_args):
-        """Adiciona regra iptables apenas se nao existir."""
-        if not self._check_iptables_rule(check_args):
-            subprocess.run(["iptables"] + add_args, check=False)
+        Usa uma unica conexao HTTP/1.1 persistente por VM (fc_client.py).
+        """
+        if self.api_client is None:
+            self.api_client = FirecrackerClient(self.socket_path)
+        return self.api_client.request(method, path, data)
 
     def setup_network(self):
-        """Configura interface TAP e NAT no host."""
-        # Verifica se ja foi configurado (evita duplicar regras)
+        """
+        Configura interface TAP e NAT no host (host_net.py: rtnetlink,
+        /proc/sys e um iptables-restore, sem um processo por passo).
+        """
+        # Verifica se ja foi configurado (evita refazer as regras)
         if os.path.exists(f"/sys/class/net/{TAP_DEV}"):
             print("[*] Rede ja configurada, verificando...")
-            subprocess.run(
-                ["ip", "link", "set", TAP_DEV, "up"],
-                check=False, capture_output=True
-            )
+            with host_net.Rtnetlink() as nl:
+                nl.set_up(TAP_DEV)
             self.network_configured = True
             return
 
         print("[*] Configurando rede do host...")
 
-        subprocess.run(
-            ["ip", "tuntap", "add", "dev", TAP_DEV, "mode", "tap"],
-            check=True
-        )
-
-        subprocess.run(
-            ["ip", "addr", "add", f"{TAP_IP}/24", "dev", TAP_DEV],
-            check=True
-        )
-        subprocess.run(
-            ["ip", "link", "set", TAP_DEV, "up"],
-            check=True
-        )
-
-        subprocess.run(
-            ["sysctl", "-w", "net.ipv4.ip_forward=1"],
-            check=True, capture_output=True
-        )
-
-        result = subprocess.run(
-            ["ip", "route", "show", "default"],
-            capture_output=True, text=True
-        )
-        if "dev " not in result.stdout:
-            raise Exception("Nao foi possivel detectar interface de saida")
-
-        output_iface = result.stdout.split("dev ")[1].split()[0]
+        host_net.create_tap(TAP_DEV)
+        with host_net.Rtnetlink() as nl:
+            nl.replace_addr(TAP_DEV, TAP_IP, 24)
+            nl.set_up(TAP_DEV)
+            output_iface = nl.default_interface()
+        host_net.enable_ip_forward()
         print(f"    Interface de saida: {output_iface}")
 
-        # Configura NAT (apenas se regra nao existir)
-        self._add_iptables_rule_if_missing(
-            ["-t", "nat", "-C", "POSTROUTING", "-o", output_iface, "-j", "MASQUERADE"],
-            ["-t", "nat", "-A", "POSTROUTING", "-o", output_iface, "-j", "MASQUERADE"]
-        )
-
-        # Permite forwarding TAP -> internet (apenas se regra nao existir)
-        self._add_iptables_rule_if_missing(
-            ["-C", "FORWARD", "-i", TAP_DEV, "-o", output_iface, "-j", "ACCEPT"],
-            ["-A", "FORWARD", "-i", TAP_DEV, "-o", output_iface, "-j", "ACCEPT"]
-        )
-
-        # Permite trafego de retorno (apenas se regra nao existir)
-        self._add_iptables_rule_if_missing(
-            ["-C", "FORWARD", "-i", output_iface, "-o", TAP_DEV,
-             "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"],
-            ["-A", "FORWARD", "-i", output_iface, "-o", TAP_DEV,
-             "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"]
-        )
+        # NAT e forward TAP <-> internet numa chain propria, num restore so
+        host_net.apply_rules(TAP_CHAIN, [
+            f"-i {TAP_DEV} -o {output_iface} -j ACCEPT",
+            f"-i {output_iface} -o {TAP_DEV} -m state --state RELATED,ESTABLISHED -j ACCEPT",
+        ], [
+            f"-o {output_iface} -j MASQUERADE",
+        ])
 
         self.network_configured = True
         print("    Rede configurada")
 
+    def lease_network(self):
+        """Pega uma TAP do pool (ja criada e configurada no setup do pool)."""
+        start = time.time()
+        self.net = self.net_pool.lease()
+        self.timings["network"] = time.time() - start
+        print(f"[*] Rede: {self.net.tap} (guest {self.net.guest_ip})")
+
     def prepare_rootfs(self, function_path, input_data):
         """Prepara o rootfs com a funcao e input."""
-        self.temp_rootfs = tempfile.NamedTemporaryFile(
-            suffix='.ext4',
-            delete=False
-        ).name
-
-        print(f"[*] Copiando rootfs template...")
-        shutil.copy(ROOTFS_TEMPLATE, self.temp_rootfs)
+        print(f"[*] Clonando rootfs template...")
+        self.rootfs_clone = clone_rootfs(ROOTFS_TEMPLATE, backend=ROOTFS_CLONE_BACKEND)
+        self.temp_rootfs = self.rootfs_clone.path
+        self.timings["clone"] = self.rootfs_clone.elapsed
+        print(f"    Rootfs clonado via {self.rootfs_clone.backend} "
+              f"({self.rootfs_clone.elapsed:.3f}s)")
 
         mount_point = tempfile.mkdtemp()
 
@@ -187,42 +167,40 @@ class NanoLambdaNetwork:
         if os.path.exists(self.socket_path):
             os.remove(self.socket_path)
 
-        if os.path.exists(self.output_file):
-            os.remove(self.output_file)
-
         print("[*] Iniciando Firecracker...")
 
-        self.output_handle = open(self.output_file, 'w')
         self.fc_process = subprocess.Popen(
             [FIRECRACKER_BIN, "--api-sock", self.socket_path],
-            stdout=self.output_handle,
+            stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT
         )
 
-        for _ in range(50):
-            if os.path.exists(self.socket_path):
-                break
-            time.sleep(0.1)
-        else:
-            raise Exception("Timeout esperando socket do Firecracker")
-
-        time.sleep(0.2)
+        # Espera o socket aceitar conexoes (sem sleep fixo)
+        wait_for_socket(self.socket_path).close()
 
     def configure_vm(self):
         """Configura a microVM via API REST."""
         print(f"[*] Configurando kernel...")
+        boot_args = BOOT_ARGS
+        if self.net:
+            # IP do guest pela linha de comando do kernel (ver net_pool.py)
+            boot_args = f"{boot_args} {self.net.boot_arg()}"
         self._call_api("PUT", "/boot-source", {
             "kernel_image_path": KERNEL_PATH,
-            "boot_args": "console=ttyS0 reboot=k panic=1 pci=off quiet"
+            "boot_args": boot_args
         })
 
         print(f"[*] Configurando rootfs...")
-        self._call_api("PUT", "/drives/rootfs", {
+        drive = {
             "drive_id": "rootfs",
             "path_on_host": self.temp_rootfs,
             "is_root_device": True,
             "is_read_only": False
-        })
+        }
+        limiter = drive_limiter(self.qos_profile)
+        if limiter:
+            drive["rate_limiter"] = limiter
+        self._call_api("PUT", "/drives/rootfs", drive)
 
         print(f"[*] Configurando recursos ({VCPU_COUNT} vCPU, {MEM_SIZE_MIB}MB RAM)...")
         self._call_api("PUT", "/machine-config", {
@@ -233,25 +211,51 @@ class NanoLambdaNetwork:
         print(f"[*] Configurando rede da VM...")
         self._call_api("PUT", "/network-interfaces/eth0", {
             "iface_id": "eth0",
-            "guest_mac": GUEST_MAC,
-            "host_dev_name": TAP_DEV
+            "guest_mac": self.net.mac if self.net else GUEST_MAC,
+            "host_dev_name": self.net.tap if self.net else TAP_DEV,
+            **net_limiters(self.qos_profile)
         })
 
+    def set_qos(self, profile):
+        """
+        Troca o perfil de QoS; com a VM rodando aplica na hora (PATCH do
+        drive e da eth0, numa conexao propria).
+        """
+        get_profile(profile)
+        self.qos_profile = profile
+        if not self.running:
+            return
+        print(f"[*] QoS ao vivo: perfil {profile}")
+        client = FirecrackerClient(self.socket_path)
+        try:
+            for method, path, data in qos_calls(profile, ["rootfs"], ["eth0"]):
+                client.request(method, path, data)
+        finally:
+            client.close()
+
     def run_vm(self, timeout=60):
-        """Inicia a VM e aguarda a execucao."""
+        """
+        Inicia a VM e aguarda a execucao.
+
+        O console e lido do pipe pelo parser incremental
+        (console_parser.py do artigo 02), sem arquivo temporario.
+        """
         print(f"[*] Iniciando microVM...")
         self._call_api("PUT", "/actions", {"action_type": "InstanceStart"})
+        self.running = True
 
         print(f"[*] Aguardando execucao (timeout: {timeout}s)...")
 
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if self.fc_process.poll() is not None:
-                break
-            time.sleep(0.5)
-
-        self.output_handle.close()
+        # Termina quando o processo sai ou o guest avisa que acabou
+        watcher = VmWatcher(self.fc_process, self.fc_process.stdout,
+                            self.console.feed)
+        reason = watcher.wait(timeout)
+        if reason == "marker":
+            print(f"[*] Funcao finalizada, encerrando microVM...")
+        elif reason == "timeout":
+            print(f"[!] Timeout apos {timeout}s")
 
+        self.running = False
         if self.fc_process.poll() is None:
             self.fc_process.terminate()
             try:
@@ -260,20 +264,16 @@ class NanoLambdaNetwork:
                 self.fc_process.kill()
                 self.fc_process.wait()
 
-        if os.path.exists(self.output_file):
-            with open(self.output_file, 'r') as f:
-                output = f.read()
-        else:
-            output = ""
-
-        return output
+        return self.console
 
     def cleanup(self):
         """Remove recursos temporarios."""
         print(f"[*] Limpando...")
+        self.running = False
 
-        if hasattr(self, 'output_handle') and not self.output_handle.closed:
-            self.output_handle.close()
+        if self.api_client:
+            self.api_client.close()
+            self.api_client = None
 
         if self.fc_process and self.fc_process.poll() is None:
             self.fc_process.terminate()
@@ -282,73 +282,104 @@ class NanoLambdaNetwork:
             except subprocess.TimeoutExpired:
                 self.fc_process.kill()
 
-        if self.temp_rootfs and os.path.exists(self.temp_rootfs):
-            os.remove(self.temp_rootfs)
+        if self.fc_process and self.fc_process.stdout:
+            self.fc_process.stdout.close()
+
+        if self.rootfs_clone:
+            self.rootfs_clone.release()
+            self.rootfs_clone = None
+
+        # A TAP volta para o pool (continua criada)
+        if self.net:
+            self.net_pool.release(self.net)
+            self.net = None
 
         if os.path.exists(self.socket_path):
             os.remove(self.socket_path)
 
-        if os.path.exists(self.output_file):
-            os.remove(self.output_file)
-
     def invoke(self, function_path, input_data):
         """Invoca uma funcao Lambda-style com rede."""
         try:
-            self.setup_network()
+            if self.net_pool:
+                self.lease_network()
+            else:
+                start = time.time()
+                self.setup_network()
+                self.timings["network"] = time.time() - start
             self.prepare_rootfs(function_path, input_data)
             self.start_firecracker()
             self.configure_vm()
-            output = self.run_vm()
-            return self.parse_output(output)
+            console = self.run_vm()
+            result = console.result()
+            result["timings"] = dict(self.timings)
+            return result
         finally:
             self.cleanup()
 
     def parse_output(self, raw_output):
-        """Extrai resultado do output bruto."""
-        if "JSON_RESULT_START" in raw_output and "JSON_RESULT_END" in raw_output:
-            start = raw_output.find("JSON_RESULT_START") + len("JSON_RESULT_START")
-            end = raw_output.find("JSON_RESULT_END")
-            json_data = raw_output[start:end].strip()
-            try:
-                return {
-                    "success": True,
-                    "type": "json",
-                    "data": json.loads(json_data)
-                }
-            except json.JSONDecodeError:
-                pass
-
-        # Procura pelo marcador de imagem base64
-        if "BASE64_IMAGE_START" in raw_output and "BASE64_IMAGE_END" in raw_output:
-            start = raw_output.find("BASE64_IMAGE_START") + len("BASE64_IMAGE_START")
-            end = raw_output.find("BASE64_IMAGE_END")
-            base64_data = raw_output[start:end].strip()
-            return {
-                "success": True,
-                "type": "image",
-                "data": base64_data
-            }
-
-        return {
-            "success": False,
-            "type": "text",
-            "data": raw_output
-        }
+        """Extrai resultado de um output bruto ja completo."""
+        parser = ConsoleParser()
+        parser.feed(raw_output.encode("utf-8"))
+        return parser.result()
+
+
+def print_result(result, output_file="resultado.png"):
+    """Mostra o resultado de uma invocacao (salva imagens em disco)."""
+    if result["success"] and result["type"] == "json":
+        print(json.dumps(result["data"], indent=2))
+    elif result["success"] and result["type"] == "image":
+        img_data = result["data"]
+        with open(output_file, "wb") as f:
+            f.write(img_data)
+        print(f"Imagem salva em: {output_file}")
+        print(f"Tamanho: {len(img_data)} bytes")
+    else:
+        print("Output bruto da VM:")
+        print(result["data"])
+
+    if "network" in result["timings"]:
+        print(f"\nRede da invocacao: {result['timings']['network'] * 1000:.2f}ms")
+    if "clone" in result["timings"]:
+        print(f"Clone do rootfs: {result['timings']['clone']:.3f}s")
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="nano-Lambda Network: funcoes em microVMs com internet"
+    )
+    parser.add_argument("function_path", metavar="funcao.py", nargs="?")
+    parser.add_argument("inputs", metavar="input", nargs="*")
+    parser.add_argument(
+        "--net-pool", type=int, default=0, metavar="N",
+        help="cria N TAPs com /30 proprias e roda os inputs em paralelo (ver net_pool.py)"
+    )
+    parser.add_argument(
+        "--qos", default=QOS_PROFILE, choices=sorted(QOS_PROFILES), metavar="PERFIL",
+        help="limites de disco e rede de cada VM (ver qos.py do artigo 02)"
+    )
+    parser.add_argument(
+        "--net-benchmark", type=int, default=0, metavar="N",
+        help="mede N vezes o setup de rede (netlink x subprocess) e sai"
+    )
+
     if os.geteuid() != 0:
         print("Erro: Este script precisa ser executado como root.")
         print("Uso: sudo python3 nano-lambda-network.py <funcao.py> <input>")
         sys.exit(1)
 
-    if len(sys.argv) < 3:
+    args = parser.parse_args()
+
+    if args.net_benchmark > 0:
+        print_benchmark(benchmark(size=args.net_pool or NET_POOL_SIZE, iterations=args.net_benchmark))
+        return
+
+    if not args.inputs:
         print("Uso: sudo python3 nano-lambda-network.py <funcao.py> <input>")
         print("Exemplo: sudo python3 nano-lambda-network.py exemplo-validador/handler.py 'https://google.com,https://github.com'")
         sys.exit(1)
 
-    function_path = sys.argv[1]
-    input_data = sys.argv[2]
+    function_path = args.function_path
+    inputs = args.inputs
 
     if not os.path.exists(function_path):
         print(f"Erro: funcao nao encontrada: {function_path}")
@@ -364,39 +395,46 @@ def main():
     print("nano-Lambda Network: Funcao em microVM com internet")
     print("=" * 50)
     print(f"Funcao: {function_path}")
-    print(f"Input: {input_data[:50]}..." if len(input_data) > 50 else f"Input: {input_data}")
+    for input_data in inputs:
+        print(f"Input: {input_data[:50]}..." if len(input_data) > 50 else f"Input: {input_data}")
     print()
 
-    lambda_runner = NanoLambdaNetwork()
+    # Pool de rede: TAPs, enderecos e NAT criados uma vez, fora das invocacoes
+    net_pool = None
+    if args.net_pool > 0:
+        net_pool = NetworkPool(size=args.net_pool)
+        start = time.time()
+        net_pool.setup()
+        print(f"[*] Pool de rede: {args.net_pool} TAPs prontas ({time.time() - start:.3f}s)")
+    elif len(inputs) > 1:
+        print("[!] Sem --net-pool os inputs rodam um de cada vez (uma TAP so)")
+
+    runners = []
 
     def signal_handler(signum, frame):
         print("\n[!] Interrompido pelo usuario. Limpando recursos...")
-        lambda_runner.cleanup()
+        for runner in runners:
+            runner.cleanup()
         sys.exit(130)
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    result = lambda_runner.invoke(function_path, input_data)
-
-    print()
-    print("=" * 50)
-    print("Resultado:")
-    print("=" * 50)
-
-    if result["success"] and result["type"] == "json":
-        print(json.dumps(result["data"], indent=2))
-    elif result["success"] and result["type"] == "image":
-        import base64
-        output_file = "resultado.png"
-        img_data = base64.b64decode(result["data"])
-        with open(output_file, "wb") as f:
-            f.write(img_data)
-        print(f"Imagem salva em: {output_file}")
-        print(f"Tamanho: {len(img_data)} bytes")
-    else:
-        print("Output bruto da VM:")
-        print(result["data"])
+    def invoke(input_data):
+        runner = NanoLambdaNetwork(net_pool=net_pool, qos=args.qos)
+        runners.append(runner)
+        return runner.invoke(function_path, input_data)
+
+    workers = args.net_pool if net_pool else 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(invoke, inputs))
+
+    for i, result in enumerate(results):
+        print()
+        print("=" * 50)
+        print("Resultado:" if len(inputs) == 1 else f"Resultado [{i + 1}/{len(inputs)}]:")
+        print("=" * 50)
+        print_result(result, "resultado.png" if len(inputs) == 1 else f"resultado-{i + 1}.png")
 
 
 if __name__ == "__main__":
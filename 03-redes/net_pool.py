@@ -0,0 +1,254 @@
+"""
+net_pool.py - Pool de interfaces TAP e enderecos para VMs com rede
+
+Com uma TAP so (tap0, 172.16.0.2 fixo no guest) apenas uma VM com rede
+roda por vez: o Firecracker abre a TAP em modo exclusivo. O pool cria
+N TAPs uma vez e da a cada uma a sua /30 e o seu MAC:
+
+    fctap0   host 172.16.128.1/30   guest 172.16.128.2   AA:FC:AC:10:80:02
+    fctap1   host 172.16.128.5/30   guest 172.16.128.6   AA:FC:AC:10:80:06
+    ...
+
+As regras de NAT/forward usam o curinga do iptables (fctap+): valem para
+todas as TAPs do pool, inclusive as criadas depois. VMs do pool nao
+falam entre si (forward fctap+ -> fctap+ descartado).
+
+A invocacao so pega um slot livre (lease, O(1)) e passa o IP para o
+guest pelos boot args (ip=, autoconfiguracao do kernel; o
+/run-function.sh le o mesmo parametro se o kernel nao tiver IP_PNP).
+Um flock por slot impede que dois processos usem a mesma TAP.
+
+O setup usa o host_net.py (rtnetlink, /proc/sys e um iptables-restore
+so). O caminho antigo, um `ip`/`sysctl`/`iptables` por passo, continua
+como backend "subprocess" para comparacao (benchmark()).
+
+Uso:
+    pool = NetworkPool(size=4)
+    pool.setup()          # uma vez (idempotente)
+    slot = pool.lease()
+    ...  # network-interfaces com slot.tap/slot.mac, boot args + slot.boot_arg()
+    pool.release(slot)
+"""
+
+import collections
+import fcntl
+import ipaddress
+import os
+import statistics
+import subprocess
+import threading
+import time
+
+import host_net
+
+NET_POOL_SIZE = 4
+# Fora da 172.16.0.0/24 da tap0 do setup-network.sh
+NET_POOL_SUBNET = "172.16.128.0/17"
+NET_POOL_PREFIX = "fctap"
+NET_POOL_LOCK_DIR = "/tmp/nano-lambda-net"
+# Chain propria (filter e nat) com as regras do pool no backend netlink
+NET_POOL_CHAIN = "NANOLAMBDA-POOL"
+NET_BACKENDS = ("netlink", "subprocess")
+LEASE_RETRY = 0.05
+
+
+class NetSlot:
+    """Uma TAP do pool com a /30 e o MAC do guest."""
+
+    def __init__(self, index, subnet=NET_POOL_SUBNET, prefix=NET_POOL_PREFIX):
+        network = ipaddress.ip_network(subnet)
+        base = network.network_address + index * 4
+        if base + 3 > network.broadcast_address:
+            raise ValueError(f"slot {index} fora de {subnet}")
+        self.index = index
+        self.tap = f"{prefix}{index}"
+        self.network = ipaddress.ip_network(f"{base}/30")
+        self.host_ip = str(base + 1)
+        self.guest_ip = str(base + 2)
+        self.netmask = str(self.network.netmask)
+        self.mac = "AA:FC:" + ":".join(f"{b:02X}" for b in (base + 2).packed)
+        self._lock_file = None
+
+    def boot_arg(self):
+        """Parametro ip= do kernel: <guest>::<gateway>:<mascara>::eth0:off."""
+        return f"ip={self.guest_ip}::{self.host_ip}:{self.netmask}::eth0:off"
+
+
+def _run(args, check=True):
+    return subprocess.run(args, check=check, capture_output=True, text=True)
+
+
+def default_interface():
+    """Interface da rota default do host."""
+    result = _run(["ip", "route", "show", "default"], check=False)
+    if "dev " not in result.stdout:
+        raise Exception("Nao foi possivel detectar interface de saida")
+    return result.stdout.split("dev ")[1].split()[0]
+
+
+def ensure_iptables_rule(rule):
+    """Adiciona `rule` (argumentos depois do -A/-C) se ainda nao existir."""
+    table = []
+    if rule[0] == "-t":
+        table, rule = rule[:2], rule[2:]
+    if _run(["iptables", *table, "-C", *rule], check=False).returncode != 0:
+        _run(["iptables", *table, "-A", *rule])
+
+
+class NetworkPool:
+    """
+    `size` TAPs pre-criadas, cada uma com a sua /30.
+
+    lease() e release() sao O(1): uma fila de slots livres no processo e
+    um flock por slot entre processos (pula o slot se outro processo
+    estiver com ele).
+    """
+
+    def __init__(self, size=NET_POOL_SIZE, subnet=NET_POOL_SUBNET, prefix=NET_POOL_PREFIX,
+                 lock_dir=NET_POOL_LOCK_DIR, chain=NET_POOL_CHAIN, backend="netlink"):
+        if backend not in NET_BACKENDS:
+            raise ValueError(f"backend de rede desconhecido: {backend}")
+        self.slots = [NetSlot(i, subnet, prefix) for i in range(size)]
+        self.subnet = subnet
+        self.prefix = prefix
+        self.lock_dir = lock_dir
+        self.chain = chain
+        self.backend = backend
+        self._free = collections.deque(self.slots)
+        self._cond = threading.Condition()
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def rules(self, output_iface):
+        """Regras de NAT e forward das TAPs do pool (curinga <prefix>+), backend subprocess."""
+        taps = f"{self.prefix}+"
+        return [
+            ["-t", "nat", "POSTROUTING", "-s", self.subnet, "-o", output_iface, "-j", "MASQUERADE"],
+            ["FORWARD", "-i", taps, "-o", taps, "-j", "DROP"],
+            ["FORWARD", "-i", taps, "-o", output_iface, "-j", "ACCEPT"],
+            ["FORWARD", "-i", output_iface, "-o", taps,
+             "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"],
+        ]
+
+    def chain_rules(self, output_iface):
+        """As mesmas regras de rules(), como linhas da chain propria (filter, nat)."""
+        taps = f"{self.prefix}+"
+        filter_rules = [
+            f"-i {taps} -o {taps} -j DROP",
+            f"-i {taps} -o {output_iface} -j ACCEPT",
+            f"-i {output_iface} -o {taps} -m state --state RELATED,ESTABLISHED -j ACCEPT",
+        ]
+        nat_rules = [f"-s {self.subnet} -o {output_iface} -j MASQUERADE"]
+        return filter_rules, nat_rules
+
+    def setup(self):
+        """Cria as TAPs que faltam, enderecos, forwarding e NAT (idempotente)."""
+        if self.backend == "subprocess":
+            return self._setup_subprocess()
+        with host_net.Rtnetlink() as nl:
+            for slot in self.slots:
+                host_net.create_tap(slot.tap)
+                nl.replace_addr(slot.tap, slot.host_ip, 30)
+                nl.set_up(slot.tap)
+            output_iface = nl.default_interface()
+        host_net.enable_ip_forward()
+        host_net.apply_rules(self.chain, *self.chain_rules(output_iface))
+
+    def _setup_subprocess(self):
+        for slot in self.slots:
+            if not os.path.exists(f"/sys/class/net/{slot.tap}"):
+                _run(["ip", "tuntap", "add", "dev", slot.tap, "mode", "tap"])
+            _run(["ip", "addr", "replace", f"{slot.host_ip}/30", "dev", slot.tap])
+            _run(["ip", "link", "set", slot.tap, "up"])
+        _run(["sysctl", "-w", "net.ipv4.ip_forward=1"])
+        for rule in self.rules(default_interface()):
+            ensure_iptables_rule(rule)
+
+    def teardown(self):
+        """Remove as TAPs e as regras do pool."""
+        if self.backend == "subprocess":
+            return self._teardown_subprocess()
+        host_net.remove_rules(self.chain)
+        with host_net.Rtnetlink() as nl:
+            for slot in self.slots:
+                nl.delete_link(slot.tap)
+
+    def _teardown_subprocess(self):
+        output_iface = default_interface()
+        for rule in self.rules(output_iface):
+            table = []
+            if rule[0] == "-t":
+                table, rule = rule[:2], rule[2:]
+            _run(["iptables", *table, "-D", *rule], check=False)
+        for slot in self.slots:
+            _run(["ip", "link", "del", slot.tap], check=False)
+
+    def lease(self, timeout=None):
+        """Pega um slot livre (espera ate `timeout` se todos estiverem em uso)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for _ in range(len(self._free)):
+                    slot = self._free.popleft()
+                    if self._try_lock(slot):
+                        return slot
+                    self._free.append(slot)  # em uso por outro processo
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("nenhuma TAP livre no pool de rede")
+                # Acorda num release deste processo ou tenta de novo os
+                # slots presos em outros processos
+                self._cond.wait(LEASE_RETRY if remaining is None else min(remaining, LEASE_RETRY))
+
+    def _try_lock(self, slot):
+        f = open(os.path.join(self.lock_dir, f"{slot.tap}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        slot._lock_file = f
+        return True
+
+    def release(self, slot):
+        """Devolve o slot (a TAP continua criada para a proxima invocacao)."""
+        if slot._lock_file:
+            fcntl.flock(slot._lock_file, fcntl.LOCK_UN)
+            slot._lock_file.close()
+            slot._lock_file = None
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify()
+
+
+def benchmark(size=NET_POOL_SIZE, iterations=10, backends=NET_BACKENDS):
+    """
+    Mede o setup de um pool de `size` TAPs em cada backend: "cold" parte
+    do zero (teardown antes) e "warm" roda de novo sobre o pool pronto
+    (o caminho idempotente). Usa TAPs, subnet e chain proprias, fora do
+    pool de verdade. Retorna {backend: {"cold": [s, ...], "warm": [...]}}.
+    """
+    results = {}
+    for backend in backends:
+        pool = NetworkPool(size=size, subnet="172.16.64.0/18", prefix="fcbench",
+                           chain="NANOLAMBDA-BENCH", backend=backend)
+        cold, warm = [], []
+        try:
+            for _ in range(iterations):
+                pool.teardown()
+                start = time.perf_counter()
+                pool.setup()
+                cold.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                pool.setup()
+                warm.append(time.perf_counter() - start)
+        finally:
+            pool.teardown()
+        results[backend] = {"cold": cold, "warm": warm}
+    return results
+
+
+def print_benchmark(results):
+    print(f"{'backend':<12} {'cold (mediana)':>15} {'warm (mediana)':>15}")
+    for backend, times in results.items():
+        print(f"{backend:<12} {statistics.median(times['cold']) * 1000:>13.2f}ms "
+              f"{statistics.median(times['warm']) * 1000:>13.2f}ms")
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+bench-phases.py - Benchmark por fase das engines do nano-Lambda
+
+O test-snapshot.py mede uma execucao de cada coisa. Aqui cada engine
+roda N vezes e cada invocacao e quebrada nas fases que o NanoLambda
+registra em result["timings"]:
+
+    clone      clone do rootfs template (ou do initrd)
+    prepare    clone + funcao e input entregues ao guest
+    spawn      processo Firecracker ate o socket da API aceitar conexoes
+    config     chamadas de API ate a VM estar pronta para o InstanceStart
+    restore    /snapshot/load + troca dos drives + resume (modo snapshot)
+    prefetch   parte do restore copiando o working set (--mem-backend Uffd)
+    boot       InstanceStart (ou resume) ate o guest comecar o handler
+    handler    handler rodando ate o marcador de fim
+    parse      leitura do resultado (vsock ou console)
+    teardown   fim do processo, clones, sockets
+    total      relogio de parede da invocacao inteira
+
+Engines:
+    cold       cold start (boot completo, engine rootfs)
+    snapshot   restore do snapshot da funcao (artigo 04)
+    pool       VM pre-aquecida do pool (spawn e config fora do caminho)
+    initramfs  boot so com initrd, sem drive de bloco
+
+Para cada fase sai p50/p95/p99; com --json o relatorio vai para um
+arquivo e --compare compara com um relatorio anterior (regressoes).
+
+Com --fake nada disso precisa de KVM: o Firecracker e trocado pelo
+fake-firecracker.py, o kernel por um arquivo vazio e o rootfs por um
+ext4 pequeno. Boot e handler viram esperas fixas, mas clone, spawn,
+API, parse e limpeza sao o codigo de verdade.
+
+Uso:
+    sudo python3 bench-phases.py --fake --iterations 50 --json base.json
+    sudo python3 bench-phases.py --fake --iterations 50 --compare base.json
+
+    # Com o Firecracker de verdade (caminhos relativos ao artigo 02)
+    cd ../02-nano-lambda && sudo python3 ../04-snapshot/bench-phases.py
+
+Requer root (mount do rootfs/initrd, como o nano-lambda.py).
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Reaproveita o nano-Lambda (artigo 02)
+NANO_LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "02-nano-lambda")
+sys.path.insert(0, NANO_LAMBDA_DIR)
+from engine import percentile
+
+FAKE_FIRECRACKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake-firecracker.py")
+DEFAULT_FUNCTION = os.path.join(NANO_LAMBDA_DIR, "exemplo-qrcode", "handler.py")
+
+ENGINES = ["cold", "snapshot", "pool", "initramfs"]
+PHASES = ["clone", "prepare", "spawn", "config", "restore", "prefetch", "boot",
+          "handler", "parse", "teardown", "total"]
+PERCENTILES = (50, 95, 99)
+
+# Variacao de p50 abaixo disso nao conta como regressao (ruido)
+REGRESSION_PCT = 10.0
+REGRESSION_MIN_S = 0.001
+
+
+def load_nano_lambda():
+    """nano-lambda.py tem hifen no nome: carrega pelo caminho."""
+    spec = importlib.util.spec_from_file_location(
+        "nano_lambda", os.path.join(NANO_LAMBDA_DIR, "nano-lambda.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def setup_fake(nl, work_dir):
+    """Kernel vazio, ext4 pequeno e o fake-firecracker no lugar dos binarios."""
+    kernel = os.path.join(work_dir, "vmlinux.bin")
+    with open(kernel, "wb") as f:
+        f.write(b"\0" * 4096)
+
+    tree = os.path.join(work_dir, "rootfs-tree")
+    os.makedirs(os.path.join(tree, "functions"))
+    rootfs = os.path.join(work_dir, "rootfs.ext4")
+    subprocess.run(["mkfs.ext4", "-q", "-F", "-d", tree, rootfs, "32M"],
+                   check=True, capture_output=True)
+
+    nl.FIRECRACKER_BIN = FAKE_FIRECRACKER
+    nl.KERNEL_PATH = kernel
+    nl.ROOTFS_TEMPLATE = rootfs
+
+
+def make_runner(nl, engine, args):
+    """Runner com a mesma interface do NanoLambda (pool incluso)."""
+    options = dict(clone_backend=args.clone_backend, input_mode=args.input_mode,
+                   api_mode=args.api_mode, result_channel=args.result_channel,
+                   mem_backend=args.mem_backend)
+    if engine == "pool":
+        pool = nl.create_warm_pool(size=1, name="bench", **options)
+        pool.start()
+        return pool
+    store = nl.SnapshotStore(nl.SNAPSHOT_DIR)
+
+    class Factory:
+        def invoke(self, function_path, input_data):
+            return nl.NanoLambda(
+                invoke_mode="snapshot" if engine == "snapshot" else "boot",
+                engine="initramfs" if engine == "initramfs" else "rootfs",
+                snapshot_store=store, **options
+            ).invoke(function_path, input_data)
+
+        def close(self):
+            pass
+
+    return Factory()
+
+
+def wait_pool_ready(pool, timeout=30):
+    """Espera o pool repor a VM: cada iteracao mede um hit."""
+    deadline = time.time() + timeout
+    while pool.stats()["idle"] < pool.size and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def run_engine(nl, engine, args):
+    """Roda as iteracoes de uma engine. Retorna (timings por iteracao, falhas)."""
+    rows = []
+    failures = []
+    # A saida do NanoLambda (e do reabastecimento do pool) so com --verbose
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose \
+        else contextlib.nullcontext()
+    with quiet:
+        runner = make_runner(nl, engine, args)
+        try:
+            for i in range(args.warmup + args.iterations):
+                if engine == "pool":
+                    wait_pool_ready(runner)
+                start = time.time()
+                try:
+                    result = runner.invoke(args.function, args.input)
+                except Exception as e:
+                    failures.append(str(e))
+                    continue
+                elapsed = time.time() - start
+                if not result.get("success"):
+                    failures.append(result.get("error") or "resultado invalido")
+                    continue
+                if i < args.warmup:
+                    # Aquece caches (snapshot da funcao, initrd, page cache)
+                    continue
+                timings = dict(result.get("timings", {}))
+                timings["total"] = elapsed
+                rows.append(timings)
+                print(f"\r    {engine}: {len(rows)}/{args.iterations}",
+                      end="", flush=True, file=sys.stderr)
+        finally:
+            runner.close()
+    print(file=sys.stderr)
+    return rows, failures
+
+
+def summarize(rows):
+    """p50/p95/p99, media, min e max de cada fase presente."""
+    phases = {}
+    for phase in PHASES:
+        values = sorted(t[phase] for t in rows if phase in t)
+        if not values:
+            continue
+        stats = {f"p{pct}": percentile(values, pct) for pct in PERCENTILES}
+        stats.update({"mean": sum(values) / len(values), "min": values[0],
+                      "max": values[-1], "n": len(values)})
+        phases[phase] = stats
+    return phases
+
+
+def print_report(report):
+    for engine, data in report["engines"].items():
+        print(f"\n{engine} ({data['iterations']} iteracoes, {data['failures']} falhas)")
+        print(f"  {'fase':<10} {'p50':>9} {'p95':>9} {'p99':>9} {'media':>9}")
+        for phase, stats in data["phases"].items():
+            print(f"  {phase:<10} " + " ".join(
+                f"{stats[key] * 1000:>7.2f}ms" for key in ("p50", "p95", "p99", "mean")))
+        for error in data["errors"][:3]:
+            print(f"  [!] {error.splitlines()[0] if error else error}")
+
+
+def compare(report, baseline, threshold=REGRESSION_PCT):
+    """Compara o p50 de cada fase com o baseline. Retorna as regressoes."""
+    regressions = []
+    print(f"\nComparacao com {baseline['meta'].get('created', 'baseline')} (p50):")
+    for engine, data in report["engines"].items():
+        base_phases = baseline.get("engines", {}).get(engine, {}).get("phases", {})
+        for phase, stats in data["phases"].items():
+            if phase not in base_phases:
+                continue
+            old, new = base_phases[phase]["p50"], stats["p50"]
+            delta = new - old
+            pct = delta / old * 100 if old else 0.0
+            flag = ""
+            if pct > threshold and delta > REGRESSION_MIN_S:
+                flag = "  <-- regressao"
+                regressions.append((engine, phase, old, new))
+            print(f"  {engine:<10} {phase:<10} {old * 1000:>8.2f}ms -> "
+                  f"{new * 1000:>8.2f}ms ({pct:+6.1f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por fase do nano-Lambda")
+    parser.add_argument("--iterations", type=int, default=20,
+                        help="invocacoes medidas por engine")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="invocacoes descartadas no inicio (criam snapshot/initrd)")
+    parser.add_argument("--engines", default="cold,snapshot,pool",
+                        help=f"engines separadas por virgula ({', '.join(ENGINES)})")
+    parser.add_argument("--function", default=DEFAULT_FUNCTION, help="handler a invocar")
+    parser.add_argument("--input", default="nano-lambda bench", help="input do handler")
+    parser.add_argument("--fake", action="store_true",
+                        help="usa o fake-firecracker.py (sem KVM, mede so o lado do host)")
+    parser.add_argument("--firecracker", help="binario do Firecracker")
+    parser.add_argument("--kernel", help="kernel do guest")
+    parser.add_argument("--rootfs", help="rootfs template")
+    parser.add_argument("--clone-backend", default="auto")
+    parser.add_argument("--input-mode", default="drive", choices=["mount", "drive"])
+    parser.add_argument("--api-mode", default="keepalive")
+    parser.add_argument("--result-channel", default="vsock", choices=["vsock", "console"])
+    parser.add_argument("--mem-backend", default="File", choices=["File", "Uffd"],
+                        help="memoria do restore na engine snapshot (Uffd: servidor de paginas)")
+    parser.add_argument("--json", metavar="ARQUIVO", help="grava o relatorio em JSON")
+    parser.add_argument("--compare", metavar="ARQUIVO",
+                        help="compara com um relatorio JSON anterior")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_PCT,
+                        help="aumento de p50 (%%) considerado regressao")
+    parser.add_argument("--verbose", action="store_true", help="mostra a saida das invocacoes")
+    args = parser.parse_args()
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"engine desconhecida: {engine}")
+
+    nl = load_nano_lambda()
+    work_dir = tempfile.mkdtemp(prefix="nano-lambda-bench-")
+    try:
+        # Snapshots e initrds do benchmark nao se misturam com os de uso normal
+        nl.SNAPSHOT_DIR = os.path.join(work_dir, "snapshots")
+        nl.INITRD_CACHE_DIR = os.path.join(work_dir, "initrd-cache")
+        if args.fake:
+            setup_fake(nl, work_dir)
+        if args.firecracker:
+            nl.FIRECRACKER_BIN = args.firecracker
+        if args.kernel:
+            nl.KERNEL_PATH = args.kernel
+        if args.rootfs:
+            nl.ROOTFS_TEMPLATE = args.rootfs
+
+        report = {
+            "meta": {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "host": platform.node(),
+                "kernel": platform.release(),
+                "python": platform.python_version(),
+                "fake": args.fake,
+                "iterations": args.iterations,
+                "warmup": args.warmup,
+                "function": os.path.abspath(args.function),
+                "clone_backend": args.clone_backend,
+                "input_mode": args.input_mode,
+                "api_mode": args.api_mode,
+                "result_channel": args.result_channel,
+                "mem_backend": args.mem_backend,
+            },
+            "engines": {},
+        }
+
+        print("=" * 60)
+        print(f"Benchmark por fase{' (fake-firecracker)' if args.fake else ''}")
+        print("=" * 60)
+        for engine in engines:
+            rows, failures = run_engine(nl, engine, args)
+            report["engines"][engine] = {
+                "iterations": len(rows),
+                "failures": len(failures),
+                "errors": failures[:10],
+                "phases": summarize(rows),
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRelatorio salvo em: {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n[!] {len(regressions)} fase(s) com regressao acima de {args.threshold:g}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -60,6 +60,11 @@ $CONTAINER_CMD run --rm --privileged -v $MOUNT_POINT:/rootfs alpine:3.21 sh -c '
     # Usa chroot para criar symlinks com paths corretos
     chroot /rootfs /bin/busybox --install -s /bin
     chroot /rootfs /bin/busybox --install -s /sbin
+
+    # Pre-compila o stdlib e o sklearn (.pyc com hash nao verificado): o
+    # import deixa de compilar e de comparar mtimes no boot
+    chroot /rootfs python3 -m compileall -q -f --invalidation-mode unchecked-hash \
+        /usr/lib/python3* || [ $? -eq 1 ]
 '
 
 echo "[*] Criando estrutura de diretorios..."
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+fake-firecracker.py - Substituto do Firecracker para medir o lado do host
+
+Fala o mesmo protocolo que o nano-Lambda usa (API REST no socket Unix,
+--config-file, console no stdout, resultado por vsock) mas sem KVM:
+o "guest" e uma thread que espera alguns milissegundos e imprime os
+mesmos marcadores do rootfs de verdade.
+
+Serve para medir as fases do host (clone do rootfs, spawn, chamadas de
+API, parse do resultado, limpeza) em qualquer maquina, inclusive em CI.
+Boot e handler sao simulados: os numeros dessas fases so dizem quanto
+o host demora para perceber o que o guest fez.
+
+Uso (o bench-phases.py --fake ja faz isso):
+    FAKE_FC_BOOT_MS=20 ./fake-firecracker.py --api-sock /tmp/fc.socket
+
+Variaveis de ambiente:
+    FAKE_FC_BOOT_MS       boot simulado ate o handler comecar (padrao 20)
+    FAKE_FC_HANDLER_MS    execucao simulada do handler (padrao 5)
+    FAKE_FC_RESULT_BYTES  tamanho do resultado devolvido (padrao 4096)
+    FAKE_FC_DIRTY_PAGES   paginas sujas por execucao do handler, gravadas
+                          num snapshot Diff (padrao 256)
+    FAKE_FC_SHARED_MIB    MiB do inicio da memoria com conteudo igual em
+                          toda VM (kernel, interpretador), para medir a
+                          deduplicacao do page store (padrao 32)
+    FAKE_FC_TOUCH_MIB     memoria lida pelo guest a cada execucao depois de
+                          um restore, sempre as mesmas paginas (padrao 16);
+                          com o backend Uffd cada pagina vira um fault
+                          servido pelo uffd_server.py
+    FAKE_FC_GUEST_USED_MIB  memoria que o guest diz usar nas estatisticas
+                          do balao (padrao 48)
+"""
+
+import base64
+import ctypes
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+BOOT_MS = float(os.environ.get("FAKE_FC_BOOT_MS", "20"))
+HANDLER_MS = float(os.environ.get("FAKE_FC_HANDLER_MS", "5"))
+RESULT_BYTES = int(os.environ.get("FAKE_FC_RESULT_BYTES", "4096"))
+DIRTY_PAGES = int(os.environ.get("FAKE_FC_DIRTY_PAGES", "256"))
+SHARED_MIB = int(os.environ.get("FAKE_FC_SHARED_MIB", "32"))
+TOUCH_MIB = int(os.environ.get("FAKE_FC_TOUCH_MIB", "16"))
+GUEST_USED_MIB = int(os.environ.get("FAKE_FC_GUEST_USED_MIB", "48"))
+PAGE_SIZE = 4096
+
+# Mesmos valores do guest/nanolambda.py e do rootfs do artigo 02
+RESULT_PORT = 10000
+KIND_IMAGE = 2
+HEADER = struct.Struct(">BQ")
+SNAPSHOT_BOOT_ARG = "nano_lambda.mode=snapshot"
+EXEC_MARKER = "=== nano-Lambda executando... ==="
+READY_MARKER = "NANO_LAMBDA_READY"
+DONE_MARKER = "=== Execucao finalizada (exit: 0) ==="
+
+# linux/userfaultfd.h (x86_64): o Firecracker cria o uffd e registra a memoria
+SYS_USERFAULTFD = 323
+UFFD_API = 0xAA
+UFFDIO_API = 0xC018AA3F        # _IOWR(0xAA, 0x3F, struct uffdio_api)
+UFFDIO_REGISTER = 0xC020AA00   # _IOWR(0xAA, 0x00, struct uffdio_register)
+UFFDIO_REGISTER_MODE_MISSING = 1
+
+_REASONS = {200: "OK", 204: "No Content", 400: "Bad Request"}
+
+
+class ApiError(Exception):
+    pass
+
+
+class FakeVm:
+    """Estado da VM: o que a API configurou e o "guest" simulado."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.boot_source = None
+        self.drives = {}
+        self.machine_config = None
+        self.vsock = None
+        self.balloon = None
+        self.started = False
+        self.paused = False
+        self.restored = False
+        self.track_dirty_pages = False
+        self.dirty = set()    # paginas escritas pelo guest desde o load
+        self.memory = None    # memoria do guest restaurado (mmap)
+        self.uffd = None
+
+    def apply_config(self, config):
+        """Equivalente ao --config-file."""
+        self.boot_source = config["boot-source"]
+        for drive in config.get("drives", []):
+            self.drives[drive["drive_id"]] = drive
+        self.machine_config = config.get("machine-config")
+        self.vsock = config.get("vsock")
+        self.balloon = config.get("balloon")
+
+    def handle(self, method, path, body):
+        with self.lock:
+            if method == "GET" and path == "/":
+                return 200, {"id": "fake-firecracker", "state": self._state()}
+            if method == "GET" and path == "/balloon/statistics":
+                return 200, self._balloon_stats()
+            if method == "PUT" and path == "/boot-source":
+                self._before_boot()
+                self.boot_source = body
+            elif method in ("PUT", "PATCH") and path.startswith("/drives/"):
+                drive_id = path[len("/drives/"):]
+                if method == "PUT":
+                    self._before_boot()
+                    self.drives[drive_id] = body
+                elif drive_id not in self.drives:
+                    raise ApiError(f"drive {drive_id} nao existe")
+                else:
+                    self.drives[drive_id].update(body)
+            elif method == "PUT" and path == "/machine-config":
+                self._before_boot()
+                self.machine_config = body
+                self.track_dirty_pages = body.get("track_dirty_pages", False)
+            elif method == "PUT" and path == "/vsock":
+                self._before_boot()
+                self.vsock = body
+            elif method == "PUT" and path == "/balloon":
+                self._before_boot()
+                self.balloon = body
+            elif method == "PATCH" and path == "/balloon":
+                if self.balloon is None:
+                    raise ApiError("balloon nao configurado")
+                self.balloon["amount_mib"] = body["amount_mib"]
+            elif method == "PUT" and path.startswith("/network-interfaces/"):
+                self._before_boot()
+            elif method == "PUT" and path == "/actions":
+                if body.get("action_type") != "InstanceStart":
+                    raise ApiError(f"acao nao suportada: {body.get('action_type')}")
+                self.start()
+            elif method == "PATCH" and path == "/vm":
+                self._set_state(body.get("state"))
+            elif method == "PUT" and path == "/snapshot/create":
+                self._snapshot_create(body)
+            elif method == "PUT" and path == "/snapshot/load":
+                self._snapshot_load(body)
+            else:
+                raise ApiError(f"requisicao invalida: {method} {path}")
+            return 204, None
+
+    def _state(self):
+        if not self.started:
+            return "Not started"
+        return "Paused" if self.paused else "Running"
+
+    def _before_boot(self):
+        if self.started or self.restored:
+            raise ApiError("operacao nao permitida depois do boot")
+
+    def start(self):
+        self._before_boot()
+        if self.boot_source is None:
+            raise ApiError("boot-source nao configurado")
+        self.started = True
+        snapshot = SNAPSHOT_BOOT_ARG in self.boot_source.get("boot_args", "")
+        threading.Thread(target=self._guest_boot, args=(snapshot,), daemon=True).start()
+
+    def _set_state(self, state):
+        if state == "Paused":
+            if not self.started:
+                raise ApiError("VM nao iniciada")
+            self.paused = True
+        elif state == "Resumed":
+            if not self.started:
+                raise ApiError("VM nao iniciada")
+            was_paused, self.paused = self.paused, False
+            if was_paused and self.restored:
+                threading.Thread(target=self._guest_resume, daemon=True).start()
+        else:
+            raise ApiError(f"estado invalido: {state}")
+
+    def _balloon_stats(self):
+        """Estatisticas do balao; o guest entrega as paginas na hora."""
+        if not (self.balloon and self.balloon.get("stats_polling_interval_s")):
+            raise ApiError("estatisticas do balloon desligadas")
+        mib = 1024 * 1024
+        amount = self.balloon["amount_mib"]
+        total = self._mem_size()
+        # Com deflate_on_oom as paginas do balao contam como usadas
+        used = (GUEST_USED_MIB + amount) * mib
+        return {"target_pages": amount * 256, "actual_pages": amount * 256,
+                "target_mib": amount, "actual_mib": amount,
+                "total_memory": total, "available_memory": max(0, total - used),
+                "free_memory": max(0, total - used), "disk_caches": 0}
+
+    def _mem_size(self):
+        return (self.machine_config or {}).get("mem_size_mib", 128) * 1024 * 1024
+
+    def _snapshot_create(self, body):
+        if not self.paused:
+            raise ApiError("a VM precisa estar pausada")
+        snapshot_type = body.get("snapshot_type", "Full")
+        if snapshot_type == "Diff" and not self.track_dirty_pages:
+            raise ApiError("snapshot Diff exige dirty page tracking")
+        state = {"boot_source": self.boot_source, "drives": self.drives,
+                 "machine_config": self.machine_config, "vsock": self.vsock}
+        with open(body["snapshot_path"], "w") as f:
+            json.dump(state, f)
+
+        size = self._mem_size()
+        with open(body["mem_file_path"], "wb") as f:
+            if snapshot_type == "Diff":
+                # So as paginas sujas, nos seus offsets (arquivo esparso)
+                f.truncate(size)
+                page = os.urandom(PAGE_SIZE)
+                for index in sorted(self.dirty):
+                    f.seek(index * PAGE_SIZE)
+                    f.write(page)
+            else:
+                # Full: a memoria inteira vai para o disco; o inicio e
+                # igual em toda VM e as paginas sujas sao desta VM
+                chunk = b"\0" * (1024 * 1024)
+                shared = min(SHARED_MIB * len(chunk), size)
+                for offset in range(0, shared, PAGE_SIZE):
+                    f.write(shared_page(offset // PAGE_SIZE))
+                for _ in range((size - shared) // len(chunk)):
+                    f.write(chunk)
+                for index in sorted(self.dirty):
+                    f.seek(index * PAGE_SIZE)
+                    f.write(os.urandom(PAGE_SIZE))
+        self.dirty.clear()
+
+    def _snapshot_load(self, body):
+        self._before_boot()
+        if self.boot_source is not None:
+            raise ApiError("snapshot/load exige uma VM nao configurada")
+        backend = body.get("mem_backend", {})
+        mem_file = backend.get("backend_path", body.get("mem_file_path"))
+        # Com Uffd o backend_path e o socket do servidor de paginas
+        for path in (body["snapshot_path"], mem_file):
+            if not path or not os.path.exists(path):
+                raise ApiError(f"arquivo do snapshot nao encontrado: {path}")
+        with open(body["snapshot_path"]) as f:
+            state = json.load(f)
+        for drive in state["drives"].values():
+            if not os.path.exists(drive["path_on_host"]):
+                raise ApiError(f"drive nao encontrado: {drive['path_on_host']}")
+        self.boot_source = state["boot_source"]
+        self.drives = state["drives"]
+        self.machine_config = state["machine_config"]
+        self.vsock = state["vsock"]
+        if backend.get("backend_type") == "Uffd":
+            self._connect_uffd(mem_file)
+        else:
+            with open(mem_file, "rb") as f:
+                self.memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.started = self.restored = True
+        self.track_dirty_pages = body.get("enable_diff_snapshots",
+                                          body.get("track_dirty_pages", False))
+        self.dirty.clear()
+        self.paused = not body.get("resume_vm", False)
+        if not self.paused:
+            threading.Thread(target=self._guest_resume, daemon=True).start()
+
+    def _connect_uffd(self, socket_path):
+        """Como o Firecracker: memoria anonima registrada num userfaultfd."""
+        size = self._mem_size()
+        self.memory = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+        buf = ctypes.c_char.from_buffer(self.memory)
+        base = ctypes.addressof(buf)
+        del buf
+        libc = ctypes.CDLL(None, use_errno=True)
+        uffd = libc.syscall(SYS_USERFAULTFD, os.O_CLOEXEC | os.O_NONBLOCK)
+        if uffd < 0:
+            raise ApiError(f"userfaultfd: {os.strerror(ctypes.get_errno())}")
+        self.uffd = uffd
+        fcntl.ioctl(uffd, UFFDIO_API, bytearray(struct.pack("QQQ", UFFD_API, 0, 0)))
+        fcntl.ioctl(uffd, UFFDIO_REGISTER, bytearray(
+            struct.pack("QQQQ", base, size, UFFDIO_REGISTER_MODE_MISSING, 0)))
+        regions = [{"base_host_virt_addr": base, "size": size, "offset": 0,
+                    "page_size": PAGE_SIZE}]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except OSError as e:
+                raise ApiError(f"servidor de paginas: {e}")
+            socket.send_fds(sock, [json.dumps(regions).encode()], [uffd])
+
+    def _touch_memory(self):
+        """Le o working set do guest (sempre as mesmas paginas)."""
+        pages = self._mem_size() // PAGE_SIZE
+        count = min(TOUCH_MIB * 1024 * 1024 // PAGE_SIZE, pages)
+        for index in random.Random(pages).sample(range(pages), count):
+            self.memory[index * PAGE_SIZE]
+
+    # Guest simulado
+
+    def _guest_boot(self, snapshot):
+        console("[    0.000000] Linux version fake (fake-firecracker)")
+        time.sleep(BOOT_MS / 1000)
+        self._touch_pages()
+        if snapshot:
+            # Espera o host pausar e tirar o snapshot; o processo morre antes
+            console(READY_MARKER)
+            return
+        self._guest_run()
+
+    def _guest_resume(self):
+        # Como o snapshot-runner.py: cada linha no console roda o handler,
+        # que depois volta a esperar no READY
+        while sys.stdin.readline():
+            self._guest_run()
+            console(READY_MARKER)
+
+    def _touch_pages(self):
+        pages = self._mem_size() // PAGE_SIZE
+        with self.lock:
+            self.dirty.update(random.randrange(pages) for _ in range(DIRTY_PAGES))
+
+    def _guest_run(self):
+        console("")
+        console(EXEC_MARKER)
+        if self.memory is not None:
+            self._touch_memory()
+        time.sleep(HANDLER_MS / 1000)
+        self._touch_pages()
+        payload = os.urandom(RESULT_BYTES)
+        if not (self.vsock and not self.restored and send_vsock(self.vsock, payload)):
+            send_console(payload)
+        console("")
+        console(DONE_MARKER)
+        if not self.restored:
+            # reboot=k panic=1: o Firecracker sai quando o guest desliga
+            os._exit(0)
+
+
+def shared_page(index):
+    """Conteudo deterministico da pagina `index` da regiao compartilhada."""
+    return hashlib.sha256(index.to_bytes(8, "little")).digest() * (PAGE_SIZE // 32)
+
+
+def console(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def send_vsock(vsock, payload):
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(f"{vsock['uds_path']}_{RESULT_PORT}")
+            sock.sendall(HEADER.pack(KIND_IMAGE, len(payload)))
+            sock.sendall(payload)
+            return bool(sock.recv(1))
+        finally:
+            sock.close()
+    except OSError:
+        return False
+
+
+def send_console(payload):
+    encoded = base64.b64encode(payload).decode("ascii")
+    lines = [encoded[i:i + 76] for i in range(0, len(encoded), 76)]
+    console("\n".join(["BASE64_IMAGE_START"] + lines + ["BASE64_IMAGE_END"]))
+
+
+def respond(conn, status, body):
+    data = json.dumps(body).encode() if body is not None else b""
+    head = f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+    if data:
+        head += "Content-Type: application/json\r\n"
+    head += f"Content-Length: {len(data)}\r\n\r\n"
+    conn.sendall(head.encode() + data)
+
+
+def serve_connection(vm, conn):
+    """Le requisicoes HTTP/1.1 da conexao (keep-alive e pipeline)."""
+    buf = b""
+    with conn:
+        while True:
+            while b"\r\n\r\n" not in buf:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                buf += data
+            head, buf = buf.split(b"\r\n\r\n", 1)
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = lines[0].split(" ", 2)
+            length = 0
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            while len(buf) < length:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                buf += data
+            raw, buf = buf[:length], buf[length:]
+            try:
+                body = json.loads(raw) if raw else {}
+                status, reply = vm.handle(method, path, body)
+            except (ApiError, ValueError, KeyError) as e:
+                status, reply = 400, {"fault_message": str(e)}
+            respond(conn, status, reply)
+
+
+def main():
+    args = sys.argv[1:]
+    if "--api-sock" not in args:
+        print("uso: fake-firecracker.py --api-sock <socket> [--config-file <json>]",
+              file=sys.stderr)
+        sys.exit(2)
+    sock_path = args[args.index("--api-sock") + 1]
+
+    vm = FakeVm()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    server.listen()
+
+    if "--config-file" in args:
+        with open(args[args.index("--config-file") + 1]) as f:
+            vm.apply_config(json.load(f))
+        vm.start()
+
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=serve_connection, args=(vm, conn), daemon=True).start()
+
+
+if __name__ == "__main__":
+    main()
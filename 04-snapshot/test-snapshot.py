@@ -6,6 +6,9 @@ Mede tempos de:
 1. Cold start (boot completo + carga sklearn)
 2. Criar snapshot
 3. Restore do snapshot
+4. Snapshot Diff (so paginas sujas) x Full, e o merge do Diff na base
+5. Restore com backend Uffd (servidor de paginas do 02), gravando o
+   working set e depois com prefetch dele
 
 Uso:
     sudo python3 test-snapshot.py
@@ -21,18 +24,33 @@ import subprocess
 import requests_unixsocket
 import time
 import shutil
-import tempfile
 import os
 import sys
 
+# Reaproveita a camada de clonagem de rootfs do nano-Lambda (artigo 02)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "02-nano-lambda"))
+from rootfs_clone import clone_rootfs, overlay_file, sparse_copy_file
+from snapshot_store import allocated_bytes
+from uffd_server import PageServer
+from vm_wait import wait_for_socket
+
 # Configuracoes
 FIRECRACKER_BIN = "./firecracker"
 KERNEL_PATH = "./vmlinux.bin"
 ROOTFS_TEMPLATE = "./rootfs-sklearn.ext4"
+ROOTFS_CLONE_BACKEND = "auto"  # auto, reflink, sparse ou dm-snapshot
 SOCKET_PATH = "/tmp/fc-snapshot-test.socket"
 SNAPSHOT_PATH = "/tmp/fc-snapshot"
 MEM_FILE = "/tmp/fc-snapshot/vm_mem"
 SNAPSHOT_FILE = "/tmp/fc-snapshot/vm_state"
+DIFF_MEM_FILE = "/tmp/fc-snapshot/vm_mem-1.diff"
+DIFF_SNAPSHOT_FILE = "/tmp/fc-snapshot/vm_state-1"
+MERGED_MEM_FILE = "/tmp/fc-snapshot/vm_mem-merged"
+UFFD_SOCKET = "/tmp/fc-snapshot-uffd.socket"
+WORKING_SET_FILE = "/tmp/fc-snapshot/working_set.bin"
+UFFD_RUN_SECONDS = 1
+# Tempo rodando depois do restore antes do snapshot Diff
+DIFF_RUN_SECONDS = 2
 VCPU_COUNT = 1
 MEM_SIZE_MIB = 512
 
@@ -130,10 +148,8 @@ def wait_for_ready(log_file, timeout=60):
 
 
 def prepare_rootfs_for_snapshot():
-    """Copia rootfs para uso temporario (init.sh ja incluso no rootfs)."""
-    temp_rootfs = tempfile.NamedTemporaryFile(suffix=".ext4", delete=False).name
-    shutil.copy(ROOTFS_TEMPLATE, temp_rootfs)
-    return temp_rootfs
+    """Clona rootfs para uso temporario (init.sh ja incluso no rootfs)."""
+    return clone_rootfs(ROOTFS_TEMPLATE, backend=ROOTFS_CLONE_BACKEND)
 
 
 def start_firecracker(log_file=None):
@@ -148,14 +164,8 @@ def start_firecracker(log_file=None):
         stderr=subprocess.STDOUT
     )
 
-    for _ in range(50):
-        if os.path.exists(SOCKET_PATH):
-            break
-        time.sleep(0.1)
-    else:
-        raise Exception("Timeout esperando socket")
-
-    time.sleep(0.2)
+    # Espera o socket aceitar conexoes (sem sleep fixo)
+    wait_for_socket(SOCKET_PATH).close()
     return proc
 
 
@@ -204,14 +214,15 @@ def main():
 
         rootfs = prepare_rootfs_for_snapshot()
         rootfs_time = time.time() - cold_start
-        print(f"    Rootfs preparado ({rootfs_time:.3f}s)")
+        print(f"    Rootfs preparado ({rootfs_time:.3f}s, clone via "
+              f"{rootfs.backend} em {rootfs.elapsed:.3f}s)")
 
         log_file = "/tmp/fc-boot.log"
         fc_proc = start_firecracker(log_file)
         fc_time = time.time() - cold_start
         print(f"    Firecracker iniciado ({fc_time:.3f}s)")
 
-        configure_vm(rootfs)
+        configure_vm(rootfs.path)
         config_time = time.time() - cold_start
         print(f"    VM configurada ({config_time:.3f}s)")
 
@@ -254,6 +265,7 @@ def main():
         print(f"    Snapshot criado ({snapshot_time:.3f}s)")
 
         # Tamanhos
+        full_bytes = allocated_bytes(MEM_FILE)
         mem_size = os.path.getsize(MEM_FILE) / (1024 * 1024)
         state_size = os.path.getsize(SNAPSHOT_FILE) / 1024
         print(f"    Memoria: {mem_size:.1f} MB | Estado: {state_size:.1f} KB")
@@ -284,13 +296,70 @@ def main():
                 "backend_type": "File",
                 "backend_path": MEM_FILE
             },
-            "enable_diff_snapshots": False,
+            # Dirty page tracking: permite o snapshot Diff da parte 4
+            "enable_diff_snapshots": True,
             "resume_vm": True
         })
 
         restore_time = time.time() - restore_start
         print(f"\n    >>> RESTORE TOTAL: {restore_time:.3f}s")
 
+        # PARTE 4: Snapshot Diff
+        print("\n[4] SNAPSHOT DIFF (paginas sujas desde o restore)")
+        print("-" * 40)
+
+        time.sleep(DIFF_RUN_SECONDS)
+        diff_start = time.time()
+        call_api("PATCH", "/vm", {"state": "Paused"})
+        call_api("PUT", "/snapshot/create", {
+            "snapshot_type": "Diff",
+            "snapshot_path": DIFF_SNAPSHOT_FILE,
+            "mem_file_path": DIFF_MEM_FILE
+        })
+        diff_time = time.time() - diff_start
+        diff_bytes = allocated_bytes(DIFF_MEM_FILE)
+        print(f"    Diff criado ({diff_time:.3f}s) | Gravado: "
+              f"{diff_bytes / (1024 * 1024):.1f} MB (Full: {full_bytes / (1024 * 1024):.1f} MB)")
+
+        # Merge: base + paginas do Diff = memoria para o proximo restore
+        merge_start = time.time()
+        sparse_copy_file(MEM_FILE, MERGED_MEM_FILE)
+        overlay_file(DIFF_MEM_FILE, MERGED_MEM_FILE)
+        merge_time = time.time() - merge_start
+        print(f"    Merge na base ({merge_time:.3f}s): {MERGED_MEM_FILE}")
+
+        fc_proc2.terminate()
+        fc_proc2.wait()
+        fc_proc2 = None
+
+        # PARTE 5: Restore lazy (Uffd)
+        print("\n[5] RESTORE UFFD (servidor de paginas + working set)")
+        print("-" * 40)
+
+        uffd_times = {}
+        for run in ("registro", "prefetch"):
+            restore_start = time.time()
+            fc_proc2 = start_firecracker()
+            server = PageServer(MEM_FILE, UFFD_SOCKET, WORKING_SET_FILE).start()
+            try:
+                call_api("PUT", "/snapshot/load", {
+                    "snapshot_path": SNAPSHOT_FILE,
+                    "mem_backend": {"backend_type": "Uffd", "backend_path": UFFD_SOCKET},
+                    "resume_vm": False
+                })
+                server.wait_prefetch()
+                call_api("PATCH", "/vm", {"state": "Resumed"})
+                uffd_times[run] = time.time() - restore_start
+                time.sleep(UFFD_RUN_SECONDS)
+            finally:
+                fc_proc2.terminate()
+                fc_proc2.wait()
+                fc_proc2 = None
+                stats = server.stop()
+            print(f"    {run}: restore {uffd_times[run]:.3f}s | "
+                  f"{stats['prefetched_pages']} paginas antecipadas, "
+                  f"{stats['faults']} faults em {UFFD_RUN_SECONDS}s")
+
         # RESUMO
         print("\n" + "=" * 60)
         print("RESULTADOS")
@@ -298,6 +367,10 @@ def main():
         print(f"  Cold Start:     {cold_time:.3f}s")
         print(f"  Criar Snapshot: {snapshot_time:.3f}s")
         print(f"  Restore:        {restore_time:.3f}s")
+        print(f"  Restore Uffd:   {uffd_times['registro']:.3f}s "
+              f"(com prefetch: {uffd_times['prefetch']:.3f}s)")
+        print(f"  Snapshot Diff:  {diff_time:.3f}s, {diff_bytes / (1024 * 1024):.1f} MB "
+              f"(Full: {snapshot_time:.3f}s, {full_bytes / (1024 * 1024):.1f} MB)")
         print()
         print(f"  Speedup:        {cold_time/restore_time:.1f}x mais rapido")
         print(f"  Economia:       {cold_time - restore_time:.3f}s por execucao")
@@ -305,8 +378,15 @@ def main():
 
         return {
             "cold_start": cold_time,
+            "rootfs_clone": rootfs.elapsed,
             "snapshot": snapshot_time,
             "restore": restore_time,
+            "diff_snapshot": diff_time,
+            "diff_bytes": diff_bytes,
+            "full_bytes": full_bytes,
+            "merge": merge_time,
+            "uffd_restore": uffd_times["registro"],
+            "uffd_restore_prefetch": uffd_times["prefetch"],
             "speedup": cold_time / restore_time
         }
 
@@ -324,9 +404,9 @@ def main():
                 fc_proc.wait(timeout=5)
             except Exception:
                 pass
-        if rootfs and os.path.exists(rootfs):
+        if rootfs:
             try:
-                os.remove(rootfs)
+                rootfs.release()
             except Exception:
                 pass
         if os.path.exists(SOCKET_PATH):